@@ -0,0 +1,105 @@
+# Memoria retenida por asset listado: registro actual (PhotoAsset con slots; URLs en el spool) frente al
+# anterior (dataclass con __dict__ y closure que retenía el asset de pyicloud completo).
+#
+#   PYTHONPATH=src python benchmarks/asset_memory.py [--assets 20000] [--max-bytes 512]
+#
+# Sale con código 1 si el registro actual supera --max-bytes por asset (regresión).
+from __future__ import annotations
+
+import argparse
+import gc
+import sys
+import tracemalloc
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Iterator
+
+from icloudsync.photos import ICloudPhotos
+
+_CREATED = datetime(2024, 1, 1)
+_URL = "https://cvws.icloud-content.com/B/" + "u" * 180  # longitud típica de una URL firmada
+
+
+class FakeAsset:
+    # Asset con la forma del de pyicloud: registros CloudKit (maestro y asset) y versiones
+    def __init__(self, i: int) -> None:
+        self.id = f"AXa{i:020d}"
+        self.filename = f"IMG_{i}.HEIC"
+        self.size = 3_000_000
+        self.created = _CREATED
+        master = ("resOriginalFingerprint", "resOriginalRes", "resJPEGMedRes", "resJPEGThumbRes", "filenameEnc", "itemType", "resOriginalWidth", "resOriginalHeight")
+        self._master_record = {"recordName": self.id, "fields": {k: {"value": "x" * 40, "type": "STRING"} for k in master}}
+        asset = ("assetDate", "addedDate", "orientation", "adjustmentType")
+        self._asset_record = {"recordName": "r" + self.id, "fields": {k: {"value": "y" * 30} for k in asset}, "modified": {"timestamp": 1}}
+
+    @property
+    def versions(self) -> dict:
+        return {"original": {"url": _URL + self.id, "filename": self.filename}}
+
+    def download(self, version: str = "original"):
+        raise NotImplementedError
+
+
+@dataclass
+class LegacyAsset:
+    # Registro anterior: __dict__ por instancia y un downloader que retiene el asset de pyicloud
+    id: str
+    created: datetime
+    filename: str
+    size: int | None
+    album: str | None
+    extension: str
+    downloader: Callable[..., Iterator[bytes]]
+    album_id: str | None = None
+    remote_version: str | None = None
+    edit: tuple[str, str] | None = None
+
+
+def _legacy(assets) -> Iterator[LegacyAsset]:
+    for asset in assets:
+        yield LegacyAsset(
+            id=asset.id,
+            created=asset.created,
+            filename=asset.filename,
+            size=asset.size,
+            album=None,
+            extension=asset.filename.rsplit(".", 1)[-1].lower(),
+            downloader=lambda version="original", a=asset: a.download(version),
+        )
+
+
+class _Api:
+    session = None
+
+
+def _retained(build: Callable[[Iterator[FakeAsset]], Iterator], n: int) -> float:
+    # Bytes por asset que siguen vivos tras listar n assets y conservar los registros
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    records = list(build(FakeAsset(i) for i in range(n)))
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert len(records) == n
+    return (after - before) / n
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--assets", type=int, default=20000)
+    parser.add_argument("--max-bytes", type=int, default=512, help="Tope por asset del registro actual")
+    args = parser.parse_args()
+
+    photos = ICloudPhotos(_Api())
+    current = _retained(lambda assets: photos._iter_album_assets(assets, None), args.assets)
+    legacy = _retained(_legacy, args.assets)
+    print(f"{args.assets} assets: anterior {legacy / 1024:.2f} KB/asset, actual {current / 1024:.2f} KB/asset ({legacy / current:.1f}x)")
+    if current > args.max_bytes:
+        print(f"Regresión: {current:.0f} B/asset > {args.max_bytes} B", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
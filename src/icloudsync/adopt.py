@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+import logging
+import os
+import re
+import shutil
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Iterable, Optional
+
+from .planner import PathPlanner
+from .state import AssetEntry, StateDB
+from .sync import _prune_empty_dirs, _state_key
+from .utils import ensure_dir
+
+log = logging.getLogger(__name__)
+
+
+# Sufijo que añade icloudpd a los duplicados de nombre: IMG_0001-123456.HEIC (123456 = tamaño)
+_SIZE_SUFFIX = re.compile(r"^(.*)-(\d+)(\.[^.]+)$")
+
+# Si no se conoce el tamaño, la fecha del fichero debe estar a menos de esto de la del asset
+DATE_TOLERANCE = 36 * 3600
+
+# Bytes del principio del fichero que se comparan con iCloud en --verify
+VERIFY_BYTES = 64 * 1024
+
+
+class _Index:
+    # Ficheros existentes por nombre (en minúsculas): [(ruta, tamaño, mtime)]
+    def __init__(self) -> None:
+        self.by_name: dict[str, list[tuple[str, int, float]]] = {}
+        self.claimed: set[str] = set()  # cada fichero se asigna a un único asset
+        self.files = 0
+
+    def add(self, path: str, size: int, mtime: float) -> None:
+        name = os.path.basename(path).lower()
+        self.by_name.setdefault(name, []).append((path, size, mtime))
+        m = _SIZE_SUFFIX.match(name)
+        if m and int(m.group(2)) == size:
+            self.by_name.setdefault(m.group(1) + m.group(3), []).append((path, size, mtime))
+        self.files += 1
+
+    def claim(self, names: Iterable[str], size: int | None, created: float) -> tuple[str, int] | None:
+        candidates = []
+        for name in names:
+            for path, fsize, mtime in self.by_name.get(name.lower(), ()):
+                if path in self.claimed:
+                    continue
+                if size is not None:
+                    if fsize == size:
+                        candidates.append((abs(mtime - created), path, fsize))
+                elif abs(mtime - created) < DATE_TOLERANCE:
+                    candidates.append((abs(mtime - created), path, fsize))
+        if not candidates:
+            return None
+        _, path, fsize = min(candidates)
+        self.claimed.add(path)
+        return path, fsize
+
+
+def scan_tree(root: str, concurrency: int = 16) -> _Index:
+    # Listado en paralelo: cada carpeta es un scandir independiente (en SMB, un round-trip)
+    index = _Index()
+
+    def _list(d: str) -> tuple[list[str], list[tuple[str, int, float]]]:
+        dirs, files = [], []
+        try:
+            with os.scandir(d) as it:
+                for e in it:
+                    if e.name.startswith("."):
+                        continue  # .icloudsync, .previews, .quarantine, temporales...
+                    if e.is_dir(follow_symlinks=False):
+                        dirs.append(e.path)
+                    elif e.is_file(follow_symlinks=False):
+                        st = e.stat(follow_symlinks=False)
+                        files.append((e.path, st.st_size, st.st_mtime))
+        except OSError as e:
+            log.warning("No se pudo listar %s: %s", d, e)
+        return dirs, files
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as ex:
+        pending = {ex.submit(_list, root)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                dirs, files = fut.result()
+                for f in files:
+                    index.add(*f)
+                pending |= {ex.submit(_list, d) for d in dirs}
+    return index
+
+
+def _head_matches(asset, path: str) -> bool:
+    # Compara el principio del fichero local con el de iCloud (descarga sólo el primer bloque)
+    remote = b""
+    chunks = asset.downloader("original")
+    try:
+        for chunk in chunks:
+            remote += chunk
+            if len(remote) >= VERIFY_BYTES:
+                break
+    finally:
+        close = getattr(chunks, "close", None)
+        if close:
+            close()
+    with open(path, "rb") as f:
+        local = f.read(VERIFY_BYTES)
+    return remote[:VERIFY_BYTES] == local
+
+
+def _adopt_one(asset, path: str, target: str, root: str, move: bool, verify: bool, dry_run: bool) -> str:
+    if verify and not _head_matches(asset, path):
+        return "mismatch"
+    if not move or path == target:
+        return "adopted"
+    if dry_run:
+        log.info("DRY-RUN: movería %s → %s", path, target)
+        return "moved"
+    ensure_dir(os.path.dirname(target))
+    try:
+        os.replace(path, target)
+    except OSError:
+        shutil.move(path, target)  # otro sistema de ficheros
+    _prune_empty_dirs(os.path.dirname(path), root)
+    return "moved"
+
+
+def adopt_tree(
+    *,
+    assets: Iterable,
+    root: str,
+    out_base: str,
+    folder_template: str,
+    state: StateDB,
+    move: bool = True,
+    verify: bool = False,
+    concurrency: int = 8,
+    dry_run: bool = False,
+    index: Optional[_Index] = None,
+) -> dict:
+    # Registra en el estado los ficheros ya descargados (p.ej. por icloudpd) que corresponden
+    # a assets de iCloud, moviéndolos a la plantilla configurada si hace falta
+    planner = PathPlanner(folder_template)
+    state.load()
+    scope = os.path.abspath(out_base)
+    if index is None:
+        index = scan_tree(root, concurrency * 2)
+        log.info("%d ficheros existentes en %s", index.files, root)
+    counts = {"adopted": 0, "moved": 0, "current": 0, "mismatch": 0, "unmatched": 0, "errors": 0}
+    pending: dict = {}
+
+    def _finish(fut) -> None:
+        asset, key, path, size, target = pending.pop(fut)
+        try:
+            outcome = fut.result()
+        except Exception as e:
+            log.warning("No se pudo adoptar %s (%s): %s", path, key, e)
+            counts["errors"] += 1
+            return
+        counts[outcome] += 1
+        if outcome == "mismatch" or dry_run:
+            return
+        final = target if outcome == "moved" else path
+        state.upsert(AssetEntry(
+            asset_id=key,
+            path=final,
+            size=size,
+            scope=scope,
+            remote_version=getattr(asset, "remote_version", None),
+            created=asset.created.timestamp(),
+            album=asset.album,
+        ))
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as ex:
+        for asset in assets:
+            key = _state_key(asset)
+            target = planner.target(asset, out_base)
+            if state.is_current(key, target, asset.size, getattr(asset, "remote_version", None)):
+                counts["current"] += 1
+                continue
+            # Nombre original (icloudpd) o el que ya genera esta herramienta
+            found = index.claim((asset.filename, os.path.basename(target)), asset.size, asset.created.timestamp())
+            if found is None:
+                counts["unmatched"] += 1
+                continue
+            path, size = found
+            fut = ex.submit(_adopt_one, asset, path, target, root, move, verify, dry_run)
+            pending[fut] = (asset, key, path, size, target)
+            if len(pending) >= max(1, concurrency) * 4:
+                done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                for f in done:
+                    _finish(f)
+        while pending:
+            done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+            for f in done:
+                _finish(f)
+
+    if not dry_run:
+        state.save()
+    return counts
@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import errno
+import time
+from email.utils import parsedate_to_datetime
+
+
+# Clases de error: las sistémicas afectan a todo lo que queda por descargar
+AUTH = "auth"
+THROTTLED = "throttled"
+NETWORK = "network"
+DISK = "disk"
+ASSET = "asset"
+
+# Fallos sistémicos consecutivos (sin ningún éxito entre medias) que abren el circuito
+THRESHOLDS = {AUTH: 2, DISK: 1, NETWORK: 8, THROTTLED: 6}
+
+# Códigos de salida del CLI cuando el circuito se abre
+EXIT_CODES = {AUTH: 10, THROTTLED: 11, NETWORK: 12, DISK: 13}
+
+# Respuestas HTTP con las que iCloud indica que se le está pidiendo demasiado
+THROTTLE_STATUS = (429, 503)
+
+_AUTH_EXC_NAMES = {
+    "PyiCloudFailedLoginException",
+    "PyiCloud2SARequiredException",
+    "PyiCloudNoStoredPasswordAvailableException",
+}
+_NETWORK_EXC_NAMES = {"ConnectionError", "ConnectTimeout", "ReadTimeout", "Timeout", "ChunkedEncodingError"}
+
+
+def status_of(exc: BaseException) -> int | None:
+    resp = getattr(exc, "response", None)
+    status = getattr(resp, "status_code", None) or getattr(exc, "code", None)
+    try:
+        return int(status) if status is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_after_of(resp) -> float | None:
+    # Cabecera Retry-After en segundos o como fecha HTTP
+    headers = getattr(resp, "headers", None) or {}
+    value = headers.get("Retry-After") if hasattr(headers, "get") else None
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_after(exc: BaseException) -> float | None:
+    return retry_after_of(getattr(exc, "response", None))
+
+
+def classify_error(exc: BaseException) -> str:
+    if isinstance(exc, OSError) and exc.errno in (errno.ENOSPC, errno.EDQUOT):
+        return DISK
+    if type(exc).__name__ in _AUTH_EXC_NAMES:
+        return AUTH
+    status = status_of(exc)
+    if status in (401, 403, 421):
+        return AUTH
+    if status in THROTTLE_STATUS:
+        return THROTTLED
+    names = {t.__name__ for t in type(exc).__mro__}
+    if names & _NETWORK_EXC_NAMES or isinstance(exc, (ConnectionError, TimeoutError)):
+        return NETWORK
+    return ASSET
+
+
+class CircuitOpen(Exception):
+    def __init__(self, kind: str, cause: BaseException) -> None:
+        super().__init__(f"Sincronización detenida ({kind}): {cause}")
+        self.kind = kind
+        self.cause = cause
+
+    @property
+    def exit_code(self) -> int:
+        return EXIT_CODES.get(self.kind, 1)
+
+
+class CircuitBreaker:
+    # Sólo se usa desde el hilo que procesa resultados; no necesita locks
+    def __init__(self, thresholds: dict[str, int] | None = None) -> None:
+        self.thresholds = thresholds or THRESHOLDS
+        self.streak: dict[str, int] = {}
+        self.tripped: CircuitOpen | None = None
+        self.paused_until = 0.0
+
+    def success(self) -> None:
+        self.streak.clear()
+
+    def failure(self, exc: BaseException) -> str:
+        kind = classify_error(exc)
+        if kind == ASSET:
+            return kind
+        n = self.streak[kind] = self.streak.get(kind, 0) + 1
+        if kind == THROTTLED:
+            # Pausa global: nadie lanza descargas nuevas hasta que pase
+            self.paused_until = max(self.paused_until, time.monotonic() + (retry_after(exc) or 30.0 * n))
+        if n >= self.thresholds.get(kind, 1) and self.tripped is None:
+            self.tripped = CircuitOpen(kind, exc)
+        return kind
+
+    def pause_remaining(self) -> float:
+        return max(0.0, self.paused_until - time.monotonic())
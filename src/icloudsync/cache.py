@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Iterator
+
+from .utils import atomic_write, ensure_dir
+
+log = logging.getLogger(__name__)
+
+
+# Caché en disco de listados de iCloud (álbumes y assets por álbum) bajo
+# /cookies/.icloudsync/cache. Política de frescura:
+#  - edad < ttl: se sirve sin tocar la API
+#  - edad < max_age: se sirve si el marcador del álbum (nº de assets) no ha cambiado
+#  - si no: se vuelve a paginar el álbum y se reescribe
+class MetadataCache:
+    def __init__(self, root: str, ttl: float = 900, max_age: float = 6 * 3600) -> None:
+        self.root = root
+        self.ttl = ttl
+        self.max_age = max(ttl, max_age)
+        self._index_path = os.path.join(root, "index.json")
+        self._index: dict[str, dict[str, Any]] | None = None
+        self._lock = threading.Lock()
+
+    def _load_index(self) -> dict[str, dict[str, Any]]:
+        if self._index is None:
+            try:
+                with open(self._index_path, "r", encoding="utf-8") as f:
+                    self._index = json.load(f)
+            except (OSError, ValueError):
+                self._index = {}
+        return self._index
+
+    def _save_index(self) -> None:
+        with atomic_write(self._index_path) as (_, tmp):
+            tmp.write(json.dumps(self._index).encode("utf-8"))
+
+    def _meta(self, key: str) -> dict[str, Any] | None:
+        with self._lock:
+            return self._load_index().get(key)
+
+    def _update(self, key: str, **meta: Any) -> None:
+        with self._lock:
+            index = self._load_index()
+            index[key] = {**index.get(key, {}), **meta}
+            self._save_index()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, "assets", hashlib.sha1(key.encode("utf-8")).hexdigest() + ".jsonl")
+
+    def is_fresh(self, key: str) -> bool:
+        meta = self._meta(key)
+        return bool(meta) and time.time() - meta.get("checked_at", 0) < self.ttl
+
+    # Listas de álbumes: [(nombre, clave)]
+    def get_albums(self, kind: str) -> list[tuple[str, str]] | None:
+        key = f"albums:{kind}"
+        if not self.is_fresh(key):
+            return None
+        return [tuple(a) for a in self._meta(key).get("albums", [])]
+
+    def put_albums(self, kind: str, albums: list[tuple[str, str]]) -> None:
+        self._update(f"albums:{kind}", checked_at=time.time(), albums=[list(a) for a in albums])
+
+    # Listados de assets por álbum (JSON lines, una fila por asset)
+    def rows(self, key: str, marker: Any = None, check_marker: bool = False) -> Iterator[list] | None:
+        meta = self._meta(key)
+        if not meta or not os.path.exists(self._path(key)):
+            return None
+        now = time.time()
+        if now - meta.get("checked_at", 0) >= self.ttl:
+            if not check_marker or marker is None or meta.get("marker") != marker:
+                return None
+            if now - meta.get("listed_at", 0) >= self.max_age:
+                return None
+            self._update(key, checked_at=now)
+        return self._read(key)
+
+    def listings(self) -> Iterator[tuple[str, float, Iterator[list]]]:
+        # Todos los listados guardados, frescos o no: (clave, instante del listado, filas)
+        with self._lock:
+            index = dict(self._load_index())
+        for key, meta in index.items():
+            if key.startswith("albums:") or not os.path.exists(self._path(key)):
+                continue
+            yield key, meta.get("listed_at", 0), self._read(key)
+
+    def album_names(self) -> dict[str, str]:
+        with self._lock:
+            index = dict(self._load_index())
+        return {k: name for key, meta in index.items() if key.startswith("albums:") for name, k in meta.get("albums", [])}
+
+    def _read(self, key: str) -> Iterator[list]:
+        with open(self._path(key), "r", encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+
+    @contextlib.contextmanager
+    def writer(self, key: str, marker: Any) -> Iterator[Callable[[list | None], None]]:
+        # Sólo se publica si el listado se completa (atomic_write descarta el temporal si no).
+        # put(None) marca el listado como no cacheable (assets sin URL de descarga).
+        path = self._path(key)
+        ensure_dir(os.path.dirname(path))
+        usable = [True]
+
+        def put(row: list | None) -> None:
+            if row is None:
+                usable[0] = False
+            elif usable[0]:
+                tmp.write((json.dumps(row, separators=(",", ":")) + "\n").encode("utf-8"))
+
+        with atomic_write(path + ".part") as (_, tmp):
+            yield put
+        if not usable[0]:
+            with contextlib.suppress(OSError):
+                os.remove(path + ".part")
+            return
+        os.replace(path + ".part", path)
+        now = time.time()
+        self._update(key, checked_at=now, listed_at=now, marker=marker)
+
+
+def to_row(asset, urls: tuple[tuple[str, str], ...]) -> list | None:
+    # urls: las de las versiones pedidas (el registro sólo guarda su posición en el spool)
+    if not urls:
+        return None
+    return [
+        asset.id,
+        asset.created.isoformat(),
+        asset.filename,
+        asset.size,
+        asset.extension,
+        asset.remote_version,
+        list(asset.edit) if asset.edit else None,
+        [list(u) for u in urls],
+        asset.media,
+    ]
+
+
+def from_row(row: list) -> dict[str, Any]:
+    asset_id, created, filename, size, ext, remote_version, edit, urls = row[:8]
+    media = row[8] if len(row) > 8 else None  # filas anteriores a --media: sin tipo
+    if remote_version and remote_version.count(":") == 2:
+        remote_version = remote_version.split(":", 1)[0]  # huella combinada antigua: la del original
+    return {
+        "id": asset_id,
+        "created": datetime.fromisoformat(created),
+        "filename": filename,
+        "size": size,
+        "extension": ext,
+        "remote_version": remote_version,
+        "edit": tuple(edit) if edit and len(edit) == 4 else None,
+        "urls": tuple(tuple(u) for u in urls),
+        "media": media,
+    }
@@ -1,8 +1,13 @@
 from __future__ import annotations
 
+import json
 import logging
 import os
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import replace
+from datetime import datetime, timedelta
 from typing import Optional
 
 import typer
@@ -11,8 +16,19 @@ from .config import Config
 from .logging_setup import setup_logging
 from .auth import login_interactive, ensure_noninteractive_session, AuthError
 from .state import StateDB
-from .photos import ICloudPhotos, PyiCloudService
-from .sync import sync_assets
+from .photos import ICloudPhotos, PyiCloudService, EDIT_VERSIONS, MEDIA, AssetFilter
+from .cache import MetadataCache
+from .adopt import adopt_tree
+from .mtimes import fix_mtimes as _fix_mtimes
+from .postprocess import TASKS as POSTPROCESS_TASKS
+from .progress import MODES as PROGRESS_MODES
+from .plan import PlanWriter, human_bytes, read_plan
+from .stats import collect as collect_stats
+from .storage import Storage, storage_for
+from .planner import PathPlanner
+from .sync import sync_assets, parse_shard, VERSIONS, EDIT_MODES, ORDERS
+from .breaker import CircuitOpen
+from .throttle import TokenBucket
 
 
 app = typer.Typer(help="Sincroniza iCloud Photos (fototeca y compartidos)")
@@ -28,17 +44,90 @@ def _get_api(apple_id: str, cookies_dir: str):
     return PyiCloudService(apple_id, password=None, cookie_directory=cookies_dir)
 
 
+def _make_cache(cfg: Config) -> Optional[MetadataCache]:
+    # Listados de álbumes/assets cacheados en disco junto al estado (CACHE_TTL=0 lo desactiva)
+    if cfg.cache_ttl <= 0:
+        return None
+    return MetadataCache(os.path.join(cfg.cookies_dir, ".icloudsync", "cache"), cfg.cache_ttl, cfg.cache_max_age)
+
+
+# Límite de peticiones de metadatos: uno por proceso, compartido por todas las cuentas (el
+# throttling de Apple es por IP)
+_metadata_limits: dict[float, TokenBucket] = {}
+_limits_lock = threading.Lock()
+
+
+def _metadata_limit_of(cfg: Config) -> Optional[TokenBucket]:
+    if not cfg.metadata_rate:
+        return None
+    with _limits_lock:
+        if cfg.metadata_rate not in _metadata_limits:
+            _metadata_limits[cfg.metadata_rate] = TokenBucket(cfg.metadata_rate)
+        return _metadata_limits[cfg.metadata_rate]
+
+
+# BANDWIDTH_LIMIT: un único cubo por proceso, compartido por todos los comandos y cuentas
+_bandwidth_limits: dict[float, TokenBucket] = {}
+
+
+def _bandwidth_of(cfg: Config) -> Optional[TokenBucket]:
+    if not cfg.bandwidth_limit:
+        return None
+    with _limits_lock:
+        if cfg.bandwidth_limit not in _bandwidth_limits:
+            _bandwidth_limits[cfg.bandwidth_limit] = TokenBucket(cfg.bandwidth_limit * 1024 * 1024)
+        return _bandwidth_limits[cfg.bandwidth_limit]
+
+
+def _make_photos(cfg: Config, versions: tuple[str, ...] = ("original",)) -> ICloudPhotos:
+    cache = _make_cache(cfg)
+    return ICloudPhotos(
+        _get_api(cfg.apple_id, cfg.cookies_dir),
+        versions=versions,
+        cache=cache,
+        filters=_filters_of(cfg),
+        metadata_limit=_metadata_limit_of(cfg),
+    )
+
+
+def _when(value: str, name: str, end: bool = False) -> float:
+    try:
+        dt = datetime.fromisoformat(value)
+    except ValueError:
+        typer.echo(f"{name} inválido '{value}': usa una fecha ISO (2024-01-01 o 2024-01-01T12:00)")
+        raise typer.Exit(code=1)
+    if end and len(value) == 10:
+        dt += timedelta(days=1)  # fecha sin hora: el día entero queda incluido
+    return dt.timestamp()
+
+
+def _filters_of(cfg: Config) -> Optional[AssetFilter]:
+    # --since/--until/--media; sin fechas con zona se interpretan en hora local (TZ)
+    if cfg.media is not None and cfg.media not in MEDIA:
+        typer.echo(f"MEDIA inválido '{cfg.media}': usa {' | '.join(MEDIA)}")
+        raise typer.Exit(code=1)
+    if not (cfg.since or cfg.until or cfg.media):
+        return None
+    return AssetFilter(
+        since=_when(cfg.since, "SINCE") if cfg.since else None,
+        until=_when(cfg.until, "UNTIL", end=True) if cfg.until else None,
+        media=cfg.media,
+    )
+
+
 @app.callback()
 def main_callback(
     ctx: typer.Context,
     yaml: Optional[str] = typer.Option(None, "--config", help="Ruta a YAML de configuración"),
     log_level: str = typer.Option("INFO", help="Nivel de log (DEBUG, INFO, WARN, ERROR)"),
     no_log_file: bool = typer.Option(False, help="No escribir a fichero de log"),
+    log_format: Optional[str] = typer.Option(None, "--log-format", help="text | json"),
 ):
     ctx.obj = {
         "yaml": yaml,
         "log_level": log_level,
         "no_log_file": no_log_file,
+        "log_format": log_format,
     }
 
 
@@ -64,8 +153,9 @@ def list_albums(
     apple_id: Optional[str] = typer.Option(None, "--apple-id", envvar="APPLE_ID"),
     cookies: str = typer.Option("/cookies", "--cookies"),
     shared_only: bool = typer.Option(False, "--shared-only", help="Sólo álbumes compartidos"),
+    refresh: bool = typer.Option(False, "--refresh", help="Ignorar el caché de listados"),
 ):
-    cfg = Config.merge(yaml_path=None, cli={"APPLE_ID": apple_id})
+    cfg = Config.merge(yaml_path=None, cli={"APPLE_ID": apple_id, "COOKIES_DIR": cookies})
     setup_logging("INFO", None)
     if not cfg.apple_id:
         typer.echo("Debe proporcionar --apple-id o APPLE_ID.")
@@ -75,29 +165,182 @@ def list_albums(
     except AuthError as e:
         typer.echo(str(e))
         raise typer.Exit(code=2)
-    api = _get_api(cfg.apple_id, cookies)
-    photos = ICloudPhotos(api)
+    photos = _make_photos(cfg)
 
-    if shared_only:
-        albums = photos.list_shared_albums()
-        for name, _ in albums:
-            print(f"[Compartido] {name}")
-    else:
+    if not shared_only:
         # List regular albums (best effort)
         try:
-            for name in api.photos.albums.keys():  # type: ignore[attr-defined]
+            for name, _ in photos.album_index("normal", refresh=refresh):
                 print(name)
         except Exception:
             print("No se pudo enumerar álbumes normales.")
-        albums = photos.list_shared_albums()
-        for name, _ in albums:
-            print(f"[Compartido] {name}")
+    for name, _ in photos.album_index("shared", refresh=refresh):
+        print(f"[Compartido] {name}")
+
+
+def _shard_of(cfg: Config) -> tuple[int, int] | None:
+    if cfg.shard_by not in ("id", "month"):
+        typer.echo(f"--shard-by inválido '{cfg.shard_by}': usa id | month")
+        raise typer.Exit(code=1)
+    try:
+        return parse_shard(cfg.shard)
+    except ValueError as e:
+        typer.echo(str(e))
+        raise typer.Exit(code=1)
+
+
+def _run_sync(**kwargs) -> dict:
+    # Circuito abierto (sesión caducada, disco lleno...): el estado ya está guardado
+    plan = kwargs.get("plan")
+    try:
+        res = sync_assets(**kwargs)
+    except CircuitOpen as e:
+        typer.echo(str(e))
+        raise typer.Exit(code=e.exit_code)
+    finally:
+        if plan is not None:
+            plan.fh.close()
+    if plan is not None:
+        copies = f"; {plan.copies} copias locales a MIRRORS ({human_bytes(plan.copy_bytes)})" if plan.copies else ""
+        logging.info(f"Plan {plan.source}: {plan.files} ficheros, {human_bytes(plan.bytes)} a descargar (+{plan.unknown_size} de tamaño desconocido){copies}")
+    return res
+
+
+def _plan_writer(ctx: typer.Context, path: Optional[str], source: str, cfg: Config, out_base: str, template: str) -> Optional[PlanWriter]:
+    # `sync` vacía el fichero una vez y cada subcomando añade su sección
+    if not path:
+        return None
+    mode = "a" if ctx.obj and ctx.obj.get("plan_append") else "w"
+    return PlanWriter(
+        open(path, mode, encoding="utf-8"),
+        source,
+        out_base=out_base,
+        folder_template=template,
+        versions=list(_versions_of(cfg)),
+        edits=_edits_of(cfg),
+        previews_dir=cfg.previews_dir,
+    )
+
+
+def _check_templates(*templates: str) -> None:
+    # Plantillas inválidas abortan antes de autenticar o listar nada
+    for template in templates:
+        try:
+            PathPlanner(template)
+        except ValueError as e:
+            typer.echo(str(e))
+            raise typer.Exit(code=1)
+
+
+def _sync_options(cfg: Config, partial: bool = False) -> dict:
+    # Parámetros de sync_assets comunes a todos los comandos sync.
+    # partial: el listado está filtrado (--include/--exclude), así que no se puede reconciliar
+    filtered = cfg.since or cfg.until or cfg.media
+    complete = not (partial or cfg.recent or cfg.shard or filtered)
+    reconcile = cfg.reconcile and complete
+    if cfg.reconcile and not reconcile:
+        logging.warning("--reconcile ignorado: requiere un listado completo (sin --recent/--include/--exclude/--shard/--since/--until/--media)")
+    return {
+        "concurrency": cfg.concurrency,
+        "dry_run": cfg.dry_run,
+        "umask": cfg.umask,
+        "chown": cfg.chown,
+        "shard": _shard_of(cfg),
+        "shard_by": cfg.shard_by,
+        "versions": _versions_of(cfg),
+        "previews_dir": cfg.previews_dir,
+        "preview_concurrency": cfg.preview_concurrency,
+        "reconcile": reconcile,
+        "quarantine_dir": cfg.quarantine_dir,
+        "edits": _edits_of(cfg),
+        "retry_max": cfg.retry_max,
+        "retry_backoff": cfg.retry_backoff,
+        "postprocess": _postprocess_of(cfg),
+        "postprocess_workers": cfg.postprocess_workers,
+        "derived_dir": cfg.derived_dir,
+        "thumb_size": cfg.thumb_size,
+        "progress": _progress_of(cfg),
+        "progress_interval": cfg.progress_interval,
+        "order": _order_of(cfg),
+        "lookahead": cfg.lookahead,
+        "full_listing": complete,
+        "gc_runs": cfg.state_gc_runs,
+        "min_free": int(cfg.min_free_gb * 1024**3),
+        "bandwidth": _bandwidth_of(cfg),
+    }
+
+
+def _mirrors_of(cfg: Config, out_base: str) -> tuple[str, ...]:
+    # Cada destino de MIRRORS replica OUT_MAIN: /data/Compartidos → <mirror>/Compartidos
+    rel = os.path.relpath(os.path.abspath(out_base), os.path.abspath(cfg.out_main))
+    if rel.startswith(".."):
+        rel = os.path.basename(os.path.normpath(out_base))
+    mirrors = tuple(os.path.normpath(os.path.join(m.strip(), rel)) for m in cfg.mirrors.split(",") if m.strip())
+    if os.path.abspath(out_base) in {os.path.abspath(m) for m in mirrors}:
+        typer.echo(f"MIRRORS no puede incluir el destino principal ({out_base})")
+        raise typer.Exit(code=1)
+    return mirrors
+
+
+def _storage_of(cfg: Config, out_base: str) -> Storage:
+    # Destino local o s3://bucket/prefijo (MinIO con S3_ENDPOINT_URL)
+    try:
+        return storage_for(out_base, cfg.s3_endpoint_url, cfg.s3_part_size * 1024 * 1024)
+    except RuntimeError as e:
+        typer.echo(str(e))
+        raise typer.Exit(code=1)
+
+
+def _order_of(cfg: Config) -> str:
+    if cfg.order not in ORDERS:
+        typer.echo(f"ORDER inválido '{cfg.order}': usa {' | '.join(ORDERS)}")
+        raise typer.Exit(code=1)
+    return cfg.order
+
+
+def _progress_of(cfg: Config) -> str:
+    if cfg.progress not in PROGRESS_MODES:
+        typer.echo(f"PROGRESS inválido '{cfg.progress}': usa {' | '.join(PROGRESS_MODES)}")
+        raise typer.Exit(code=1)
+    return cfg.progress
+
+
+def _postprocess_of(cfg: Config) -> tuple[str, ...]:
+    tasks = tuple(t.strip().lower() for t in cfg.postprocess.split(",") if t.strip())
+    bad = [t for t in tasks if t not in POSTPROCESS_TASKS]
+    if bad:
+        typer.echo(f"POSTPROCESS inválido '{cfg.postprocess}': usa una lista de {', '.join(POSTPROCESS_TASKS)}")
+        raise typer.Exit(code=1)
+    return tasks
+
+
+def _icloud_versions(cfg: Config) -> tuple[str, ...]:
+    # Versiones cuyas URLs debe conservar cada PhotoAsset
+    versions = _versions_of(cfg)
+    return versions + EDIT_VERSIONS if _edits_of(cfg) != "original" else versions
+
+
+def _edits_of(cfg: Config) -> str:
+    if cfg.edits not in EDIT_MODES:
+        typer.echo(f"--edits inválido '{cfg.edits}': usa {' | '.join(EDIT_MODES)}")
+        raise typer.Exit(code=1)
+    return cfg.edits
+
+
+def _versions_of(cfg: Config) -> tuple[str, ...]:
+    versions = tuple(v.strip().lower() for v in cfg.versions.split(",") if v.strip())
+    bad = [v for v in versions if v not in VERSIONS]
+    if bad or not versions:
+        typer.echo(f"--versions inválido '{cfg.versions}': usa una lista de {', '.join(VERSIONS)}")
+        raise typer.Exit(code=1)
+    return versions
 
 
 def _merge_common(ctx: typer.Context, cli_overrides: dict) -> Config:
     yaml_path = ctx.obj.get("yaml") if ctx.obj else None
-    cfg = Config.merge(yaml_path=yaml_path, cli=cli_overrides)
-    setup_logging(cfg.log_level, None if cfg.no_log_file else cfg.log_file)
+    log_format = ctx.obj.get("log_format") if ctx.obj else None
+    cfg = Config.merge(yaml_path=yaml_path, cli={"LOG_FORMAT": log_format, **cli_overrides})
+    setup_logging(cfg.log_level, None if cfg.no_log_file else cfg.log_file, cfg.log_format, cfg.log_rate_limit)
     return cfg
 
 
@@ -111,6 +354,15 @@ def sync_library(
     folder_template: str = typer.Option("{:%Y/%m}", "--folder-template", help="Plantilla de carpetas"),
     dry_run: bool = typer.Option(False, "--dry-run", help="No escribir, sólo listar"),
     chown: Optional[str] = typer.Option(None, "--chown", help="UID:GID para fijar propietario"),
+    shard: Optional[str] = typer.Option(None, "--shard", help="Procesar sólo la porción i/N (workers en paralelo)"),
+    shard_by: Optional[str] = typer.Option(None, "--shard-by", help="Criterio de reparto: id | month"),
+    versions: Optional[str] = typer.Option(None, "--versions", help="Versiones a descargar: thumb,medium,original"),
+    reconcile: bool = typer.Option(False, "--reconcile", help="Mover renombrados y poner en cuarentena lo borrado en iCloud"),
+    edits: Optional[str] = typer.Option(None, "--edits", help="Fotos editadas: original | edited | both"),
+    plan: Optional[str] = typer.Option(None, "--plan", help="Escribir el plan (JSON lines) en este fichero sin descargar"),
+    since: Optional[str] = typer.Option(None, "--since", help="Sólo assets creados desde esta fecha (2024-01-01)"),
+    until: Optional[str] = typer.Option(None, "--until", help="Sólo assets creados hasta esta fecha (incluida)"),
+    media: Optional[str] = typer.Option(None, "--media", help="photo | video | live"),
 ):
     cfg = _merge_common(ctx, {
         "OUT_MAIN": out,
@@ -120,8 +372,17 @@ def sync_library(
         "FOLDER_TEMPLATE_LIBRARY": folder_template,
         "DRY_RUN": dry_run,
         "CHOWN": chown,
+        "SHARD": shard,
+        "SHARD_BY": shard_by,
+        "VERSIONS": versions,
+        "RECONCILE": reconcile or None,
+        "EDITS": edits,
+        "SINCE": since,
+        "UNTIL": until,
+        "MEDIA": media,
     })
 
+    _check_templates(cfg.folder_template_library)
     if not cfg.apple_id:
         typer.echo("Debe proporcionar --apple-id/APPLE_ID via config/env.")
         raise typer.Exit(code=1)
@@ -131,18 +392,17 @@ def sync_library(
         typer.echo(str(e))
         raise typer.Exit(code=2)
 
-    api = _get_api(cfg.apple_id, cfg.cookies_dir)
-    photos = ICloudPhotos(api)
+    photos = _make_photos(cfg, _icloud_versions(cfg))
     state = StateDB(_make_state_path(cfg.cookies_dir))
-    res = sync_assets(
+    res = _run_sync(
         assets=photos.iter_library(cfg.recent),
         out_base=cfg.out_main,
         folder_template=cfg.folder_template_library,
         state=state,
-        concurrency=cfg.concurrency,
-        dry_run=cfg.dry_run,
-        umask=cfg.umask,
-        chown=cfg.chown,
+        **_sync_options(cfg),
+        mirrors=_mirrors_of(cfg, cfg.out_main),
+        storage=_storage_of(cfg, cfg.out_main),
+        plan=_plan_writer(ctx, plan, "library", cfg, cfg.out_main, cfg.folder_template_library),
     )
     logging.info(f"sync library -> {res}")
 
@@ -158,6 +418,15 @@ def sync_shared(
     exclude: Optional[str] = typer.Option(None, "--exclude", help="Regex de exclusión"),
     dry_run: bool = typer.Option(False, "--dry-run"),
     chown: Optional[str] = typer.Option(None, "--chown"),
+    shard: Optional[str] = typer.Option(None, "--shard", help="Procesar sólo la porción i/N"),
+    shard_by: Optional[str] = typer.Option(None, "--shard-by", help="id | month"),
+    versions: Optional[str] = typer.Option(None, "--versions", help="thumb,medium,original"),
+    reconcile: bool = typer.Option(False, "--reconcile", help="Cuarentena de lo borrado en iCloud"),
+    edits: Optional[str] = typer.Option(None, "--edits", help="original | edited | both"),
+    plan: Optional[str] = typer.Option(None, "--plan", help="Escribir el plan en este fichero sin descargar"),
+    since: Optional[str] = typer.Option(None, "--since", help="Sólo assets creados desde esta fecha (2024-01-01)"),
+    until: Optional[str] = typer.Option(None, "--until", help="Sólo assets creados hasta esta fecha (incluida)"),
+    media: Optional[str] = typer.Option(None, "--media", help="photo | video | live"),
 ):
     cfg = _merge_common(ctx, {
         "OUT_SHARED": out,
@@ -166,7 +435,16 @@ def sync_shared(
         "FOLDER_TEMPLATE_SHARED": folder_template,
         "DRY_RUN": dry_run,
         "CHOWN": chown,
+        "SHARD": shard,
+        "SHARD_BY": shard_by,
+        "VERSIONS": versions,
+        "RECONCILE": reconcile or None,
+        "EDITS": edits,
+        "SINCE": since,
+        "UNTIL": until,
+        "MEDIA": media,
     })
+    _check_templates(cfg.folder_template_shared)
     if not cfg.apple_id:
         typer.echo("Debe proporcionar --apple-id/APPLE_ID via config/env.")
         raise typer.Exit(code=1)
@@ -176,19 +454,18 @@ def sync_shared(
         typer.echo(str(e))
         raise typer.Exit(code=2)
 
-    api = _get_api(cfg.apple_id, cfg.cookies_dir)
-    photos = ICloudPhotos(api)
+    photos = _make_photos(cfg, _icloud_versions(cfg))
     state = StateDB(_make_state_path(cfg.cookies_dir))
     assets = photos.iter_shared(cfg.recent, include=include, exclude=exclude)
-    res = sync_assets(
+    res = _run_sync(
         assets=assets,
         out_base=cfg.out_shared,
         folder_template=cfg.folder_template_shared,
         state=state,
-        concurrency=cfg.concurrency,
-        dry_run=cfg.dry_run,
-        umask=cfg.umask,
-        chown=cfg.chown,
+        **_sync_options(cfg, partial=bool(include or exclude)),
+        mirrors=_mirrors_of(cfg, cfg.out_shared),
+        storage=_storage_of(cfg, cfg.out_shared),
+        plan=_plan_writer(ctx, plan, "shared", cfg, cfg.out_shared, cfg.folder_template_shared),
     )
     logging.info(f"sync shared -> {res}")
 
@@ -204,6 +481,15 @@ def sync_albums(
     exclude: Optional[str] = typer.Option(None, "--exclude", help="Regex de exclusión"),
     dry_run: bool = typer.Option(False, "--dry-run"),
     chown: Optional[str] = typer.Option(None, "--chown"),
+    shard: Optional[str] = typer.Option(None, "--shard", help="Procesar sólo la porción i/N"),
+    shard_by: Optional[str] = typer.Option(None, "--shard-by", help="id | month"),
+    versions: Optional[str] = typer.Option(None, "--versions", help="thumb,medium,original"),
+    reconcile: bool = typer.Option(False, "--reconcile", help="Cuarentena de lo borrado en iCloud"),
+    edits: Optional[str] = typer.Option(None, "--edits", help="original | edited | both"),
+    plan: Optional[str] = typer.Option(None, "--plan", help="Escribir el plan en este fichero sin descargar"),
+    since: Optional[str] = typer.Option(None, "--since", help="Sólo assets creados desde esta fecha (2024-01-01)"),
+    until: Optional[str] = typer.Option(None, "--until", help="Sólo assets creados hasta esta fecha (incluida)"),
+    media: Optional[str] = typer.Option(None, "--media", help="photo | video | live"),
 ):
     cfg = _merge_common(ctx, {
         "OUT_SHARED": out,  # reuse path field for this target
@@ -212,7 +498,16 @@ def sync_albums(
         "FOLDER_TEMPLATE_SHARED": folder_template,
         "DRY_RUN": dry_run,
         "CHOWN": chown,
+        "SHARD": shard,
+        "SHARD_BY": shard_by,
+        "VERSIONS": versions,
+        "RECONCILE": reconcile or None,
+        "EDITS": edits,
+        "SINCE": since,
+        "UNTIL": until,
+        "MEDIA": media,
     })
+    _check_templates(cfg.folder_template_shared)
     if not cfg.apple_id:
         typer.echo("Debe proporcionar --apple-id/APPLE_ID via config/env.")
         raise typer.Exit(code=1)
@@ -222,19 +517,18 @@ def sync_albums(
         typer.echo(str(e))
         raise typer.Exit(code=2)
 
-    api = _get_api(cfg.apple_id, cfg.cookies_dir)
-    photos = ICloudPhotos(api)
+    photos = _make_photos(cfg, _icloud_versions(cfg))
     state = StateDB(_make_state_path(cfg.cookies_dir))
     assets = photos.iter_normal_albums(cfg.recent, include=include, exclude=exclude)
-    res = sync_assets(
+    res = _run_sync(
         assets=assets,
         out_base=cfg.out_shared,
         folder_template=cfg.folder_template_shared,
         state=state,
-        concurrency=cfg.concurrency,
-        dry_run=cfg.dry_run,
-        umask=cfg.umask,
-        chown=cfg.chown,
+        **_sync_options(cfg, partial=bool(include or exclude)),
+        mirrors=_mirrors_of(cfg, cfg.out_shared),
+        storage=_storage_of(cfg, cfg.out_shared),
+        plan=_plan_writer(ctx, plan, "albums", cfg, cfg.out_shared, cfg.folder_template_shared),
     )
     logging.info(f"sync albums -> {res}")
 
@@ -250,7 +544,47 @@ def sync_all(
     concurrency: int = typer.Option(4, "--concurrency"),
     dry_run: bool = typer.Option(False, "--dry-run"),
     chown: Optional[str] = typer.Option(None, "--chown"),
+    shard: Optional[str] = typer.Option(None, "--shard", help="Procesar sólo la porción i/N"),
+    shard_by: Optional[str] = typer.Option(None, "--shard-by", help="id | month"),
+    versions: Optional[str] = typer.Option(None, "--versions", help="thumb,medium,original"),
+    reconcile: bool = typer.Option(False, "--reconcile", help="Cuarentena de lo borrado en iCloud"),
+    edits: Optional[str] = typer.Option(None, "--edits", help="original | edited | both"),
+    plan: Optional[str] = typer.Option(None, "--plan", help="Escribir el plan en este fichero sin descargar"),
+    since: Optional[str] = typer.Option(None, "--since", help="Sólo assets creados desde esta fecha (2024-01-01)"),
+    until: Optional[str] = typer.Option(None, "--until", help="Sólo assets creados hasta esta fecha (incluida)"),
+    media: Optional[str] = typer.Option(None, "--media", help="photo | video | live"),
 ):
+    cfg = _merge_common(ctx, {
+        "OUT_MAIN": out,
+        "COOKIES_DIR": cookies,
+        "RECENT": recent,
+        "CONCURRENCY": concurrency,
+        "FOLDER_TEMPLATE_LIBRARY": folder_template,
+        "FOLDER_TEMPLATE_SHARED": shared_folder_template,
+        "DRY_RUN": dry_run,
+        "CHOWN": chown,
+        "SHARD": shard,
+        "SHARD_BY": shard_by,
+        "VERSIONS": versions,
+        "RECONCILE": reconcile or None,
+        "EDITS": edits,
+        "SINCE": since,
+        "UNTIL": until,
+        "MEDIA": media,
+    })
+    _sync_options(cfg)  # valida --shard/--versions antes de lanzar nada
+    _filters_of(cfg)
+    _check_templates(cfg.folder_template_library, cfg.folder_template_shared)
+    if cfg.accounts:
+        if plan:
+            typer.echo("--plan no está soportado con varias cuentas")
+            raise typer.Exit(code=1)
+        _accounts_of(cfg)  # valida 'accounts' antes de lanzar nada
+        raise typer.Exit(code=_sync_accounts(cfg))
+    if plan:
+        open(plan, "w").close()
+        ctx.obj = {**(ctx.obj or {}), "plan_append": True}
+
     # Reutiliza los comandos anteriores
     ctx2 = ctx
     ctx2.obj = ctx.obj
@@ -266,6 +600,15 @@ def sync_all(
         folder_template=folder_template,
         dry_run=dry_run,
         chown=chown,
+        shard=shard,
+        shard_by=shard_by,
+        versions=versions,
+        reconcile=reconcile,
+        edits=edits,
+        plan=plan,
+        since=since,
+        until=until,
+        media=media,
     )
     # shared dentro de /data/Compartidos
     shared_out = os.path.join(out, "Compartidos")
@@ -279,6 +622,15 @@ def sync_all(
         exclude=None,
         dry_run=dry_run,
         chown=chown,
+        shard=shard,
+        shard_by=shard_by,
+        versions=versions,
+        reconcile=reconcile,
+        edits=edits,
+        plan=plan,
+        since=since,
+        until=until,
+        media=media,
     )
 
     # álbumes no compartidos dentro de /data/Albums
@@ -293,7 +645,262 @@ def sync_all(
         exclude=None,
         dry_run=dry_run,
         chown=chown,
+        shard=shard,
+        shard_by=shard_by,
+        versions=versions,
+        reconcile=reconcile,
+        edits=edits,
+        plan=plan,
+        since=since,
+        until=until,
+        media=media,
+    )
+
+
+@app.command(help="Ejecuta un plan generado con --plan (sólo lo que contiene)")
+def apply(
+    ctx: typer.Context,
+    plan_path: str = typer.Argument(..., help="Fichero de plan (JSON lines)"),
+    cookies: str = typer.Option("/cookies", "--cookies"),
+    concurrency: int = typer.Option(4, "--concurrency"),
+    chown: Optional[str] = typer.Option(None, "--chown"),
+):
+    cfg = _merge_common(ctx, {"COOKIES_DIR": cookies, "CONCURRENCY": concurrency, "CHOWN": chown})
+    try:
+        sections = [(header, jobs) for header, jobs in read_plan(plan_path) if jobs]
+    except (OSError, ValueError, KeyError) as e:
+        typer.echo(f"No se pudo leer el plan: {e}")
+        raise typer.Exit(code=1)
+    if not cfg.apple_id:
+        typer.echo("Debe proporcionar --apple-id/APPLE_ID via config/env.")
+        raise typer.Exit(code=1)
+    try:
+        ensure_noninteractive_session(cfg.apple_id, cfg.cookies_dir)
+    except AuthError as e:
+        typer.echo(str(e))
+        raise typer.Exit(code=2)
+
+    state = StateDB(_make_state_path(cfg.cookies_dir))
+    for header, jobs in sections:
+        versions = tuple(header.get("versions") or ("original",))
+        edits = header.get("edits") or "original"
+        photos = _make_photos(cfg, versions + EDIT_VERSIONS if edits != "original" else versions)
+        listers = {"library": photos.iter_library, "shared": photos.iter_shared, "albums": photos.iter_normal_albums}
+        if header.get("source") not in listers:
+            logging.warning(f"Sección de plan desconocida '{header.get('source')}'; se omite")
+            continue
+        # Mismas opciones con las que se generó el plan; sin shards ni reconcile
+        options = {**_sync_options(replace(cfg, shard=None, reconcile=False)), "versions": versions, "edits": edits, "previews_dir": header.get("previews_dir")}
+        res = _run_sync(
+            assets=listers[header["source"]](),
+            out_base=header["out_base"],
+            folder_template=header["folder_template"],
+            state=state,
+            **options,
+            mirrors=_mirrors_of(cfg, header["out_base"]),
+            storage=_storage_of(cfg, header["out_base"]),
+            only=jobs,
+        )
+        logging.info(f"apply {header['source']} -> {res}")
+
+
+def _sync_account(cfg: Config, slots: threading.Semaphore, bandwidth: Optional[TokenBucket]) -> dict:
+    # Cuenta aislada: sesión, estado y rutas propias; sólo comparte slots y ancho de banda
+    ensure_noninteractive_session(cfg.apple_id, cfg.cookies_dir)
+    photos = _make_photos(cfg, _icloud_versions(cfg))
+    targets = (
+        ("library", photos.iter_library(cfg.recent), cfg.out_main, cfg.folder_template_library),
+        ("shared", photos.iter_shared(cfg.recent), cfg.out_shared, cfg.folder_template_shared),
+        ("albums", photos.iter_normal_albums(cfg.recent), os.path.join(cfg.out_main, "Albums"), cfg.folder_template_shared),
     )
+    results = {}
+    for name, assets, out_base, template in targets:
+        results[name] = sync_assets(
+            assets=assets,
+            out_base=out_base,
+            folder_template=template,
+            state=StateDB(_make_state_path(cfg.cookies_dir)),
+            **{**_sync_options(cfg), "bandwidth": bandwidth},
+            mirrors=_mirrors_of(cfg, out_base),
+            storage=_storage_of(cfg, out_base),
+            slots=slots,
+        )
+        logging.info(f"[{cfg.apple_id}] sync {name} -> {results[name]}")
+    return results
+
+
+def _accounts_of(cfg: Config) -> list[Config]:
+    try:
+        return [cfg.for_account(a) for a in cfg.accounts]
+    except ValueError as e:
+        typer.echo(f"Configuración inválida: {e}")
+        raise typer.Exit(code=1)
+
+
+def _sync_accounts(cfg: Config) -> int:
+    # Todas las cuentas en paralelo; CONCURRENCY y BANDWIDTH_LIMIT son presupuestos globales.
+    # threading.Semaphore despierta a los hilos en orden FIFO, así que el reparto es justo.
+    # Devuelve el código de salida: 0, el del circuito abierto o 2 si falla alguna cuenta.
+    accounts = _accounts_of(cfg)
+    # Varias barras a la vez en la misma terminal se pisan: progreso como líneas de log
+    accounts = [replace(a, progress="log") if a.progress in ("auto", "bar") else a for a in accounts]
+    slots = threading.Semaphore(max(1, cfg.concurrency))
+    bandwidth = _bandwidth_of(cfg)
+    code = 0
+    with ThreadPoolExecutor(max_workers=len(accounts)) as ex:
+        futures = {ex.submit(_sync_account, acc, slots, bandwidth): acc for acc in accounts}
+        for fut in as_completed(futures):
+            acc = futures[fut]
+            try:
+                fut.result()
+            except CircuitOpen as e:
+                logging.error(f"[{acc.apple_id}] {e}")
+                code = code or e.exit_code
+            except AuthError as e:
+                logging.error(f"[{acc.apple_id}] {e}")
+                code = code or 2
+            except Exception as e:
+                logging.error(f"[{acc.apple_id}] Error sincronizando cuenta: {e}")
+                code = code or 2
+    return code
+
+
+@app.command(help="Indexa un árbol ya descargado (p.ej. por icloudpd) sin volver a descargarlo")
+def adopt(
+    ctx: typer.Context,
+    source: str = typer.Option("library", "--source", help="library | shared | albums"),
+    existing: Optional[str] = typer.Option(None, "--from", help="Árbol existente (por defecto, el destino)"),
+    out: Optional[str] = typer.Option(None, "--out", help="Destino de la sincronización"),
+    cookies: str = typer.Option("/cookies", "--cookies"),
+    folder_template: Optional[str] = typer.Option(None, "--folder-template"),
+    move: bool = typer.Option(True, "--move/--no-move", help="Mover los ficheros a la plantilla configurada"),
+    verify: bool = typer.Option(False, "--verify", help="Comparar el principio de cada fichero con iCloud"),
+    concurrency: int = typer.Option(8, "--concurrency"),
+    dry_run: bool = typer.Option(False, "--dry-run"),
+):
+    if source not in ("library", "shared", "albums"):
+        typer.echo(f"--source inválido '{source}': usa library | shared | albums")
+        raise typer.Exit(code=1)
+    cfg = _merge_common(ctx, {"COOKIES_DIR": cookies, "DRY_RUN": dry_run})
+    if source == "library":
+        out_base = out or cfg.out_main
+        template = folder_template or cfg.folder_template_library
+    else:
+        out_base = out or (cfg.out_shared if source == "shared" else os.path.join(cfg.out_main, "Albums"))
+        template = folder_template or cfg.folder_template_shared
+    _check_templates(template)
+    if not cfg.apple_id:
+        typer.echo("Debe proporcionar --apple-id/APPLE_ID via config/env.")
+        raise typer.Exit(code=1)
+    try:
+        ensure_noninteractive_session(cfg.apple_id, cfg.cookies_dir)
+    except AuthError as e:
+        typer.echo(str(e))
+        raise typer.Exit(code=2)
+
+    photos = _make_photos(cfg)
+    listers = {"library": photos.iter_library, "shared": photos.iter_shared, "albums": photos.iter_normal_albums}
+    res = adopt_tree(
+        assets=listers[source](),
+        root=existing or out_base,
+        out_base=out_base,
+        folder_template=template,
+        state=StateDB(_make_state_path(cfg.cookies_dir)),
+        move=move,
+        verify=verify,
+        concurrency=concurrency,
+        dry_run=cfg.dry_run,
+    )
+    logging.info(f"adopt {source} -> {res}")
+
+
+@app.command(name="fix-mtimes", help="Ajusta el mtime de los ficheros a la fecha de la foto")
+def fix_mtimes(
+    ctx: typer.Context,
+    out: str = typer.Option("/data", "--out", help="Carpeta a revisar"),
+    cookies: str = typer.Option("/cookies", "--cookies"),
+    exif: bool = typer.Option(False, "--exif", help="Usar EXIF DateTimeOriginal si existe (lee cada fichero)"),
+    concurrency: int = typer.Option(16, "--concurrency", help="Hilos de stat/utime"),
+    dry_run: bool = typer.Option(False, "--dry-run", help="Sólo contar lo que se ajustaría"),
+):
+    cfg = _merge_common(ctx, {"COOKIES_DIR": cookies, "DRY_RUN": dry_run})
+    # Sin estado (p.ej. descargas de otra herramienta) se recorre el disco con scandir
+    state_path = _make_state_path(cfg.cookies_dir)
+    state = StateDB(state_path) if os.path.exists(state_path) else None
+    res = _fix_mtimes(out, state=state, timezone=cfg.timezone, exif=exif, concurrency=concurrency, dry_run=cfg.dry_run)
+    logging.info(f"fix-mtimes -> {res}")
+
+
+@app.command(help="Estadísticas de lo sincronizado (desde el estado, sin tocar disco ni iCloud)")
+def stats(
+    ctx: typer.Context,
+    cookies: str = typer.Option("/cookies", "--cookies"),
+    by: str = typer.Option("year", "--by", help="Agrupar por year | month"),
+    as_json: bool = typer.Option(False, "--json", help="Salida JSON"),
+):
+    cfg = _merge_common(ctx, {"COOKIES_DIR": cookies})
+    if by not in ("year", "month"):
+        typer.echo(f"--by inválido '{by}': usa year | month")
+        raise typer.Exit(code=1)
+    state_path = _make_state_path(cfg.cookies_dir)
+    if not os.path.exists(state_path):
+        typer.echo(f"No hay estado en {state_path}")
+        raise typer.Exit(code=1)
+    res = collect_stats(StateDB(state_path), _make_cache(cfg), by=by)
+    if as_json:
+        print(json.dumps(res, ensure_ascii=False, indent=2))
+        return
+
+    def _when(ts: float | None) -> str:
+        return datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M") if ts else "-"
+
+    totals = res["totals"]
+    print(f"Total: {totals['files']} ficheros, {human_bytes(totals['bytes'])} (+{totals['previews']} previews, {human_bytes(totals['previews_bytes'])})")
+    print("\nDestinos:")
+    for scope, row in res["scopes"].items():
+        run = res["runs"].get(scope) or {}
+        print(f"  {scope}: {row['files']} ficheros, {human_bytes(row['bytes'])}; última escritura {_when(row['last_write'])}, última ejecución {_when(run.get('finished_at'))}")
+    print("\nPor año:" if by == "year" else "\nPor mes:")
+    for period, row in res["periods"].items():
+        print(f"  {period}: {row['files']:>7} {human_bytes(row['bytes']):>10}")
+    print("\nPor álbum:")
+    for album, row in res["albums"].items():
+        print(f"  {album}: {row['files']} ficheros, {human_bytes(row['bytes'])}")
+    pending = res["pending"]
+    if pending is not None:
+        print(f"\nPendiente (listados de {_when(pending['listed_at'])}): {pending['files']} ficheros, {human_bytes(pending['bytes'])} (+{pending['unknown_size']} de tamaño desconocido)")
+    failures = res["failures"]
+    print(f"\nFallidos: {failures['count']} " + " ".join(f"{k}={v}" for k, v in failures["by_kind"].items()))
+    for key, f in failures["recent"].items():
+        print(f"  {_when(f.get('at'))} {key} ({f.get('kind')}, {f.get('count', 1)}x): {f.get('error')}")
+
+
+state_app = typer.Typer(help="Mantenimiento del estado (state.json)")
+app.add_typer(state_app, name="state")
+
+
+@state_app.command(name="gc", help="Olvida entradas obsoletas y compacta el estado")
+def state_gc(
+    ctx: typer.Context,
+    cookies: str = typer.Option("/cookies", "--cookies"),
+    runs: Optional[int] = typer.Option(None, "--runs", help="Ejecuciones completas sin aparecer (por defecto STATE_GC_RUNS)"),
+    check_files: bool = typer.Option(False, "--check-files", help="Olvidar también las entradas cuyo fichero ya no existe"),
+    dry_run: bool = typer.Option(False, "--dry-run", help="Sólo contar lo que se retiraría"),
+):
+    cfg = _merge_common(ctx, {"COOKIES_DIR": cookies, "DRY_RUN": dry_run})
+    state_path = _make_state_path(cfg.cookies_dir)
+    if not os.path.exists(state_path):
+        typer.echo(f"No hay estado en {state_path}")
+        raise typer.Exit(code=1)
+    state = StateDB(state_path)
+    before = os.path.getsize(state_path)
+    removed = state.gc(cfg.state_gc_runs if runs is None else runs, check_files=check_files, dry_run=cfg.dry_run)
+    if cfg.dry_run:
+        print(f"Se retirarían {removed} de {len(state.entries())} entradas")
+        return
+    state.save()  # reescribe el fichero en formato compacto
+    after = os.path.getsize(state_path)
+    print(f"Retiradas {removed} entradas; quedan {len(state.entries())}. {human_bytes(before)} → {human_bytes(after)} ({human_bytes(max(0, before - after))} recuperados)")
 
 
 @app.command(help="Diagnóstico de entorno")
@@ -2,8 +2,8 @@ from __future__ import annotations
 
 import os
 import yaml
-from dataclasses import dataclass, field
-from typing import Any, Dict
+from dataclasses import dataclass, field, replace
+from typing import Any, Dict, List
 
 
 DEFAULTS = {
@@ -19,8 +19,44 @@ DEFAULTS = {
     "RETRY_MAX": 5,
     "RETRY_BACKOFF": 2.0,
     "UMASK": "002",
+    "BANDWIDTH_LIMIT": None,  # MB/s global (todas las cuentas); None = sin límite
+    "SHARD": None,  # "i/N": este proceso sólo descarga su porción
+    "SHARD_BY": "id",  # id | month
+    "VERSIONS": "original",  # lista separada por comas: thumb,medium,original
+    "PREVIEWS_DIR": None,  # árbol paralelo para thumb/medium; None = <out>/.previews
+    "PREVIEW_CONCURRENCY": 16,
+    "RECONCILE": False,  # mover/poner en cuarentena lo que ya no está en iCloud
+    "QUARANTINE_DIR": None,  # None = <out>/.quarantine
+    "EDITS": "original",  # original | edited | both (fotos editadas en iCloud)
+    "CACHE_TTL": 0,  # s que un listado en caché se usa sin consultar iCloud; 0 = sin caché (p.ej. 900)
+    "CACHE_MAX_AGE": 6 * 3600,  # s que se reutiliza si el nº de assets del álbum no cambia
+    "POSTPROCESS": "",  # tareas tras descargar, separadas por comas: jpeg,thumb (requiere Pillow)
+    "POSTPROCESS_WORKERS": None,  # procesos; None = nº de CPUs
+    "DERIVED_DIR": None,  # árbol de derivados; None = <out>/.derived
+    "THUMB_SIZE": 512,  # lado mayor de las miniaturas (px)
+    "LOG_FORMAT": "text",  # text | json (una línea JSON por mensaje)
+    "LOG_RATE_LIMIT": 20,  # máx. mensajes iguales por minuto; 0 = sin límite
+    "PROGRESS": "auto",  # auto (barra en TTY, líneas de log si no) | bar | log | off
+    "PROGRESS_INTERVAL": 60,  # s entre líneas de progreso en modo log
+    "ORDER": "newest",  # newest | oldest | smallest | listing (orden de descarga)
+    "LOOKAHEAD": 2000,  # assets que se retienen para reordenar
+    "SINCE": None,  # sólo assets creados desde esta fecha (ISO: 2024-01-01)
+    "UNTIL": None,  # ... y hasta esta fecha (incluida)
+    "MEDIA": None,  # photo | video | live; None = todo
+    "MIRRORS": "",  # destinos adicionales (equivalentes a OUT_MAIN), separados por comas
+    "S3_ENDPOINT_URL": None,  # para OUT_MAIN=s3://bucket/prefijo en MinIO u otro S3 compatible
+    "S3_PART_SIZE": 8,  # MB por parte de las subidas multipart (memoria por transferencia)
+    "STATE_GC_RUNS": 10,  # ejecuciones completas sin aparecer tras las que se olvida una entrada; 0 = nunca
+    "METADATA_RATE": 0.0,  # peticiones/s a la API de metadatos (todas las cuentas, p.ej. 10); 0 = sin límite
+    "MIN_FREE_GB": 0.0,  # espacio libre que se reserva en el destino (p.ej. 2); 0 = sin control de espacio
 }
 
+# Claves que son de todo el proceso (presupuestos globales y logging): no se pueden
+# cambiar por cuenta
+PROCESS_KEYS = {"CONCURRENCY", "BANDWIDTH_LIMIT", "METADATA_RATE", "LOG_FILE", "LOG_FORMAT", "LOG_RATE_LIMIT", "LOG_LEVEL", "NO_LOG_FILE"}
+# Claves que admite cada elemento de 'accounts'
+ACCOUNT_KEYS = (set(DEFAULTS) | {"APPLE_ID", "CHOWN", "DRY_RUN"}) - PROCESS_KEYS
+
 
 @dataclass
 class Config:
@@ -37,11 +73,44 @@ class Config:
     retry_max: int = DEFAULTS["RETRY_MAX"]
     retry_backoff: float = DEFAULTS["RETRY_BACKOFF"]
     umask: str = DEFAULTS["UMASK"]
+    bandwidth_limit: float | None = DEFAULTS["BANDWIDTH_LIMIT"]
+    shard: str | None = DEFAULTS["SHARD"]
+    shard_by: str = DEFAULTS["SHARD_BY"]
+    versions: str = DEFAULTS["VERSIONS"]
+    previews_dir: str | None = DEFAULTS["PREVIEWS_DIR"]
+    preview_concurrency: int = DEFAULTS["PREVIEW_CONCURRENCY"]
+    reconcile: bool = DEFAULTS["RECONCILE"]
+    quarantine_dir: str | None = DEFAULTS["QUARANTINE_DIR"]
+    edits: str = DEFAULTS["EDITS"]
+    cache_ttl: float = DEFAULTS["CACHE_TTL"]
+    cache_max_age: float = DEFAULTS["CACHE_MAX_AGE"]
+    postprocess: str = DEFAULTS["POSTPROCESS"]
+    postprocess_workers: int | None = DEFAULTS["POSTPROCESS_WORKERS"]
+    derived_dir: str | None = DEFAULTS["DERIVED_DIR"]
+    thumb_size: int = DEFAULTS["THUMB_SIZE"]
+    log_format: str = DEFAULTS["LOG_FORMAT"]
+    log_rate_limit: int = DEFAULTS["LOG_RATE_LIMIT"]
+    progress: str = DEFAULTS["PROGRESS"]
+    progress_interval: float = DEFAULTS["PROGRESS_INTERVAL"]
+    order: str = DEFAULTS["ORDER"]
+    lookahead: int = DEFAULTS["LOOKAHEAD"]
+    since: str | None = DEFAULTS["SINCE"]
+    until: str | None = DEFAULTS["UNTIL"]
+    media: str | None = DEFAULTS["MEDIA"]
+    mirrors: str = DEFAULTS["MIRRORS"]
+    s3_endpoint_url: str | None = DEFAULTS["S3_ENDPOINT_URL"]
+    s3_part_size: int = DEFAULTS["S3_PART_SIZE"]
+    state_gc_runs: int = DEFAULTS["STATE_GC_RUNS"]
+    metadata_rate: float = DEFAULTS["METADATA_RATE"]
+    min_free_gb: float = DEFAULTS["MIN_FREE_GB"]
     chown: str | None = None  # "UID:GID"
     log_level: str = "INFO"
     no_log_file: bool = False
     dry_run: bool = False
     yaml_path: str | None = None
+    # Lista de cuentas (sólo YAML): cada elemento admite las claves de la config global salvo
+    # las de todo el proceso (PROCESS_KEYS)
+    accounts: List[Dict[str, Any]] = field(default_factory=list)
 
     extra: Dict[str, Any] = field(default_factory=dict)
 
@@ -72,6 +141,36 @@ class Config:
             "RETRY_MAX",
             "RETRY_BACKOFF",
             "UMASK",
+            "BANDWIDTH_LIMIT",
+            "SHARD",
+            "SHARD_BY",
+            "VERSIONS",
+            "PREVIEWS_DIR",
+            "PREVIEW_CONCURRENCY",
+            "RECONCILE",
+            "QUARANTINE_DIR",
+            "EDITS",
+            "CACHE_TTL",
+            "CACHE_MAX_AGE",
+            "POSTPROCESS",
+            "POSTPROCESS_WORKERS",
+            "DERIVED_DIR",
+            "THUMB_SIZE",
+            "LOG_FORMAT",
+            "LOG_RATE_LIMIT",
+            "PROGRESS",
+            "PROGRESS_INTERVAL",
+            "ORDER",
+            "LOOKAHEAD",
+            "SINCE",
+            "UNTIL",
+            "MEDIA",
+            "MIRRORS",
+            "S3_ENDPOINT_URL",
+            "S3_PART_SIZE",
+            "STATE_GC_RUNS",
+            "METADATA_RATE",
+            "MIN_FREE_GB",
             "CHOWN",
             "LOG_LEVEL",
             "NO_LOG_FILE",
@@ -93,12 +192,49 @@ class Config:
                 out["RECENT"] = None
         if "CONCURRENCY" in out:
             out["CONCURRENCY"] = int(out["CONCURRENCY"])  # may raise
+        if "PREVIEW_CONCURRENCY" in out:
+            out["PREVIEW_CONCURRENCY"] = int(out["PREVIEW_CONCURRENCY"])  # may raise
+        if "VERSIONS" in out and isinstance(out["VERSIONS"], (list, tuple)):
+            out["VERSIONS"] = ",".join(str(v) for v in out["VERSIONS"])
         if "RETRY_MAX" in out:
             out["RETRY_MAX"] = int(out["RETRY_MAX"])  # may raise
         if "RETRY_BACKOFF" in out:
             out["RETRY_BACKOFF"] = float(out["RETRY_BACKOFF"])  # may raise
+        if "BANDWIDTH_LIMIT" in out and out["BANDWIDTH_LIMIT"] is not None:
+            out["BANDWIDTH_LIMIT"] = float(out["BANDWIDTH_LIMIT"]) or None  # may raise
+        if "CACHE_TTL" in out:
+            out["CACHE_TTL"] = float(out["CACHE_TTL"] or 0)  # may raise
+        if "CACHE_MAX_AGE" in out:
+            out["CACHE_MAX_AGE"] = float(out["CACHE_MAX_AGE"] or 0)  # may raise
+        if "POSTPROCESS" in out and isinstance(out["POSTPROCESS"], (list, tuple)):
+            out["POSTPROCESS"] = ",".join(str(v) for v in out["POSTPROCESS"])
+        if "POSTPROCESS_WORKERS" in out and out["POSTPROCESS_WORKERS"] is not None:
+            out["POSTPROCESS_WORKERS"] = int(out["POSTPROCESS_WORKERS"]) or None  # may raise
+        if "THUMB_SIZE" in out:
+            out["THUMB_SIZE"] = int(out["THUMB_SIZE"])  # may raise
+        if "LOG_RATE_LIMIT" in out:
+            out["LOG_RATE_LIMIT"] = int(out["LOG_RATE_LIMIT"] or 0)  # may raise
+        if "PROGRESS_INTERVAL" in out:
+            out["PROGRESS_INTERVAL"] = float(out["PROGRESS_INTERVAL"])  # may raise
+        if "LOOKAHEAD" in out:
+            out["LOOKAHEAD"] = int(out["LOOKAHEAD"])  # may raise
+        if "MIRRORS" in out and isinstance(out["MIRRORS"], (list, tuple)):
+            out["MIRRORS"] = ",".join(str(v) for v in out["MIRRORS"])
+        if "S3_PART_SIZE" in out:
+            out["S3_PART_SIZE"] = int(out["S3_PART_SIZE"])  # may raise
+        if "STATE_GC_RUNS" in out:
+            out["STATE_GC_RUNS"] = int(out["STATE_GC_RUNS"] or 0)  # may raise
+        if "METADATA_RATE" in out:
+            out["METADATA_RATE"] = float(out["METADATA_RATE"] or 0)  # may raise
+        if "MIN_FREE_GB" in out:
+            out["MIN_FREE_GB"] = float(out["MIN_FREE_GB"] or 0)  # may raise
+        for k in ("SINCE", "UNTIL"):
+            if k in out and out[k] is not None:
+                out[k] = str(out[k]) or None  # YAML convierte 2024-01-01 en date
         if "NO_LOG_FILE" in out:
             out["NO_LOG_FILE"] = str(out["NO_LOG_FILE"]).lower() in ("1", "true", "yes")
+        if "RECONCILE" in out:
+            out["RECONCILE"] = str(out["RECONCILE"]).lower() in ("1", "true", "yes")
         if "DRY_RUN" in out:
             out["DRY_RUN"] = str(out["DRY_RUN"]).lower() in ("1", "true", "yes")
         return out
@@ -130,12 +266,74 @@ class Config:
             retry_max=merged.get("RETRY_MAX", DEFAULTS["RETRY_MAX"]),
             retry_backoff=merged.get("RETRY_BACKOFF", DEFAULTS["RETRY_BACKOFF"]),
             umask=str(merged.get("UMASK", DEFAULTS["UMASK"])),
+            bandwidth_limit=merged.get("BANDWIDTH_LIMIT", DEFAULTS["BANDWIDTH_LIMIT"]),
+            shard=merged.get("SHARD") or None,
+            shard_by=str(merged.get("SHARD_BY") or DEFAULTS["SHARD_BY"]).lower(),
+            versions=str(merged.get("VERSIONS") or DEFAULTS["VERSIONS"]),
+            previews_dir=merged.get("PREVIEWS_DIR") or None,
+            preview_concurrency=merged.get("PREVIEW_CONCURRENCY", DEFAULTS["PREVIEW_CONCURRENCY"]),
+            reconcile=merged.get("RECONCILE", DEFAULTS["RECONCILE"]),
+            quarantine_dir=merged.get("QUARANTINE_DIR") or None,
+            edits=str(merged.get("EDITS") or DEFAULTS["EDITS"]).lower(),
+            cache_ttl=merged.get("CACHE_TTL", DEFAULTS["CACHE_TTL"]),
+            cache_max_age=merged.get("CACHE_MAX_AGE", DEFAULTS["CACHE_MAX_AGE"]),
+            postprocess=str(merged.get("POSTPROCESS") or ""),
+            postprocess_workers=merged.get("POSTPROCESS_WORKERS", DEFAULTS["POSTPROCESS_WORKERS"]),
+            derived_dir=merged.get("DERIVED_DIR") or None,
+            thumb_size=merged.get("THUMB_SIZE", DEFAULTS["THUMB_SIZE"]),
+            log_format=str(merged.get("LOG_FORMAT") or DEFAULTS["LOG_FORMAT"]).lower(),
+            log_rate_limit=merged.get("LOG_RATE_LIMIT", DEFAULTS["LOG_RATE_LIMIT"]),
+            progress=str(merged.get("PROGRESS") or DEFAULTS["PROGRESS"]).lower(),
+            progress_interval=merged.get("PROGRESS_INTERVAL", DEFAULTS["PROGRESS_INTERVAL"]),
+            order=str(merged.get("ORDER") or DEFAULTS["ORDER"]).lower(),
+            lookahead=merged.get("LOOKAHEAD", DEFAULTS["LOOKAHEAD"]),
+            since=merged.get("SINCE") or None,
+            until=merged.get("UNTIL") or None,
+            media=str(merged.get("MEDIA")).lower() if merged.get("MEDIA") else None,
+            mirrors=str(merged.get("MIRRORS") or ""),
+            s3_endpoint_url=merged.get("S3_ENDPOINT_URL") or None,
+            s3_part_size=merged.get("S3_PART_SIZE", DEFAULTS["S3_PART_SIZE"]),
+            state_gc_runs=merged.get("STATE_GC_RUNS", DEFAULTS["STATE_GC_RUNS"]),
+            metadata_rate=merged.get("METADATA_RATE", DEFAULTS["METADATA_RATE"]),
+            min_free_gb=merged.get("MIN_FREE_GB", DEFAULTS["MIN_FREE_GB"]),
             chown=merged.get("CHOWN"),
             log_level=merged.get("LOG_LEVEL", "INFO"),
             no_log_file=merged.get("NO_LOG_FILE", False),
             dry_run=merged.get("DRY_RUN", False),
             yaml_path=yaml_path,
-            extra={k: v for k, v in merged.items() if k not in DEFAULTS and k not in {"APPLE_ID", "CHOWN", "LOG_LEVEL", "NO_LOG_FILE", "DRY_RUN"}},
+            accounts=list(merged.get("ACCOUNTS") or []),
+            extra={k: v for k, v in merged.items() if k not in DEFAULTS and k not in {"APPLE_ID", "CHOWN", "LOG_LEVEL", "NO_LOG_FILE", "DRY_RUN", "ACCOUNTS"}},
         )
         return cfg
 
+    def for_account(self, account: Dict[str, Any]) -> "Config":
+        # Config aislada por cuenta: hereda la global y, salvo que se indique otra cosa,
+        # usa cookies/estado y rutas de salida propias bajo <base>/<apple_id>. Cualquier clave
+        # de ACCOUNT_KEYS la sustituye; las demás son un error de configuración
+        if not isinstance(account, dict):
+            raise ValueError(f"Cada cuenta en 'accounts' debe ser un mapa con 'apple_id' (recibido: {account!r})")
+        acc = self.coerce_types({k.upper(): v for k, v in account.items()})
+        apple_id = acc.get("APPLE_ID")
+        if not apple_id:
+            raise ValueError("Cada cuenta en 'accounts' necesita 'apple_id'")
+        bad = sorted(set(acc) - ACCOUNT_KEYS)
+        if bad:
+            where = "son globales, no por cuenta" if set(bad) <= PROCESS_KEYS else "no reconocidas"
+            raise ValueError(f"Claves de la cuenta {apple_id} {where}: {', '.join(bad)}")
+        out_main = acc.get("OUT_MAIN") or os.path.join(self.out_main, apple_id)
+        overrides = {k.lower(): v for k, v in acc.items() if k not in {"OUT_MAIN", "OUT_SHARED", "COOKIES_DIR", "MIRRORS"}}
+        for k in ("shard_by", "edits", "progress", "order", "media"):
+            if overrides.get(k):
+                overrides[k] = str(overrides[k]).lower()
+        if "umask" in overrides:
+            overrides["umask"] = str(overrides["umask"])
+        return replace(
+            self,
+            **overrides,
+            cookies_dir=acc.get("COOKIES_DIR") or os.path.join(self.cookies_dir, apple_id),
+            out_main=out_main,
+            out_shared=acc.get("OUT_SHARED") or os.path.join(out_main, "Compartidos"),
+            # Copias adicionales también separadas por cuenta
+            mirrors=acc.get("MIRRORS") or ",".join(os.path.join(m.strip(), apple_id) for m in self.mirrors.split(",") if m.strip()),
+            accounts=[],
+        )
@@ -1,9 +1,112 @@
+import atexit
+import json
 import logging
 import os
-from logging.handlers import RotatingFileHandler
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 
-def setup_logging(log_level: str = "INFO", log_file: str | None = None) -> None:
+# Los hilos de descarga sólo encolan el LogRecord; el formateo y la E/S (consola, fichero)
+# los hace un único hilo (QueueListener), así que el log no compite con los workers
+_listener: QueueListener | None = None
+_limiter: "RateLimitFilter | None" = None
+
+
+class _LazyQueueHandler(QueueHandler):
+    # QueueHandler.prepare formatea en el hilo que loguea; aquí la cola es del propio
+    # proceso, así que el record viaja tal cual y se formatea en el listener
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class RateLimitFilter(logging.Filter):
+    # Avisos/errores repetitivos (misma plantilla, mismo logger y nivel): como mucho `limit`
+    # por ventana de `window` segundos; el primero de la ventana siguiente indica cuántos se
+    # omitieron. INFO/DEBUG no se limitan (p.ej. el listado de --dry-run)
+    def __init__(self, limit: int, window: float = 60.0) -> None:
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self._seen: dict[tuple, list] = {}  # clave -> [inicio de ventana, emitidos, suprimidos]
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING:
+            return True
+        key = (record.name, record.levelno, record.msg if isinstance(record.msg, str) else repr(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            slot = self._seen.get(key)
+            if slot is None and len(self._seen) >= 4096:
+                # Mensajes con texto variable (f-strings) no se repiten: no acumular claves
+                self._seen = {k: v for k, v in self._seen.items() if v[2] or now - v[0] < self.window}
+            if slot is None or now - slot[0] >= self.window:
+                if slot is not None and slot[2]:
+                    record.suppressed = slot[2]
+                self._seen[key] = [now, 1, 0]
+                return True
+            if slot[1] < self.limit:
+                slot[1] += 1
+                return True
+            slot[2] += 1
+            return False
+
+    def flush(self) -> list[logging.LogRecord]:
+        # Resumen de lo suprimido en ventanas que no llegaron a cerrarse
+        out = []
+        with self._lock:
+            for (name, level, msg), slot in self._seen.items():
+                if slot[2]:
+                    out.append(logging.LogRecord(name, level, "", 0, "%d mensajes similares suprimidos: %s", (slot[2], msg), None))
+                    slot[2] = 0
+        return out
+
+
+class _SuppressedMixin:
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)  # type: ignore[misc]
+        n = getattr(record, "suppressed", 0)
+        return f"{text} [+{n} similares suprimidos]" if n else text
+
+
+class TextFormatter(_SuppressedMixin, logging.Formatter):
+    pass
+
+
+class JsonFormatter(logging.Formatter):
+    # Una línea JSON por mensaje (para Loki/ELK/jq)
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "suppressed", 0):
+            data["suppressed"] = record.suppressed
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+
+def shutdown_logging() -> None:
+    global _listener, _limiter
+    if _listener is None:
+        return
+    if _limiter is not None:
+        for record in _limiter.flush():
+            _listener.queue.put_nowait(record)
+    _listener.stop()  # vacía la cola antes de volver
+    for h in _listener.handlers:
+        h.close()
+    _listener = None
+    _limiter = None
+
+
+def setup_logging(log_level: str = "INFO", log_file: str | None = None, log_format: str = "text", rate_limit: int = 20) -> None:
+    global _listener, _limiter
     level = getattr(logging, log_level.upper(), logging.INFO)
     root = logging.getLogger()
     root.setLevel(level)
@@ -12,21 +115,36 @@ def setup_logging(log_level: str = "INFO", log_file: str | None = None) -> None:
     if root.handlers:
         for h in list(root.handlers):
             root.removeHandler(h)
+    shutdown_logging()
 
-    fmt = logging.Formatter(
-        fmt="%(asctime)s %(levelname)s %(name)s: %(message)s",
-        datefmt="%Y-%m-%d %H:%M:%S",
-    )
+    if log_format == "json":
+        fmt: logging.Formatter = JsonFormatter()
+    else:
+        fmt = TextFormatter(
+            fmt="%(asctime)s %(levelname)s %(name)s: %(message)s",
+            datefmt="%Y-%m-%d %H:%M:%S",
+        )
 
     sh = logging.StreamHandler()
     sh.setFormatter(fmt)
     sh.setLevel(level)
-    root.addHandler(sh)
+    handlers: list[logging.Handler] = [sh]
 
     if log_file:
         os.makedirs(os.path.dirname(log_file), exist_ok=True)
         fh = RotatingFileHandler(log_file, maxBytes=10 * 1024 * 1024, backupCount=5)
         fh.setFormatter(fmt)
         fh.setLevel(level)
-        root.addHandler(fh)
+        handlers.append(fh)
+
+    q: queue.SimpleQueue = queue.SimpleQueue()
+    qh = _LazyQueueHandler(q)
+    if rate_limit > 0:
+        _limiter = RateLimitFilter(rate_limit)
+        qh.addFilter(_limiter)
+    root.addHandler(qh)
+    _listener = QueueListener(q, *handlers, respect_handler_level=True)
+    _listener.start()
+
 
+atexit.register(shutdown_logging)
@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import logging
+import os
+import re
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone as dt_timezone, tzinfo
+from typing import Iterator, Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from .state import StateDB
+from .utils import mtime_from_exif, set_mtime
+
+log = logging.getLogger(__name__)
+
+
+# Fecha en el nombre (YYYYmmdd_HHMMSS), del planner o de otras herramientas/cámaras
+_NAME_TS = re.compile(r"(\d{4})(\d{2})(\d{2})_(\d{2})(\d{2})(\d{2})")
+# Nombres que genera el planner: 20250801_060203_<id>[_edit].<ext>, con la fecha de iCloud en UTC
+_OWN_NAME = re.compile(r"^\d{8}_\d{6}_[^.]+\.\w+$")
+
+# Diferencia (s) por debajo de la cual el mtime se da por correcto (SMB/FAT redondean)
+MTIME_TOLERANCE = 2.0
+
+
+def _tz(name: str | None) -> tzinfo:
+    try:
+        return ZoneInfo(name) if name else dt_timezone.utc
+    except (ZoneInfoNotFoundError, ValueError):
+        log.warning(f"Zona horaria desconocida '{name}'; se usa UTC")
+        return dt_timezone.utc
+
+
+def timestamp_from_name(name: str, tz: tzinfo) -> float | None:
+    m = _NAME_TS.search(name)
+    if not m:
+        return None
+    try:
+        return datetime(*(int(g) for g in m.groups()), tzinfo=tz).timestamp()
+    except ValueError:
+        return None
+
+
+def timestamp_of_name(name: str, tz: tzinfo) -> float | None:
+    # TIMEZONE sólo para nombres ajenos: los de esta herramienta ya van en UTC
+    return timestamp_from_name(name, dt_timezone.utc if _OWN_NAME.match(name) else tz)
+
+
+def _scan(root: str) -> Iterator[str]:
+    # Recorrido con os.scandir: el tipo de entrada viene del propio listado (sin stat extra)
+    stack = [root]
+    while stack:
+        d = stack.pop()
+        try:
+            with os.scandir(d) as it:
+                for e in it:
+                    if e.is_dir(follow_symlinks=False):
+                        stack.append(e.path)
+                    elif e.is_file(follow_symlinks=False):
+                        yield e.path
+        except OSError as e:
+            log.warning("No se pudo listar %s: %s", d, e)
+
+
+def candidates(root: str, state: Optional[StateDB] = None) -> Iterator[tuple[str, float | None]]:
+    # (ruta, fecha de creación en iCloud) de lo conocido por el estado bajo root; si no hay
+    # nada, recorrido del disco (sin fecha: sale del nombre)
+    root = os.path.abspath(root)
+    if state is not None:
+        state.load()
+        known = [(e.path, e.created) for e in state.entries() if os.path.abspath(e.path).startswith(root + os.sep)]
+        if known:
+            log.info(f"{len(known)} ficheros candidatos según el estado")
+            yield from known
+            return
+    for path in _scan(root):
+        yield path, None
+
+
+def _fix_one(path: str, created: float | None, tz: tzinfo, exif: bool, dry_run: bool) -> str:
+    # Con fecha de iCloud se sigue la regla de sync (EXIF si lo hay, si no la fecha de
+    # creación); el EXIF sólo se lee si el mtime no coincide ya con la fecha de creación
+    mtime = os.stat(path).st_mtime
+    if created is not None:
+        if not exif and abs(mtime - created) < MTIME_TOLERANCE:
+            return "ok"
+        ts = mtime_from_exif(path) or created
+    else:
+        ts = (mtime_from_exif(path) if exif else None) or timestamp_of_name(os.path.basename(path), tz)
+    if ts is None:
+        return "unknown"
+    if abs(mtime - ts) < MTIME_TOLERANCE:
+        return "ok"
+    if not dry_run:
+        set_mtime(path, ts)
+    return "fixed"
+
+
+def fix_mtimes(
+    root: str,
+    *,
+    state: Optional[StateDB] = None,
+    timezone: str | None = None,
+    exif: bool = False,
+    concurrency: int = 16,
+    dry_run: bool = False,
+) -> dict:
+    # stat + utime (y la lectura EXIF) van a un pool: en SMB/NFS cada una es un round-trip
+    tz = _tz(timezone)
+    counts = {"scanned": 0, "fixed": 0, "ok": 0, "unknown": 0, "errors": 0}
+    pending: dict = {}
+
+    def _drain() -> None:
+        done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+        for fut in done:
+            path = pending.pop(fut)
+            try:
+                counts[fut.result()] += 1
+            except OSError as e:
+                log.warning("No se pudo ajustar %s: %s", path, e)
+                counts["errors"] += 1
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as ex:
+        for path, created in candidates(root, state):
+            counts["scanned"] += 1
+            pending[ex.submit(_fix_one, path, created, tz, exif, dry_run)] = path
+            if len(pending) >= max(1, concurrency) * 8:
+                _drain()
+        while pending:
+            _drain()
+    return counts
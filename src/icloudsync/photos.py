@@ -1,10 +1,21 @@
 from __future__ import annotations
 
+import copy
+import json
 import logging
+import os
+import tempfile
+import threading
+from collections import deque
 from dataclasses import dataclass
 from datetime import datetime
+from itertools import islice
 from typing import Callable, Iterable, Iterator, Optional
 
+from .breaker import THROTTLE_STATUS, retry_after_of, status_of
+from .cache import MetadataCache, from_row, to_row
+from .throttle import TokenBucket
+
 try:
     from pyicloud_ipd import PyiCloudService
 except Exception:  # pragma: no cover - optional at dev time
@@ -13,7 +24,10 @@ except Exception:  # pragma: no cover - optional at dev time
 log = logging.getLogger(__name__)
 
 
-@dataclass
+# Registro compacto (slots, sin closure por asset): sólo lo necesario para planificar la
+# descarga. Los bytes se piden a través del ICloudPhotos compartido (source), que resuelve
+# las URLs al descargar: el registro sólo guarda dónde están (urls_at, en su UrlSpool)
+@dataclass(slots=True)
 class PhotoAsset:
     id: str
     created: datetime
@@ -21,59 +35,454 @@ class PhotoAsset:
     size: int | None
     album: str | None
     extension: str
-    downloader: Callable[[], Iterator[bytes]]
+    source: "ICloudPhotos | None" = None
+    urls_at: int | None = None  # posición de sus URLs en el UrlSpool de source
+    album_id: str | None = None  # estable aunque se renombre el álbum
+    remote_version: str | None = None  # huella de la versión remota (cambia al editar en iCloud)
+    edit: tuple[str, str, str, int | None] | None = None  # edición descargable: (versión, extensión, huella, tamaño)
+    media: str = "photo"  # photo | video | live
+    listing: str | None = None  # clave del listado en caché del que salió (URLs quizá caducadas)
+
+    def downloader(self, version: str = "original") -> Iterator[bytes]:
+        return self.source.download(self, version)
+
+
+def _iter_response(resp) -> Iterator[bytes]:
+    if hasattr(resp, "iter_content"):
+        yield from resp.iter_content(chunk_size=1024 * 1024)
+    elif hasattr(resp, "raw") and hasattr(resp.raw, "stream"):
+        yield from resp.raw.stream(1024 * 1024, decode_content=True)
+    else:
+        data = getattr(resp, "content", None) or getattr(resp, "data", None)
+        if data:
+            yield data
+
+
+# Versión con el render editado a resolución completa. pyicloud no la expone en
+# asset.versions (sólo original/medium/thumb): sale de los campos resJPEGFull* del registro
+EDIT_VERSION = "edited"
+EDIT_VERSIONS = (EDIT_VERSION,)
+
+# Tipo de fichero (UTI) del render editado → extensión
+_EDIT_TYPES = {"public.jpeg": "jpg", "public.heic": "heic", "public.png": "png", "com.apple.quicktime-movie": "mov"}
+
+
+def _field(record: dict, name: str):
+    value = (record or {}).get("fields", {}).get(name)
+    return value.get("value") if isinstance(value, dict) else value
+
+
+def remote_version_of(asset) -> str | None:
+    # Huella del original (registro maestro); si no hay, su fecha de modificación. Editar en
+    # iCloud sólo toca el registro del asset, así que no cambia (ver edit_of)
+    master = getattr(asset, "_master_record", None) or {}
+    fingerprint = _field(master, "resOriginalFingerprint")
+    if fingerprint:
+        return str(fingerprint)
+    modified = (master.get("modified") or {}).get("timestamp")
+    return str(modified) if modified else None
+
+
+def edit_of(asset) -> tuple[str, str, str, str | None] | None:
+    # Render editado: (extensión, URL, huella, tamaño) a partir de resJPEGFull* del registro
+    # del asset; None si la foto no está editada. Editada sin render descargable: LookupError
+    record = getattr(asset, "_asset_record", None) or {}
+    adjustment = _field(record, "adjustmentType")
+    res = _field(record, "resJPEGFullRes")
+    if not adjustment and not res:
+        return None
+    url = res.get("downloadURL") if isinstance(res, dict) else None
+    if not url:
+        raise LookupError(f"editada en iCloud ({adjustment}) sin render descargable")
+    ext = _EDIT_TYPES.get(_field(record, "resJPEGFullFileType"), "jpg")
+    version = f"{_field(record, 'resJPEGFullFingerprint') or ''}:{adjustment or ''}"
+    return ext, url, version, res.get("size")
+
+
+def album_key(album, name: str) -> str:
+    # Identificador estable del álbum; si la API no lo expone, el nombre
+    for attr in ("id", "record_name", "obj_type"):
+        value = getattr(album, attr, None)
+        if value:
+            return str(value)
+    return name
+
+
+def _version_urls(versions, wanted: tuple[str, ...]) -> tuple[tuple[str, str], ...]:
+    urls = []
+    for name in wanted:
+        info = versions.get(name) if hasattr(versions, "get") else None
+        url = info.get("url") if info else None
+        if url:
+            urls.append((name, url))
+    return tuple(urls)
+
+
+# Tipos de --media; "photo" incluye las Live Photos (su foto fija)
+MEDIA = ("photo", "video", "live")
+VIDEO_EXTENSIONS = ("mov", "mp4", "m4v", "avi", "3gp")
+
+# Carpetas inteligentes de iCloud que ya filtran por tipo en el servidor
+SMART_ALBUMS = {"video": "Videos", "live": "Live"}
+
+
+def media_of(item_type: str | None, ext: str, versions) -> str:
+    if item_type == "movie" or ext in VIDEO_EXTENSIONS:
+        return "video"
+    # Las Live Photos traen, además de la foto, versiones de vídeo (original_video, ...)
+    names = versions.keys() if hasattr(versions, "keys") else ()
+    return "live" if any("video" in str(n).lower() for n in names) else "photo"
+
+
+@dataclass(frozen=True)
+class AssetFilter:
+    # --since/--until/--media: timestamps de creación (until exclusivo) y tipo de asset
+    since: float | None = None
+    until: float | None = None
+    media: str | None = None
+
+    def matches(self, created: datetime, media: str) -> bool:
+        ts = created.timestamp()
+        if self.since is not None and ts < self.since:
+            return False
+        if self.until is not None and ts >= self.until:
+            return False
+        if self.media == "photo":
+            return media != "video"
+        return self.media is None or media == self.media
+
+
+# Respuestas de una URL de descarga caducada (firmada con caducidad). Si viene del caché de
+# listados se vuelve a listar el álbum en lugar de tratarlo como sesión caducada. La sesión
+# de pyicloud lanza una excepción (con .code) ante una respuesta de error que no es JSON,
+# como la página del CDN: se mira el código tanto en la respuesta como en la excepción
+EXPIRED_STATUS = (401, 403, 404, 410)
+
+
+# Reintentos de una petición de metadatos limitada (429/503) antes de dejar que falle
+METADATA_RETRIES = 3
+
+
+def limit_metadata(session, bucket: TokenBucket) -> None:
+    # Todas las peticiones de metadatos de la sesión (listados, álbumes, recuentos) pasan por
+    # bucket; las descargas (stream=True) no, ya tienen BANDWIDTH_LIMIT. Se engancha en send,
+    # antes de que pyicloud convierta la respuesta en excepción y se pierda la cabecera. Un
+    # 429/503 pausa el bucket lo que diga Retry-After: esperan todos los hilos a la vez
+    if getattr(session, "_metadata_bucket", None) is not None:
+        session._metadata_bucket = bucket
+        return
+    send = session.send
+
+    def _send(request, **kwargs):
+        if kwargs.get("stream"):
+            return send(request, **kwargs)
+        attempt = 0
+        while True:
+            session._metadata_bucket.consume()
+            resp = send(request, **kwargs)
+            attempt += 1
+            if resp.status_code not in THROTTLE_STATUS or attempt > METADATA_RETRIES:
+                return resp
+            delay = retry_after_of(resp) or 30.0 * attempt
+            log.warning(f"iCloud limita las peticiones de metadatos ({resp.status_code}); pausa de {delay:.0f}s")
+            resp.close()
+            session._metadata_bucket.pause(delay)
+
+    session._metadata_bucket = bucket
+    session.send = _send
+
+
+def _marker(collection) -> int | None:
+    # Nº de assets del álbum: consulta barata que detecta altas y bajas sin paginar
+    try:
+        return len(collection)
+    except Exception:
+        return None
+
+
+class UrlSpool:
+    # URLs de descarga de los assets listados en esta ejecución, en un temporal en disco (una
+    # línea JSON por asset). Las URLs firmadas son lo que más ocupa de un registro: en memoria
+    # sólo queda la posición de cada línea
+    def __init__(self) -> None:
+        self._file = None
+        self._lock = threading.Lock()
+
+    def add(self, urls: tuple[tuple[str, str], ...]) -> int | None:
+        if not urls:
+            return None
+        line = (json.dumps(urls, separators=(",", ":")) + "\n").encode("utf-8")
+        with self._lock:
+            if self._file is None:
+                self._file = tempfile.TemporaryFile(prefix="icloudsync-urls-")
+            self._file.seek(0, os.SEEK_END)
+            pos = self._file.tell()
+            self._file.write(line)
+        return pos
+
+    def get(self, pos: int | None) -> dict[str, str]:
+        if pos is None:
+            return {}
+        with self._lock:
+            self._file.seek(pos)
+            line = self._file.readline()
+        return {version: url for version, url in json.loads(line)}
+
+
+class Listing:
+    # Listado de assets que, al terminar, sabe cuántos errores de enumeración hubo (assets o
+    # álbumes que no se pudieron leer). Con errores es parcial: no sirve para deducir borrados
+    def __init__(self, photos: "ICloudPhotos", assets: Iterator[PhotoAsset]) -> None:
+        self._photos = photos
+        self._assets = assets
+        self.errors = 0
+
+    def __iter__(self) -> Iterator[PhotoAsset]:
+        start = self._photos.errors
+        try:
+            yield from self._assets
+        finally:
+            self.errors = self._photos.errors - start
 
 
 class ICloudPhotos:
-    def __init__(self, api: "PyiCloudService") -> None:
+    def __init__(
+        self,
+        api: "PyiCloudService",
+        versions: Iterable[str] = ("original",),
+        cache: MetadataCache | None = None,
+        filters: AssetFilter | None = None,
+        metadata_limit: TokenBucket | None = None,
+    ) -> None:
         self.api = api
+        if metadata_limit is not None:
+            limit_metadata(api.session, metadata_limit)  # type: ignore[attr-defined]
+        # Versiones iCloud cuyas URLs se guardan en cada PhotoAsset
+        self.versions = tuple(versions)
+        self.cache = cache
+        self.filters = filters
+        self._albums: dict[str, dict[str, object]] = {}
+        self.errors = 0  # errores de enumeración acumulados (ver Listing)
+        self.spool = UrlSpool()
+        # Assets cuya API no expone URLs: se descargan con el objeto de pyicloud ({id: asset})
+        self._refs: dict[str, object] = {}
+        # Listados en caché que se pueden volver a pedir ({clave: (load, álbum, id)}) y
+        # posiciones en el spool de las URLs renovadas de los que ya se relistaron
+        self._loaders: dict[str, tuple[Callable[[], object], Optional[str], Optional[str]]] = {}
+        self._fresh: dict[str, dict[str, int | None]] = {}
+        self._refresh_lock = threading.Lock()
 
-    def _iter_album_assets(self, album, album_name: Optional[str]) -> Iterator[PhotoAsset]:
-        # pyicloud-ipd exposes PhotoAsset with attributes. We stream original.
+    def download(self, asset: PhotoAsset, version: str = "original") -> Iterator[bytes]:
+        urls_at = asset.urls_at
+        cached = asset.listing is not None and asset.listing not in self._fresh  # URL del caché
+        if asset.listing is not None and not cached:
+            urls_at = self._fresh[asset.listing].get(asset.id, urls_at)
+        url = self.spool.get(urls_at).get(version)
+        if url is not None:
+            try:
+                resp = self.api.session.get(url, stream=True)  # type: ignore[attr-defined]
+                status = getattr(resp, "status_code", 200)
+            except Exception as e:
+                if not cached or status_of(e) not in EXPIRED_STATUS:
+                    raise
+                resp, status = None, status_of(e)
+            if status in EXPIRED_STATUS and cached:
+                # URL del caché caducada: se relista el álbum (una vez por ejecución) y se reintenta
+                if resp is not None:
+                    resp.close()
+                url = self.spool.get(self._refresh(asset.listing).get(asset.id)).get(version)
+                if url is None:
+                    raise LookupError(f"El asset {asset.id} ya no está en iCloud")
+                resp = self.api.session.get(url, stream=True)  # type: ignore[attr-defined]
+            resp.raise_for_status()
+        elif asset.id in self._refs:
+            resp = self._refs[asset.id].download(version)  # type: ignore[attr-defined]
+        else:
+            raise LookupError(f"El asset {asset.id} no tiene versión '{version}'")
+        return _iter_response(resp)
+
+    def _refresh(self, key: str) -> dict[str, int | None]:
+        # Vuelve a paginar el listado `key` y reescribe su entrada del caché, como mucho una vez
+        # por ejecución: los hilos que lleguen con otra URL caducada esperan y usan el resultado
+        with self._refresh_lock:
+            fresh = self._fresh.get(key)
+            if fresh is not None:
+                return fresh
+            load, album_name, album_id = self._loaders[key]
+            log.warning(f"URLs caducadas en el caché de {album_name or 'la fototeca'}; se vuelve a listar")
+            positions: dict[str, int | None] = {}
+            collection = load()
+            start = self.errors
+            with self.cache.writer(key, _marker(collection)) as put:
+                for rec, urls in self._album_records(collection, album_name, album_id, filtered=False):
+                    put(to_row(rec, urls))
+                    positions[rec.id] = rec.urls_at
+                if self.errors != start:
+                    put(None)
+            self._fresh[key] = positions
+            return positions
+
+    def _iter_album_assets(self, album, album_name: Optional[str], album_id: Optional[str] = None, **kw) -> Iterator[PhotoAsset]:
+        for rec, _ in self._album_records(album, album_name, album_id, **kw):
+            yield rec
+
+    def _album_records(
+        self,
+        album,
+        album_name: Optional[str],
+        album_id: Optional[str] = None,
+        *,
+        filtered: bool = True,
+        stop_before: float | None = None,
+    ) -> Iterator[tuple[PhotoAsset, tuple[tuple[str, str], ...]]]:
+        # pyicloud-ipd exposes PhotoAsset with attributes; sólo se conservan metadatos, y las
+        # URLs van al spool (se devuelven también para escribir el caché).
+        # Los filtros se aplican antes de construir el registro (y de extraer URLs).
+        # stop_before: el álbum se recorre del más reciente al más antiguo y se corta al llegar
+        # a un asset creado y añadido antes de esa fecha (ninguno posterior puede coincidir)
+        filters = self.filters if filtered else None
         for asset in album:
             try:
                 created = getattr(asset, "created", None) or getattr(asset, "added_date", None) or getattr(asset, "creation_date", None)
                 if created is None:
                     created = datetime.utcnow()
+                if stop_before is not None:
+                    added = getattr(asset, "added_date", None) or created
+                    if max(created.timestamp(), added.timestamp()) < stop_before:
+                        break
                 filename = getattr(asset, "filename", None) or f"{getattr(asset, 'id', 'asset')}.jpg"
                 ext = filename.split(".")[-1].lower()
 
-                def make_downloader(a=asset):
-                    def _dl() -> Iterator[bytes]:
-                        resp = a.download()  # type: ignore[attr-defined]
-                        if hasattr(resp, "iter_content"):
-                            yield from resp.iter_content(chunk_size=1024 * 1024)
-                        elif hasattr(resp, "raw") and hasattr(resp.raw, "stream"):
-                            yield from resp.raw.stream(1024 * 1024, decode_content=True)
-                        else:
-                            data = getattr(resp, "content", None) or getattr(resp, "data", None)
-                            if data:
-                                yield data
-                    return _dl
-
-                yield PhotoAsset(
-                    id=str(getattr(asset, "id", getattr(asset, "_asset_id", "unknown"))),
+                versions = getattr(asset, "versions", None) or {}
+                media = media_of(getattr(asset, "item_type", None), ext, versions)
+                if filters is not None and not filters.matches(created, media):
+                    continue
+                urls = _version_urls(versions, self.versions)
+                edit = None
+                if EDIT_VERSION in self.versions:
+                    try:
+                        found = edit_of(asset)
+                    except LookupError as e:
+                        log.warning("%s: %s; sólo se descarga el original", filename, e)
+                        found = None
+                    if found is not None:
+                        edit_ext, edit_url, edit_version, edit_size = found
+                        urls += ((EDIT_VERSION, edit_url),)
+                        edit = (EDIT_VERSION, edit_ext, edit_version, edit_size)
+                asset_id = str(getattr(asset, "id", getattr(asset, "_asset_id", "unknown")))
+                if not urls:
+                    self._refs[asset_id] = asset
+                rec = PhotoAsset(
+                    id=asset_id,
                     created=created,
                     filename=filename,
                     size=getattr(asset, "size", None),
                     album=album_name,
                     extension=ext,
-                    downloader=make_downloader(),
+                    source=self,
+                    urls_at=self.spool.add(urls),
+                    album_id=album_id,
+                    remote_version=remote_version_of(asset),
+                    edit=edit,
+                    media=media,
                 )
+                yield rec, urls
             except Exception as e:
-                log.warning(f"No se pudo procesar un asset del álbum {album_name}: {e}")
+                self.errors += 1
+                log.warning("No se pudo procesar un asset del álbum %s: %s", album_name, e)
 
-    def iter_library(self, recent: Optional[int] = None) -> Iterator[PhotoAsset]:
+    def _library(self):
         photos = self.api.photos  # type: ignore[attr-defined]
         # Prefer 'all' if exists, else fallback to albums['All Photos']
         try:
-            collection = photos.all  # type: ignore[attr-defined]
+            return photos.all  # type: ignore[attr-defined]
         except Exception:
-            collection = photos.albums.get("All Photos")  # type: ignore[attr-defined]
-        items = list(collection) if recent else collection
-        if recent and hasattr(items, "__len__"):
-            items = items[-recent:]
-        yield from self._iter_album_assets(items, album_name=None)
+            return photos.albums.get("All Photos")  # type: ignore[attr-defined]
+
+    def _smart_album(self, name: str):
+        try:
+            return self.api.photos.albums[name]  # type: ignore[attr-defined]
+        except KeyError:
+            # Versión de pyicloud sin esa carpeta: fototeca completa, filtrada en cliente
+            log.warning(f"Carpeta inteligente '{name}' no disponible; se filtra la fototeca completa")
+            return self._library()
+
+    def _cached_assets(self, key: str, album_name: Optional[str], album_id: Optional[str], load: Callable[[], object]) -> Iterator[PhotoAsset]:
+        # Listado de un álbum desde el caché en disco si sigue siendo válido; si no, se pagina
+        # la API y se reescribe la entrada mientras se consume
+        key = f"{key}|{','.join(self.versions)}"
+        self._loaders[key] = (load, album_name, album_id)
+        rows = self.cache.rows(key)
+        marker = None
+        collection = None
+        if rows is None:
+            collection = load()
+            marker = _marker(collection)
+            rows = self.cache.rows(key, marker, check_marker=True)
+        filters = self.filters
+        if rows is not None:
+            log.debug("Listado de %s servido desde caché", album_name or "fototeca")
+            for row in rows:
+                fields = from_row(row)
+                fields["media"] = fields["media"] or media_of(None, fields["extension"], {})
+                if filters is None or filters.matches(fields["created"], fields["media"]):
+                    urls_at = self.spool.add(fields.pop("urls"))
+                    yield PhotoAsset(**fields, album=album_name, album_id=album_id, source=self, urls_at=urls_at, listing=key)
+            return
+        # En caché va el listado completo; el filtro se aplica al consumirlo
+        start = self.errors
+        with self.cache.writer(key, marker) as put:
+            for rec, urls in self._album_records(collection, album_name, album_id, filtered=False):
+                put(to_row(rec, urls))
+                if filters is None or filters.matches(rec.created, rec.media):
+                    yield rec
+            if self.errors != start:
+                put(None)  # le faltan assets: no se guarda
+
+    def _collection_assets(self, key: str, album_name: Optional[str], album_id: Optional[str], load: Callable[[], object], recent: Optional[int]) -> Iterator[PhotoAsset]:
+        if self.cache is None:
+            items = load()
+            if recent and self.filters is None:
+                yield from self._iter_album_assets(list(items)[-recent:], album_name, album_id)
+                return
+            assets = self._iter_album_assets(items, album_name, album_id)
+        else:
+            assets = self._cached_assets(key, album_name, album_id, load)
+        # --recent: se recorre el listado completo (así queda en caché) y se quedan los N últimos
+        # que pasan los filtros
+        yield from deque(assets, maxlen=recent) if recent else assets
+
+    def _newest_assets(self, load: Callable[[], object], recent: Optional[int]) -> Iterator[PhotoAsset]:
+        # --since sin listado en caché: se pagina del más reciente hacia atrás y se corta en la
+        # fecha, así que el tráfico es proporcional a lo seleccionado. No se guarda en caché
+        # (es un listado parcial).
+        collection = load()
+        if getattr(collection, "direction", None) is None:
+            # Colección sin orden conocido: recorrido completo con el filtro
+            assets = self._iter_album_assets(collection, None, None)
+            yield from deque(assets, maxlen=recent) if recent else assets
+            return
+        collection = copy.copy(collection)
+        collection.direction = "DESCENDING"
+        assets = self._iter_album_assets(collection, None, None, stop_before=self.filters.since)
+        yield from islice(assets, recent) if recent else assets
+
+    def iter_library(self, recent: Optional[int] = None) -> Listing:
+        return Listing(self, self._iter_library(recent))
+
+    def _iter_library(self, recent: Optional[int]) -> Iterator[PhotoAsset]:
+        key, load = "__library__", self._library
+        filters = self.filters
+        if filters is not None and filters.media in SMART_ALBUMS:
+            # Vídeos/Live Photos: la carpeta inteligente ya viene filtrada del servidor
+            name = SMART_ALBUMS[filters.media]
+            key, load = f"__{filters.media}__", lambda: self._smart_album(name)
+        if filters is not None and filters.since is not None:
+            fresh = self.cache is not None and self.cache.is_fresh(f"{key}|{','.join(self.versions)}")
+            if not fresh:
+                yield from self._newest_assets(load, recent)
+                return
+        yield from self._collection_assets(key, None, None, load, recent)
 
     def list_shared_albums(self) -> list[tuple[str, object]]:
         photos = self.api.photos  # type: ignore[attr-defined]
@@ -88,24 +497,68 @@ class ICloudPhotos:
                 try:
                     if getattr(album, "is_shared", False):
                         albums.append((name, album))
-                except Exception:
+                except Exception as e:
+                    self.errors += 1
+                    log.warning(f"No se pudo leer el álbum {name}: {e}")
+        return albums
+
+    def list_normal_albums(self) -> list[tuple[str, object]]:
+        photos = self.api.photos  # type: ignore[attr-defined]
+        shared_names = {name for name, _ in self.list_shared_albums()}
+        smart = set(getattr(type(photos), "SMART_FOLDERS", {}) or {})
+        albums = []
+        for name, album in photos.albums.items():  # type: ignore[attr-defined]
+            if name in shared_names or name in smart:
+                continue
+            try:
+                if getattr(album, "is_shared", False):
                     continue
+            except Exception as e:
+                self.errors += 1
+                log.warning(f"No se pudo leer el álbum {name}: {e}")
+                continue
+            albums.append((name, album))
         return albums
 
-    def iter_shared(self, recent: Optional[int] = None, include: Optional[str] = None, exclude: Optional[str] = None) -> Iterator[PhotoAsset]:
+    def _album_objects(self, kind: str) -> dict[str, object]:
+        if kind not in self._albums:
+            lister = self.list_shared_albums if kind == "shared" else self.list_normal_albums
+            self._albums[kind] = dict(lister())
+        return self._albums[kind]
+
+    def album_index(self, kind: str, refresh: bool = False) -> list[tuple[str, str]]:
+        # [(nombre, clave)] de los álbumes "shared" o "normal"; desde caché si está fresco
+        if self.cache is not None and not refresh:
+            cached = self.cache.get_albums(kind)
+            if cached is not None:
+                return cached
+        start = self.errors
+        index = [(name, album_key(album, name)) for name, album in self._album_objects(kind).items()]
+        if self.cache is not None and self.errors == start:
+            self.cache.put_albums(kind, index)  # con álbumes ilegibles no se guarda
+        return index
+
+    def _iter_albums(self, kind: str, recent: Optional[int], include: Optional[str], exclude: Optional[str]) -> Iterator[PhotoAsset]:
         import re
 
-        albums = self.list_shared_albums()
         inc = re.compile(include) if include else None
         exc = re.compile(exclude) if exclude else None
 
-        for name, album in albums:
+        for name, key in self.album_index(kind):
             if inc and not inc.search(name):
                 continue
             if exc and exc.search(name):
                 continue
-            items = list(album) if recent else album
-            if recent and hasattr(items, "__len__"):
-                items = items[-recent:]
-            yield from self._iter_album_assets(items, album_name=name)
+            try:
+                yield from self._collection_assets(key, name, key, lambda name=name: self._album_objects(kind)[name], recent)
+            except KeyError:
+                # Índice en caché con un álbum que ya no existe (o renombrado): el listado
+                # queda incompleto
+                self.errors += 1
+                log.warning(f"El álbum {name} ya no existe en iCloud; se omite")
+
+    def iter_shared(self, recent: Optional[int] = None, include: Optional[str] = None, exclude: Optional[str] = None) -> Listing:
+        return Listing(self, self._iter_albums("shared", recent, include, exclude))
 
+    def iter_normal_albums(self, recent: Optional[int] = None, include: Optional[str] = None, exclude: Optional[str] = None) -> Listing:
+        return Listing(self, self._iter_albums("normal", recent, include, exclude))
@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import json
+from typing import IO, Any, Iterator
+
+
+# Plan de sincronización en JSON lines. Por cada destino (library/shared/albums):
+#  {"plan": {...}}     cabecera con lo necesario para aplicarlo (out_base, plantilla, versiones)
+#  {"source": ..., "key": ..., "target": ..., "size": ..., "reason": ...}   una línea por fichero
+#  {"summary": {...}}  totales por motivo y por álbum (ficheros y bytes)
+# Motivos: new (nunca descargado), changed (editado en iCloud), missing (el fichero en disco
+# no coincide con el estado), move (ya está en disco en otra ruta). Las copias a destinos
+# adicionales (MIRRORS) llevan "mirror": true y se suman aparte: son E/S local, no descargas.
+REASONS = ("new", "changed", "missing", "move")
+
+
+class PlanWriter:
+    def __init__(self, fh: IO[str], source: str, **settings: Any) -> None:
+        self.fh = fh
+        self.source = source
+        self.files = 0
+        self.bytes = 0
+        self.unknown_size = 0
+        self.copies = 0
+        self.copy_bytes = 0
+        self.reasons = {r: 0 for r in REASONS}
+        self.albums: dict[str, dict[str, int]] = {}
+        self._write({"plan": {"source": source, **settings}})
+
+    def _write(self, record: dict) -> None:
+        self.fh.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+    def add(self, asset, key: str, version: str, target: str, size: int | None, reason: str, src: str | None = None, mirror: bool = False) -> None:
+        record = {
+            "source": self.source,
+            "key": key,
+            "asset_id": asset.id,
+            "album": asset.album,
+            "version": version,
+            "target": target,
+            "size": size,
+            "reason": reason,
+        }
+        if src is not None:
+            record["from"] = src
+        if mirror:
+            record["mirror"] = True
+        self._write(record)
+        self.files += 1
+        self.reasons[reason] += 1
+        album = self.albums.setdefault(asset.album or "", {"files": 0, "bytes": 0})
+        album["files"] += 1
+        # Los movimientos no descargan nada
+        if reason == "move":
+            return
+        if mirror:
+            self.copies += 1
+            self.copy_bytes += size or 0
+            return
+        if size is None:
+            self.unknown_size += 1
+        else:
+            self.bytes += size
+            album["bytes"] += size
+
+    def close(self) -> dict:
+        summary = {
+            "source": self.source,
+            "files": self.files,
+            "bytes": self.bytes,
+            "unknown_size": self.unknown_size,
+            "copies": self.copies,
+            "copy_bytes": self.copy_bytes,
+            "reasons": self.reasons,
+            "albums": self.albums,
+        }
+        self._write({"summary": summary})
+        self.fh.flush()
+        return summary
+
+
+def read_plan(path: str) -> Iterator[tuple[dict, dict[str, str]]]:
+    # (cabecera, {clave: ruta destino}) por cada destino del plan, en orden
+    header: dict | None = None
+    jobs: dict[str, str] = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for n, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                raise ValueError(f"{path}:{n}: línea del plan inválida") from None
+            if "plan" in record:
+                if header is not None:
+                    yield header, jobs
+                header, jobs = record["plan"], {}
+            elif "key" in record:
+                if header is None:
+                    raise ValueError(f"{path}:{n}: línea del plan sin cabecera")
+                jobs[record["key"]] = record["target"]
+    if header is not None:
+        yield header, jobs
+
+
+def human_bytes(n: float) -> str:
+    for unit in ("B", "KB", "MB", "GB", "TB"):
+        if n < 1024 or unit == "TB":
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} TB"
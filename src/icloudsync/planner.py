@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+import os
+import re
+import string
+from datetime import datetime
+
+from .utils import sanitize_filename
+
+
+# Directivas strftime según la granularidad que implican en la carpeta
+_MONTH_DIRECTIVES = set("YymbB")
+_DAY_DIRECTIVES = _MONTH_DIRECTIVES | set("dejaAUWwGVu")
+_DIRECTIVE = re.compile(r"%[-#_^0]?([A-Za-z%])")
+
+
+class PathPlanner:
+    # Renderiza rutas destino a partir de folder_template. La plantilla se valida una vez al
+    # crear el planner y la carpeta (formato + saneado del álbum) se cachea por
+    # (álbum, año, mes) —o por día si la plantilla baja a ese nivel—.
+    def __init__(self, folder_template: str) -> None:
+        self.folder_template = folder_template
+        self._granularity = self._validate(folder_template)
+        # Niveles de carpeta que genera la plantilla (para precargar el caché de carpetas)
+        stripped = folder_template.strip("/")
+        self.depth = stripped.count("/") + 1 if stripped else 0
+        self._cache: dict[tuple, str] = {}
+        self._dirs: dict[tuple[str, str], str] = {}
+
+    @staticmethod
+    def _validate(template: str) -> str | None:
+        directives: set[str] = set()
+        whole = False  # fecha sin formato ({} o {!s}): se renderiza con hora, minutos...
+        try:
+            for _, field, spec, conversion in string.Formatter().parse(template):
+                if field is None:
+                    continue
+                if field not in ("", "0", "album"):
+                    raise ValueError(f"campo desconocido '{{{field}}}'")
+                if field != "album":
+                    whole = whole or not spec or conversion is not None
+                    directives.update(_DIRECTIVE.findall(spec or ""))
+            template.format(datetime(2000, 1, 2, 3, 4, 5), album="album")
+        except (ValueError, KeyError, IndexError) as e:
+            raise ValueError(f"Plantilla de carpetas inválida '{template}': {e}") from None
+        if whole:
+            return None
+        directives.discard("%")
+        if directives <= _MONTH_DIRECTIVES:
+            return "month"
+        if directives <= _DAY_DIRECTIVES:
+            return "day"
+        return None  # horas/minutos en la carpeta: sin caché
+
+    def folder(self, asset) -> str:
+        created: datetime = asset.created
+        if self._granularity is None:
+            return self.folder_template.format(created, album=sanitize_filename(asset.album or ""))
+        if self._granularity == "month":
+            key = (asset.album, created.year, created.month)
+        else:
+            key = (asset.album, created.year, created.month, created.day)
+        folder = self._cache.get(key)
+        if folder is None:
+            folder = self.folder_template.format(created, album=sanitize_filename(asset.album or ""))
+            self._cache[key] = folder
+        return folder
+
+    def directory(self, asset, base: str) -> str:
+        folder = self.folder(asset)
+        key = (base, folder)
+        path = self._dirs.get(key)
+        if path is None:
+            path = self._dirs[key] = os.path.join(base, folder)
+        return path
+
+    def target(self, asset, base: str, extension: str | None = None, suffix: str = "") -> str:
+        c: datetime = asset.created
+        # Equivalente a f"{c:%Y%m%d_%H%M%S}" sin pasar por strftime
+        fname = (
+            f"{c.year:04d}{c.month:02d}{c.day:02d}_{c.hour:02d}{c.minute:02d}{c.second:02d}"
+            f"_{asset.id}{suffix}.{extension or asset.extension}"
+        )
+        return os.path.join(self.directory(asset, base), sanitize_filename(fname))
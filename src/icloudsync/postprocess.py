@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+import contextlib
+import os
+
+try:
+    from PIL import Image, ImageOps
+except Exception:  # pragma: no cover - dependencia opcional
+    Image = None  # type: ignore
+    ImageOps = None  # type: ignore
+
+try:
+    from pillow_heif import register_heif_opener
+
+    register_heif_opener()
+    HEIF_SUPPORT = True
+except Exception:  # pragma: no cover - dependencia opcional
+    HEIF_SUPPORT = False
+
+
+# Trabajo CPU tras la descarga (en un ProcessPoolExecutor, fuera del GIL):
+#  jpeg: derivado JPEG de los HEIC/HEIF para clientes SMB y visores que no los abren
+#  thumb: miniatura JPEG local
+TASKS = ("jpeg", "thumb")
+HEIF_EXTENSIONS = (".heic", ".heif")
+IMAGE_EXTENSIONS = HEIF_EXTENSIONS + (".jpg", ".jpeg", ".png", ".tif", ".tiff", ".webp")
+
+
+def available() -> bool:
+    return Image is not None
+
+
+def derived_path(derived_base: str, task: str, out_base: str, source: str) -> str:
+    # Árbol paralelo: <derived>/<tarea>/<ruta relativa>.jpg
+    rel = os.path.splitext(os.path.relpath(source, out_base))[0] + ".jpg"
+    return os.path.join(derived_base, task, rel)
+
+
+def applicable(task: str, source: str) -> bool:
+    ext = os.path.splitext(source)[1].lower()
+    if task == "jpeg":
+        return ext in HEIF_EXTENSIONS and HEIF_SUPPORT
+    if ext in HEIF_EXTENSIONS:
+        return HEIF_SUPPORT
+    return ext in IMAGE_EXTENSIONS
+
+
+def _save_jpeg(img, dest: str, mtime: float, quality: int) -> None:
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    tmp = dest + ".part"
+    try:
+        img.convert("RGB").save(tmp, "JPEG", quality=quality)
+        os.replace(tmp, dest)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp)
+        raise
+    os.utime(dest, (mtime, mtime))
+
+
+def process(source: str, jobs: tuple[tuple[str, str], ...], thumb_size: int = 512) -> dict[str, str]:
+    # Se ejecuta en un proceso hijo: {tarea: ruta del derivado}; "" = no aplica a este fichero
+    done: dict[str, str] = {}
+    todo = [(task, dest) for task, dest in jobs if applicable(task, source)]
+    done.update({task: "" for task, _ in jobs if not applicable(task, source)})
+    if not todo:
+        return done
+    mtime = os.stat(source).st_mtime
+    with Image.open(source) as img:
+        img = ImageOps.exif_transpose(img)
+        for task, dest in todo:
+            if task == "jpeg":
+                _save_jpeg(img, dest, mtime, quality=90)
+            else:
+                thumb = img.copy()
+                thumb.thumbnail((thumb_size, thumb_size))
+                _save_jpeg(thumb, dest, mtime, quality=80)
+            done[task] = dest
+    return done
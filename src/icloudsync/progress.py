@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import logging
+import sys
+import threading
+import time
+from collections import deque
+
+try:
+    from tqdm import tqdm
+except Exception:  # pragma: no cover - dependencia opcional
+    tqdm = None  # type: ignore
+
+from .plan import human_bytes
+
+log = logging.getLogger(__name__)
+
+
+MODES = ("auto", "bar", "log", "off")
+
+# Segundos de historial con los que se calcula la velocidad (y la ETA)
+RATE_WINDOW = 60.0
+
+
+def _duration(seconds: float) -> str:
+    seconds = int(seconds)
+    h, rem = divmod(seconds, 3600)
+    return f"{h}h{rem // 60:02d}m" if h else f"{rem // 60}m{rem % 60:02d}s"
+
+
+class Progress:
+    # Progreso en vivo a partir del dict de contadores de sync_assets. Sólo el hilo principal
+    # escribe en él; este hilo sólo lee, así que no hace falta ningún lock por asset.
+    # Modo bar: barra tqdm (TTY); modo log: una línea de resumen cada `interval` segundos.
+    def __init__(self, counts: dict, label: str, mode: str = "auto", interval: float = 60.0) -> None:
+        if mode == "auto":
+            mode = "bar" if sys.stderr.isatty() and tqdm is not None else "log"
+        if mode == "bar" and tqdm is None:
+            mode = "log"
+        self.counts = counts
+        self.label = label
+        self.mode = mode
+        self.interval = interval
+        self._samples: deque[tuple[float, int]] = deque()  # (instante, bytes), ver _rate
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._bar = None
+        self._started = time.monotonic()
+
+    def __enter__(self) -> "Progress":
+        if self.mode == "off":
+            return self
+        if self.mode == "bar":
+            self._bar = tqdm(desc=self.label, unit="B", unit_scale=True, unit_divisor=1024, dynamic_ncols=True, leave=True)
+        self._thread = threading.Thread(target=self._run, name="icloudsync-progress", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._tick(final=True)
+        if self._bar is not None:
+            self._bar.close()
+
+    def _run(self) -> None:
+        last_log = time.monotonic()
+        while not self._stop.wait(1.0):
+            if self.mode == "bar":
+                self._tick()
+            elif time.monotonic() - last_log >= self.interval:
+                last_log = time.monotonic()
+                self._tick()
+
+    def _rate(self, now: float, done: int) -> float:
+        # Media sobre los últimos RATE_WINDOW segundos, por tiempo y no por nº de muestras: la
+        # barra muestrea cada segundo y el modo log cada `interval`. Se conserva la muestra más
+        # reciente que cubre la ventana, así que con intervalos largos la media es la del último
+        self._samples.append((now, done))
+        while len(self._samples) > 2 and now - self._samples[1][0] >= RATE_WINDOW:
+            self._samples.popleft()
+        t0, b0 = self._samples[0]
+        if now - t0 < 1.0:
+            return 0.0
+        return (done - b0) / (now - t0)
+
+    def _tick(self, final: bool = False) -> None:
+        c = self.counts
+        now = time.monotonic()
+        done = c.get("bytes", 0)
+        rate = self._rate(now, done) if not final else done / max(1e-6, now - self._started)
+        # ETA con los tamaños conocidos de lo ya encolado; si aún se está listando es un mínimo
+        remaining = max(0, c.get("bytes_queued", 0) - c.get("bytes_sized", 0))
+        eta = remaining / rate if rate > 0 else None
+        finished = c.get("downloaded", 0) + c.get("previews", 0)
+        status = (
+            f"listados {c.get('enumerated', 0)}, al día {c.get('skipped', 0)}, encolados {c.get('queued', 0)}, "
+            f"hechos {finished}, errores {c.get('errors', 0)}"
+        )
+        if self._bar is not None:
+            self._bar.total = max(c.get("bytes_queued", 0), done) or None
+            self._bar.n = done
+            self._bar.set_postfix_str(status, refresh=False)
+            self._bar.refresh()
+            return
+        speed = f"{human_bytes(rate)}/s"
+        if final:
+            log.info("Progreso %s: %s; %s en %s (%s)", self.label, status, human_bytes(done), _duration(now - self._started), speed)
+            return
+        eta_s = "?" if eta is None else _duration(eta) + ("" if c.get("listing_done") else "+")
+        log.info("Progreso %s: %s; %s a %s, ETA %s", self.label, status, human_bytes(done), speed, eta_s)
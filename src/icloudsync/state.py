@@ -1,10 +1,15 @@
 from __future__ import annotations
 
+import contextlib
+import fcntl
 import json
 import os
 import time
-from dataclasses import dataclass, asdict
-from typing import Dict, Optional
+from dataclasses import MISSING, dataclass, asdict, fields
+from typing import Dict, Iterator, Optional
+
+from .storage import LOCAL, Storage
+from .utils import ensure_dir
 
 
 @dataclass
@@ -14,35 +19,101 @@ class AssetEntry:
     size: int | None = None
     checksum: str | None = None
     last_seen: float = 0.0
+    scope: str | None = None  # out_base de la sincronización que lo escribió
+    remote_version: str | None = None  # ver photos.remote_version_of
+    created: float | None = None  # fecha de la foto (para estadísticas por año/mes)
+    album: str | None = None
+    derived: dict | None = None  # {tarea de post-proceso: ruta del derivado}; "" = no aplica
+    seen_run: int = 0  # nº de la última ejecución completa de su ámbito que lo listó
+
+
+_ENTRY_FIELDS = {f.name for f in fields(AssetEntry)}
+# Valores por defecto: no se escriben en disco (el estado ocupa bastante menos)
+_ENTRY_DEFAULTS = {f.name: f.default for f in fields(AssetEntry) if f.default is not MISSING}
+
+
+def _compact(entry: AssetEntry) -> dict:
+    return {k: v for k, v in asdict(entry).items() if k not in _ENTRY_DEFAULTS or v != _ENTRY_DEFAULTS[k]}
+
+
+def same_version(stored: str, remote: str) -> bool:
+    # Las entradas antiguas guardaban original:edición:ajuste en un solo token; están al día
+    # si coincide la parte que corresponde a la clave (original, o edición:ajuste)
+    if stored == remote:
+        return True
+    if stored.count(":") == 2:
+        return remote in stored.split(":", 1)
+    return False
 
 
 class StateDB:
     def __init__(self, state_path: str) -> None:
         self.state_path = state_path
         self._data: Dict[str, AssetEntry] = {}
+        self._dirty: set[str] = set()
+        self._removed: set[str] = set()
+        # Último error por clave (se borra al descargarse bien) y resumen de la última
+        # ejecución por ámbito; cambios pendientes de fusionar al guardar (None = borrar)
+        self._failures: Dict[str, dict] = {}
+        self._runs: Dict[str, dict] = {}
+        self._meta_changes: Dict[tuple[str, str], Optional[dict]] = {}
         self._loaded = False
 
-    def load(self) -> None:
-        if self._loaded:
-            return
-        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+    @contextlib.contextmanager
+    def _locked(self) -> Iterator[None]:
+        # Lock exclusivo entre procesos/pods que comparten el mismo state.json (shards)
+        with open(self.state_path + ".lock", "a") as lf:
+            fcntl.flock(lf.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lf.fileno(), fcntl.LOCK_UN)
+
+    def _read_disk(self) -> tuple[Dict[str, AssetEntry], Dict[str, dict], Dict[str, dict]]:
+        data: Dict[str, AssetEntry] = {}
         if os.path.exists(self.state_path):
             try:
                 with open(self.state_path, "r", encoding="utf-8") as f:
                     raw = json.load(f)
                 for k, v in raw.get("assets", {}).items():
-                    self._data[k] = AssetEntry(**v)
+                    data[k] = AssetEntry(**{f: x for f, x in v.items() if f in _ENTRY_FIELDS})
+                return data, raw.get("failures", {}), raw.get("runs", {})
             except Exception:
-                self._data = {}
+                return {}, {}, {}
+        return data, {}, {}
+
+    def load(self) -> None:
+        if self._loaded:
+            return
+        ensure_dir(os.path.dirname(self.state_path))
+        self._data, self._failures, self._runs = self._read_disk()
         self._loaded = True
 
     def save(self) -> None:
-        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
-        payload = {"assets": {k: asdict(v) for k, v in self._data.items()} }
-        tmp_path = self.state_path + ".tmp"
-        with open(tmp_path, "w", encoding="utf-8") as f:
-            json.dump(payload, f)
-        os.replace(tmp_path, self.state_path)
+        ensure_dir(os.path.dirname(self.state_path))
+        with self._locked():
+            # Relee lo que otros workers hayan guardado y aplica encima sólo nuestros cambios
+            merged, failures, runs = self._read_disk()
+            for k in self._dirty:
+                if k in self._data:
+                    merged[k] = self._data[k]
+            for k in self._removed:
+                merged.pop(k, None)
+            for (section, k), value in self._meta_changes.items():
+                target = failures if section == "failures" else runs
+                if value is None:
+                    target.pop(k, None)
+                else:
+                    target[k] = value
+            payload = {"assets": {k: _compact(v) for k, v in merged.items()}, "failures": failures, "runs": runs}
+            tmp_path = self.state_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(payload, f, separators=(",", ":"))
+            os.replace(tmp_path, self.state_path)
+        self._data, self._failures, self._runs = merged, failures, runs
+        self._dirty.clear()
+        self._removed.clear()
+        self._meta_changes.clear()
 
     def get(self, asset_id: str) -> Optional[AssetEntry]:
         self.load()
@@ -51,9 +122,96 @@ class StateDB:
     def upsert(self, entry: AssetEntry) -> None:
         self.load()
         entry.last_seen = time.time()
+        # Recién escrita: cuenta como vista en la última ejecución completa de su ámbito
+        entry.seen_run = max(entry.seen_run, (self._runs.get(entry.scope) or {}).get("seq", 0))
         self._data[entry.asset_id] = entry
+        self._dirty.add(entry.asset_id)
+        self._removed.discard(entry.asset_id)
+        if entry.asset_id in self._failures:
+            self._failures.pop(entry.asset_id)
+            self._meta_changes[("failures", entry.asset_id)] = None
 
-    def exists_same(self, asset_id: str, path: str, size: int | None) -> bool:
+    def remove(self, asset_id: str) -> None:
+        self.load()
+        self._data.pop(asset_id, None)
+        self._dirty.discard(asset_id)
+        self._removed.add(asset_id)
+        if self._failures.pop(asset_id, None) is not None:
+            self._meta_changes[("failures", asset_id)] = None
+
+    def entries(self) -> list[AssetEntry]:
+        self.load()
+        return list(self._data.values())
+
+    def record_failure(self, asset_id: str, path: str, kind: str, error: str) -> None:
+        self.load()
+        prev = self._failures.get(asset_id) or {}
+        failure = {"path": path, "kind": kind, "error": error, "at": time.time(), "count": prev.get("count", 0) + 1}
+        self._failures[asset_id] = failure
+        self._meta_changes[("failures", asset_id)] = failure
+
+    def failures(self) -> Dict[str, dict]:
+        self.load()
+        return dict(self._failures)
+
+    def record_run(self, scope: str, summary: dict, complete: bool = False) -> int:
+        # seq cuenta sólo las ejecuciones con listado completo: son las que permiten saber
+        # qué entradas ya no están en iCloud (ver mark_seen y gc)
+        self.load()
+        seq = (self._runs.get(scope) or {}).get("seq", 0) + (1 if complete else 0)
+        run = {"finished_at": time.time(), **summary, "seq": seq}
+        self._runs[scope] = run
+        self._meta_changes[("runs", scope)] = run
+        return seq
+
+    def mark_seen(self, scope: str, seen: set[str], seq: int) -> None:
+        # seen: claves base (sin #versión) listadas en la ejecución completa `seq` de scope
+        self.load()
+        for key, entry in self._data.items():
+            if entry.scope == scope and entry.seen_run != seq and key.split("#", 1)[0] in seen:
+                entry.seen_run = seq
+                self._dirty.add(key)
+
+    def stale(self, runs: int, scope: str | None = None, check_files: bool = False) -> list[str]:
+        # Entradas que no han aparecido en las últimas `runs` ejecuciones completas de su
+        # ámbito (borradas en iCloud) y, con check_files, las cuyo fichero ya no existe
+        self.load()
+        out = []
+        for key, entry in self._data.items():
+            if scope is not None and entry.scope != scope:
+                continue
+            seq = (self._runs.get(entry.scope) or {}).get("seq", 0) if entry.scope else 0
+            if runs > 0 and seq and seq - entry.seen_run >= runs:
+                out.append(key)
+            elif check_files and not os.path.exists(entry.path):
+                out.append(key)
+        return out
+
+    def gc(self, runs: int, scope: str | None = None, check_files: bool = False, dry_run: bool = False) -> int:
+        # Retira del estado (no del disco) las entradas obsoletas; el guardado siguiente compacta
+        stale = self.stale(runs, scope, check_files)
+        if not dry_run:
+            for key in stale:
+                self.remove(key)
+        return len(stale)
+
+    def runs(self) -> Dict[str, dict]:
+        self.load()
+        return dict(self._runs)
+
+    def is_current(self, asset_id: str, path: str, size: int | None, remote_version: str | None, storage: Storage = LOCAL) -> bool:
+        # Con versión remota conocida en ambos lados manda la versión, no el tamaño anunciado
+        self.load()
+        cur = self._data.get(asset_id)
+        if cur and cur.path == path and remote_version and cur.remote_version:
+            if not same_version(cur.remote_version, remote_version):
+                return False
+            actual = storage.size(path)
+            return actual is not None and (cur.size is None or actual == cur.size)
+        return self.exists_same(asset_id, path, size, storage)
+
+    def exists_same(self, asset_id: str, path: str, size: int | None, storage: Storage = LOCAL) -> bool:
+        # storage: dónde comprobar el fichero (stat local, o listado/HEAD en S3)
         self.load()
         cur = self._data.get(asset_id)
         if not cur:
@@ -63,13 +221,8 @@ class StateDB:
         if size is not None and cur.size is not None and size != cur.size:
             return False
         # If file exists on disk and matches recorded size, consider present
-        if os.path.exists(path):
-            if size is None:
-                return True
-            try:
-                st = os.stat(path)
-                return st.st_size == size
-            except Exception:
-                return False
-        return False
+        actual = storage.size(path)
+        if actual is None:
+            return False
+        return size is None or actual == size
 
@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import os
+from datetime import datetime, timezone
+from typing import Optional
+
+from .cache import MetadataCache
+from .mtimes import timestamp_from_name
+from .state import StateDB
+
+
+LIBRARY = "(fototeca)"
+
+
+def _period(entry, by: str) -> str:
+    # En UTC, como las carpetas y nombres que genera el planner
+    ts = entry.created
+    if ts is None:
+        # Entradas anteriores a guardar la fecha: la del nombre del fichero
+        ts = timestamp_from_name(os.path.basename(entry.path), timezone.utc)
+        if ts is None:
+            return "?"
+    dt = datetime.fromtimestamp(ts, timezone.utc)
+    return f"{dt:%Y-%m}" if by == "month" else f"{dt:%Y}"
+
+
+def _bump(bucket: dict, name: str, size: int | None) -> None:
+    row = bucket.setdefault(name, {"files": 0, "bytes": 0})
+    row["files"] += 1
+    row["bytes"] += size or 0
+
+
+def collect(state: StateDB, cache: Optional[MetadataCache] = None, by: str = "year") -> dict:
+    # Todo sale del state.json (y de los listados en caché para lo pendiente): ni se
+    # recorre el árbol de ficheros ni se consulta iCloud
+    album_names = cache.album_names() if cache is not None else {}
+    entries = state.entries()
+    totals = {"files": 0, "bytes": 0, "previews": 0, "previews_bytes": 0}
+    scopes: dict[str, dict] = {}
+    periods: dict[str, dict] = {}
+    albums: dict[str, dict] = {}
+    for e in entries:
+        base, _, variant = e.asset_id.partition("#")
+        if variant in ("thumb", "medium"):
+            totals["previews"] += 1
+            totals["previews_bytes"] += e.size or 0
+            continue
+        scope = scopes.setdefault(e.scope or "?", {"files": 0, "bytes": 0, "last_write": 0.0})
+        scope["files"] += 1
+        scope["bytes"] += e.size or 0
+        scope["last_write"] = max(scope["last_write"], e.last_seen or 0.0)
+        if "#@" in e.asset_id:
+            continue  # copia en un destino adicional (MIRRORS): sólo cuenta en su destino
+        totals["files"] += 1
+        totals["bytes"] += e.size or 0
+        _bump(periods, _period(e, by), e.size)
+        album_id = base.rsplit("/", 1)[0] if "/" in base else None
+        _bump(albums, e.album or album_names.get(album_id or "", album_id) or LIBRARY, e.size)
+
+    failures = state.failures()
+    by_kind: dict[str, int] = {}
+    for f in failures.values():
+        by_kind[f.get("kind", "?")] = by_kind.get(f.get("kind", "?"), 0) + 1
+    recent_failures = sorted(failures.items(), key=lambda kv: kv[1].get("at", 0), reverse=True)[:10]
+
+    pending = None
+    if cache is not None:
+        # Assets de los últimos listados que aún no están en el estado (sólo originales)
+        known = {e.asset_id for e in entries}
+        seen: set[str] = set()
+        pending = {"files": 0, "bytes": 0, "unknown_size": 0, "listed_at": None}
+        for key, listed_at, rows in cache.listings():
+            album_id = key.rsplit("|", 1)[0]
+            for row in rows:
+                # __library__ y las carpetas inteligentes de --media (__video__, __live__)
+                skey = row[0] if album_id.startswith("__") else f"{album_id}/{row[0]}"
+                if skey in known or skey in seen:
+                    continue
+                seen.add(skey)
+                pending["files"] += 1
+                if row[3] is None:
+                    pending["unknown_size"] += 1
+                else:
+                    pending["bytes"] += row[3]
+            pending["listed_at"] = min(pending["listed_at"] or listed_at, listed_at)
+
+    return {
+        "totals": totals,
+        "scopes": scopes,
+        "runs": state.runs(),
+        "periods": dict(sorted(periods.items())),
+        "albums": dict(sorted(albums.items(), key=lambda kv: -kv[1]["bytes"])),
+        "failures": {"count": len(failures), "by_kind": by_kind, "recent": dict(recent_failures)},
+        "pending": pending,
+    }
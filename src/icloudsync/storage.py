@@ -0,0 +1,247 @@
+from __future__ import annotations
+
+import abc
+import contextlib
+import os
+import threading
+from typing import IO, Iterator
+
+try:
+    import boto3
+except Exception:  # pragma: no cover - dependencia opcional
+    boto3 = None  # type: ignore
+
+from .utils import apply_tree_permissions, atomic_write, ensure_dir, seed_known_dirs
+
+
+# Tamaño de cada parte del multipart (S3 exige >= 5 MiB salvo la última): es también la
+# memoria máxima que retiene una transferencia
+PART_SIZE = 8 * 1024 * 1024
+
+
+class Storage(abc.ABC):
+    # Destino de las descargas. Las rutas son cadenas: locales o s3://bucket/prefijo/...
+    # Un backend incompleto falla al crearlo, no a mitad de una sincronización
+    local = True
+
+    @abc.abstractmethod
+    def scope(self, root: str) -> str:
+        ...
+
+    @abc.abstractmethod
+    def prepare(self, root: str, depth: int) -> None:
+        ...
+
+    @abc.abstractmethod
+    def writer(self, path: str, mtime: float | None = None) -> contextlib.AbstractContextManager:
+        # Escritura atómica: el fichero sólo aparece si el bloque termina sin error
+        ...
+
+    @abc.abstractmethod
+    def reader(self, path: str) -> IO[bytes]:
+        ...
+
+    @abc.abstractmethod
+    def size(self, path: str) -> int | None:
+        # Tamaño del fichero; None si no existe
+        ...
+
+    @abc.abstractmethod
+    def replace(self, src: str, dst: str) -> None:
+        ...
+
+    @abc.abstractmethod
+    def remove(self, path: str) -> None:
+        ...
+
+    def finalize(self, root: str, umask: str, chown: str | None) -> None:
+        pass
+
+
+class LocalStorage(Storage):
+    # Sistema de ficheros local/SMB/NFS: temporal en la misma carpeta + os.replace
+    local = True
+
+    def scope(self, root: str) -> str:
+        return os.path.abspath(root)
+
+    def prepare(self, root: str, depth: int) -> None:
+        ensure_dir(root)
+        seed_known_dirs(root, depth)
+
+    @contextlib.contextmanager
+    def writer(self, path: str, mtime: float | None = None) -> Iterator[IO[bytes]]:
+        with atomic_write(path, mode="wb") as (_, tmp):
+            yield tmp
+
+    def reader(self, path: str) -> IO[bytes]:
+        return open(path, "rb")
+
+    def size(self, path: str) -> int | None:
+        try:
+            return os.stat(path).st_size
+        except OSError:
+            return None
+
+    def replace(self, src: str, dst: str) -> None:
+        ensure_dir(os.path.dirname(dst))
+        os.replace(src, dst)
+
+    def remove(self, path: str) -> None:
+        os.remove(path)
+
+    def finalize(self, root: str, umask: str, chown: str | None) -> None:
+        apply_tree_permissions(root, umask=umask, chown=chown)
+
+
+LOCAL = LocalStorage()
+
+
+def split_url(url: str) -> tuple[str, str]:
+    # s3://bucket/a/b → ("bucket", "a/b")
+    bucket, _, key = url[len("s3://"):].partition("/")
+    return bucket, key
+
+
+def _not_found(e: Exception) -> bool:
+    code = (getattr(e, "response", None) or {}).get("Error", {}).get("Code")
+    return code in ("404", "NoSuchKey", "NotFound")
+
+
+class _MultipartUpload:
+    # Sube según llegan los bytes en partes de part_size; si el objeto no llega a una parte
+    # se envía con un único PUT. El objeto sólo es visible al completar (atómico)
+    def __init__(self, client, bucket: str, key: str, part_size: int, metadata: dict[str, str]) -> None:
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.metadata = metadata
+        self.buf = bytearray()
+        self.parts: list[dict] = []
+        self.upload_id: str | None = None
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        self.buf += data
+        self.size += len(data)
+        while len(self.buf) >= self.part_size:
+            self._upload_part(bytes(self.buf[: self.part_size]))
+            del self.buf[: self.part_size]
+        return len(data)
+
+    def _upload_part(self, body: bytes) -> None:
+        if self.upload_id is None:
+            resp = self.client.create_multipart_upload(Bucket=self.bucket, Key=self.key, Metadata=self.metadata)
+            self.upload_id = resp["UploadId"]
+        number = len(self.parts) + 1
+        resp = self.client.upload_part(Bucket=self.bucket, Key=self.key, PartNumber=number, UploadId=self.upload_id, Body=body)
+        self.parts.append({"ETag": resp["ETag"], "PartNumber": number})
+
+    def commit(self) -> None:
+        if self.upload_id is None:
+            self.client.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self.buf), Metadata=self.metadata)
+            return
+        if self.buf:
+            self._upload_part(bytes(self.buf))
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, MultipartUpload={"Parts": self.parts}
+        )
+
+    def abort(self) -> None:
+        if self.upload_id is not None:
+            with contextlib.suppress(Exception):
+                self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+
+
+class S3Storage(Storage):
+    # Almacén de objetos compatible con S3 (AWS, MinIO...). Credenciales por las variables
+    # estándar de AWS (AWS_ACCESS_KEY_ID, ...). Sin carpetas, permisos ni mtime: la fecha de
+    # la foto va en los metadatos (x-amz-meta-mtime)
+    local = False
+
+    def __init__(self, endpoint_url: str | None = None, part_size: int = PART_SIZE, client=None) -> None:
+        if client is None:
+            if boto3 is None:
+                raise RuntimeError("Destino s3:// sin boto3 (pip install icloudsync[s3])")
+            client = boto3.client("s3", endpoint_url=endpoint_url)
+        self.client = client
+        self.part_size = max(5 * 1024 * 1024, part_size)
+        # Tamaños de lo listado o subido en esta ejecución; los prefijos listados responden a
+        # la existencia sin un HEAD por asset
+        self._sizes: dict[str, int] = {}
+        self._listed: list[str] = []
+        self._lock = threading.Lock()
+
+    def scope(self, root: str) -> str:
+        return root.rstrip("/")
+
+    def _covered(self, path: str) -> bool:
+        return any(path.startswith(prefix + "/") for prefix in self._listed)
+
+    def prepare(self, root: str, depth: int) -> None:
+        # Un listado paginado (1000 claves por petición) de todo el prefijo
+        root = self.scope(root)
+        if root in self._listed or self._covered(root):
+            return
+        bucket, prefix = split_url(root)
+        sizes = {}
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=bucket, Prefix=f"{prefix}/" if prefix else ""):
+            for obj in page.get("Contents", ()):
+                sizes[f"s3://{bucket}/{obj['Key']}"] = obj["Size"]
+        with self._lock:
+            self._sizes.update(sizes)
+            self._listed.append(root)
+
+    @contextlib.contextmanager
+    def writer(self, path: str, mtime: float | None = None) -> Iterator[_MultipartUpload]:
+        bucket, key = split_url(path)
+        upload = _MultipartUpload(self.client, bucket, key, self.part_size, {"mtime": str(int(mtime))} if mtime else {})
+        try:
+            yield upload
+            upload.commit()
+        except BaseException:
+            upload.abort()
+            raise
+        with self._lock:
+            self._sizes[path] = upload.size
+
+    def reader(self, path: str) -> IO[bytes]:
+        bucket, key = split_url(path)
+        return self.client.get_object(Bucket=bucket, Key=key)["Body"]
+
+    def size(self, path: str) -> int | None:
+        with self._lock:
+            if path in self._sizes:
+                return self._sizes[path]
+            if self._covered(path):
+                return None
+        bucket, key = split_url(path)
+        try:
+            return self.client.head_object(Bucket=bucket, Key=key)["ContentLength"]
+        except Exception as e:
+            if _not_found(e):
+                return None
+            raise
+
+    def replace(self, src: str, dst: str) -> None:
+        # Sin rename en S3: copia en el servidor (multipart si es grande) y borrado
+        src_bucket, src_key = split_url(src)
+        bucket, key = split_url(dst)
+        self.client.copy({"Bucket": src_bucket, "Key": src_key}, bucket, key)
+        self.client.delete_object(Bucket=src_bucket, Key=src_key)
+        with self._lock:
+            size = self._sizes.pop(src, None)
+            if size is not None:
+                self._sizes[dst] = size
+
+    def remove(self, path: str) -> None:
+        bucket, key = split_url(path)
+        self.client.delete_object(Bucket=bucket, Key=key)
+        with self._lock:
+            self._sizes.pop(path, None)
+
+
+def storage_for(root: str, endpoint_url: str | None = None, part_size: int = PART_SIZE) -> Storage:
+    return S3Storage(endpoint_url, part_size) if root.startswith("s3://") else LOCAL
@@ -1,40 +1,363 @@
 from __future__ import annotations
 
+import contextlib
 import logging
+import multiprocessing
 import os
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from datetime import datetime
-from typing import Iterable, Optional
+import heapq
+import itertools
+import random
+import shutil
+import threading
+import time
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from typing import Iterable, Iterator, Optional
 
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
-
-from .state import StateDB, AssetEntry
-from .utils import atomic_write, sanitize_filename, mtime_from_exif, set_mtime, apply_tree_permissions
+from . import postprocess as postprocessing
+from .breaker import ASSET, AUTH, DISK, CircuitBreaker, CircuitOpen, classify_error
+from .plan import PlanWriter, human_bytes
+from .planner import PathPlanner
+from .progress import Progress
+from .state import StateDB, AssetEntry, same_version
+from .storage import LOCAL, Storage
+from .throttle import TokenBucket
+from .utils import atomic_write, forget_dir, free_bytes, mtime_from_exif, remove_stale_temps, set_mtime
 
 log = logging.getLogger(__name__)
 
 
+# Versiones que expone iCloud por asset; thumb/medium son JPEG pequeños en fotos (y Live
+# Photos), pero en vídeos son vídeos reducidos: esos no van al árbol de previews
+VERSIONS = ("thumb", "medium", "original")
+PREVIEW_VERSIONS = ("thumb", "medium")
+# Qué hacer con fotos editadas en iCloud: original sin editar, sólo la edición, o ambas
+EDIT_MODES = ("original", "edited", "both")
+
+
 class DownloadError(Exception):
     pass
 
 
-def _target_path_for(asset, out_base: str, folder_template: str) -> str:
-    created: datetime = asset.created
-    subfolder = folder_template.format(created, album=sanitize_filename(asset.album or ""))
-    fname_base = f"{created:%Y%m%d_%H%M%S}_{asset.id}.{asset.extension}"
-    return os.path.join(out_base, subfolder, sanitize_filename(fname_base))
+# Tope de espera entre reintentos de un mismo asset
+RETRY_MAX_DELAY = 300.0
 
 
-@retry(reraise=True, stop=stop_after_attempt(5), wait=wait_exponential(multiplier=1, min=1, max=30), retry=retry_if_exception_type(DownloadError))
-def _download_one(asset, path: str) -> tuple[str, int | None]:
-    bytes_written = 0
-    with atomic_write(path, mode="wb") as (_, tmp):
-        for chunk in asset.downloader():
-            if not chunk:
-                continue
-            tmp.write(chunk)
-            bytes_written += len(chunk)
-    return path, bytes_written
+def retry_delay(attempt: int, backoff: float) -> float:
+    # Espera antes del reintento nº attempt: backoff ** attempt (con tope) y jitter entre la
+    # mitad y el total, para que los fallos de una misma ráfaga no se reintenten a la vez
+    delay = min(RETRY_MAX_DELAY, backoff**attempt)
+    return delay * random.uniform(0.5, 1.0)
+
+# Si el reconcile fuese a retirar más de esta fracción del ámbito, se asume un listado
+# incompleto (errores de la API) y no se toca nada
+RECONCILE_MAX_FRACTION = 0.5
+
+# Control de espacio: tamaño supuesto de lo que iCloud no anuncia y de cada
+# preview, y cada cuánto se vuelve a medir el espacio libre (otros procesos usan el disco)
+UNKNOWN_SIZE = 8 * 1024 * 1024
+PREVIEW_SIZE = 512 * 1024
+SPACE_CHECK_INTERVAL = 30.0
+
+# Temporales huérfanos de descargas interrumpidas: se buscan como mucho una vez al día y
+# sólo se borran los que llevan más de una hora sin tocarse
+TMP_SWEEP_INTERVAL = 24 * 3600
+TMP_MAX_AGE = 3600.0
+
+
+def _state_key(asset) -> str:
+    # Un mismo asset puede estar en la fototeca y en varios álbumes: se indexa por álbum
+    album_id = getattr(asset, "album_id", None)
+    return f"{album_id}/{asset.id}" if album_id else asset.id
+
+
+def _preview_key(key: str, version: str) -> str:
+    return f"{key}#{version}"
+
+
+def _mirror_key(key: str, mirror_scope: str) -> str:
+    # Copia en un destino adicional: entrada propia en el estado (su base sigue siendo la clave)
+    return f"{key}#@{mirror_scope}"
+
+
+def _main_jobs(asset, key: str, out_base: str, planner: PathPlanner, versions: tuple, edits: str):
+    # (clave de estado, ruta, versión iCloud, tamaño esperado) de lo que va por el carril principal
+    if "original" not in versions:
+        return []
+    edit = getattr(asset, "edit", None)
+    if edit and edits == "edited":
+        return [(key, planner.target(asset, out_base, extension=edit[1]), edit[0], edit[3])]
+    jobs = [(key, planner.target(asset, out_base), "original", asset.size)]
+    if edit and edits == "both":
+        jobs.append((f"{key}#edit", planner.target(asset, out_base, extension=edit[1], suffix="_edit"), edit[0], edit[3]))
+    return jobs
+
+
+def _job_size(asset, version: str) -> int | None:
+    # Tamaño anunciado de la versión (el de la edición viene en su propio recurso)
+    edit = getattr(asset, "edit", None)
+    if edit and version == edit[0]:
+        return edit[3]
+    return asset.size if version == "original" else None
+
+
+def _remote_version(asset, version: str) -> str | None:
+    # Huella de lo que se descarga: la edición lleva la suya, así que editar en iCloud no
+    # invalida el original (y al revés)
+    edit = getattr(asset, "edit", None)
+    if edit and version == edit[0]:
+        return edit[2]
+    return getattr(asset, "remote_version", None)
+
+
+def _is_current(state: StateDB, key: str, target: str, size: int | None, remote_version: str | None, scope: str, asset=None, storage: Storage = LOCAL) -> bool:
+    if not state.is_current(key, target, size, remote_version, storage):
+        return False
+    entry = state.get(key)
+    # Entradas antiguas (sin huella o con la combinada de original y edición) se actualizan
+    if entry is not None and ((remote_version and entry.remote_version != remote_version) or entry.scope is None or (asset is not None and entry.created is None)):
+        entry.remote_version = remote_version or entry.remote_version
+        entry.scope = entry.scope or scope
+        if asset is not None and entry.created is None:
+            entry.created = asset.created.timestamp()
+            entry.album = asset.album
+        state.upsert(entry)
+    return True
+
+
+def _lookup(state: StateDB, key: str, legacy_key: str, target: str):
+    entry = state.get(key)
+    if entry is None and legacy_key != key:
+        # Estados anteriores indexaban los álbumes sólo por asset id
+        legacy = state.get(legacy_key)
+        if legacy is not None and legacy.path == target:
+            entry = AssetEntry(asset_id=key, path=legacy.path, size=legacy.size, checksum=legacy.checksum, remote_version=legacy.remote_version)
+            state.upsert(entry)
+            state.remove(legacy_key)
+    return entry
+
+
+def _inside(path: str, root: str) -> bool:
+    return os.path.abspath(path).startswith(os.path.abspath(root) + os.sep)
+
+
+def _prune_empty_dirs(directory: str, stop: str) -> None:
+    # Borra carpetas vacías hacia arriba (p.ej. el álbum con el nombre antiguo) sin pasar de stop
+    stop = os.path.abspath(stop)
+    directory = os.path.abspath(directory)
+    while directory.startswith(stop + os.sep):
+        try:
+            os.rmdir(directory)
+        except OSError:
+            return
+        forget_dir(directory)
+        directory = os.path.dirname(directory)
+
+
+def _remove_derived(entry) -> None:
+    for path in (entry.derived or {}).values():
+        if path:
+            with contextlib.suppress(OSError):
+                os.remove(path)
+
+
+def _try_move(state: StateDB, entry, key: str, target: str, size: int | None, remote_version: str | None, scope: str, dry_run: bool, asset=None, storage: Storage = LOCAL) -> bool:
+    # El asset ya está en disco en otra ruta (álbum renombrado, cambio de plantilla): se mueve
+    if entry is None or entry.path == target:
+        return False
+    if remote_version and entry.remote_version and not same_version(entry.remote_version, remote_version):
+        return False
+    if os.path.splitext(entry.path)[1].lower() != os.path.splitext(target)[1].lower():
+        return False  # otra variante (original vs. edición): no es el mismo fichero
+    try:
+        current = storage.size(entry.path)
+        if current is None or (size is not None and current != size):
+            return False
+        if dry_run:
+            log.info("DRY-RUN: movería %s → %s", entry.path, target)
+            return True
+        storage.replace(entry.path, target)
+    except Exception as e:
+        log.warning("No se pudo mover %s → %s: %s", entry.path, target, e)
+        return False
+    if storage.local:
+        _prune_empty_dirs(os.path.dirname(entry.path), scope)
+    _remove_derived(entry)  # se regeneran con la ruta nueva
+    state.upsert(AssetEntry(asset_id=key, path=target, size=entry.size, checksum=entry.checksum, scope=scope, remote_version=remote_version or entry.remote_version, created=asset.created.timestamp() if asset is not None else entry.created, album=asset.album if asset is not None else entry.album))
+    return True
+
+
+def _reconcile(state: StateDB, scope: str, seen: set[str], quarantine_dir: str, dry_run: bool, storage: Storage = LOCAL) -> int:
+    # Entradas de este ámbito que ya no existen en iCloud: originales a cuarentena, previews fuera
+    gone = [e for e in state.entries() if e.scope == scope and e.asset_id.split("#", 1)[0] not in seen]
+    total = sum(1 for e in state.entries() if e.scope == scope)
+    if gone and len(gone) > total * RECONCILE_MAX_FRACTION:
+        log.warning(f"Reconcile cancelado: {len(gone)}/{total} assets desaparecidos en {scope}; ¿listado incompleto?")
+        return 0
+    removed = 0
+    for entry in gone:
+        if dry_run:
+            log.info("DRY-RUN: retiraría %s", entry.path)
+            removed += 1
+            continue
+        try:
+            if storage.size(entry.path) is not None:
+                if entry.asset_id.rsplit("#", 1)[-1] in PREVIEW_VERSIONS:
+                    storage.remove(entry.path)
+                else:
+                    dest = os.path.join(quarantine_dir, os.path.relpath(entry.path, scope))
+                    storage.replace(entry.path, dest)
+                    log.info("Cuarentena: %s → %s", entry.path, dest)
+                if storage.local:
+                    _prune_empty_dirs(os.path.dirname(entry.path), scope)
+            _remove_derived(entry)
+        except Exception as e:
+            log.warning("No se pudo retirar %s: %s", entry.path, e)
+            continue
+        state.remove(entry.asset_id)
+        removed += 1
+    return removed
+
+
+def _forget_stale(state: StateDB, scope: str, runs: int) -> int:
+    # Compactación tras una ejecución completa: fuera del estado lo que lleva `runs` ejecuciones
+    # sin aparecer (los ficheros no se tocan; para eso está reconcile)
+    stale = state.stale(runs, scope)
+    total = sum(1 for e in state.entries() if e.scope == scope)
+    if stale and len(stale) > total * RECONCILE_MAX_FRACTION:
+        log.warning(f"Limpieza del estado cancelada: {len(stale)}/{total} entradas obsoletas en {scope}; ¿listados incompletos?")
+        return 0
+    for key in stale:
+        state.remove(key)
+    if stale:
+        log.info(f"{len(stale)} entradas obsoletas retiradas del estado ({scope})")
+    return len(stale)
+
+
+def parse_shard(spec: str | None) -> tuple[int, int] | None:
+    # "i/N" con 0 <= i < N
+    if not spec:
+        return None
+    try:
+        idx_s, count_s = spec.split("/", 1)
+        idx, count = int(idx_s), int(count_s)
+    except ValueError:
+        raise ValueError(f"Shard inválido '{spec}': se espera 'i/N'")
+    if count < 1 or not 0 <= idx < count:
+        raise ValueError(f"Shard inválido '{spec}': se espera 0 <= i < N")
+    return idx, count
+
+
+def in_shard(asset, shard: tuple[int, int] | None, shard_by: str = "id") -> bool:
+    # Partición determinista (crc32 es estable entre procesos, a diferencia de hash())
+    if shard is None:
+        return True
+    idx, count = shard
+    key = f"{asset.created:%Y%m}" if shard_by == "month" else asset.id
+    return zlib.crc32(key.encode("utf-8")) % count == idx
+
+
+# Orden de descarga dentro de la ventana de lookahead
+ORDERS = ("newest", "oldest", "smallest", "listing")
+
+
+def _priority(asset, order: str):
+    if order == "newest":
+        return -asset.created.timestamp()
+    if order == "oldest":
+        return asset.created.timestamp()
+    return asset.size if asset.size is not None else float("inf")
+
+
+def prioritized(assets: Iterable, order: str = "newest", lookahead: int = 2000) -> Iterator:
+    # Reordena el listado en streaming: se retienen como mucho `lookahead` assets y sale
+    # siempre el de mayor prioridad, así lo reciente llega antes sin cargar todo en memoria
+    if order == "listing" or lookahead <= 1:
+        yield from assets
+        return
+    heap: list = []
+    seq = itertools.count()
+    for asset in assets:
+        heapq.heappush(heap, (_priority(asset, order), next(seq), asset))
+        if len(heap) >= lookahead:
+            yield heapq.heappop(heap)[2]
+    while heap:
+        yield heapq.heappop(heap)[2]
+
+
+def _abort(cm, exc: BaseException) -> None:
+    # Cierra un atomic_write abierto a mano descartando su temporal
+    cm.__exit__(type(exc), exc, exc.__traceback__)
+
+
+def _download_one(
+    asset,
+    path: str,
+    slots: Optional[threading.Semaphore] = None,
+    bandwidth: Optional[TokenBucket] = None,
+    version: str = "original",
+    mirrors: tuple[str, ...] = (),
+    storage: Storage = LOCAL,
+) -> tuple[str, int | None, dict[str, Exception]]:
+    # slots/bandwidth: presupuesto global compartido entre cuentas (ver cli._sync_accounts)
+    # mirrors: copias en otros destinos escritas desde el mismo flujo (una sola descarga), cada
+    # una con su temporal; la que falla se descarta sin afectar al resto ({ruta: error})
+    if slots is not None:
+        slots.acquire()
+    try:
+        bytes_written = 0
+        errors: dict[str, Exception] = {}
+        copies = {}
+        with storage.writer(path, asset.created.timestamp()) as tmp:
+            for mirror in mirrors:
+                cm = atomic_write(mirror, mode="wb")
+                try:
+                    copies[mirror] = (cm, cm.__enter__()[1])
+                except OSError as e:
+                    errors[mirror] = e
+            try:
+                for chunk in asset.downloader(version):
+                    if not chunk:
+                        continue
+                    if bandwidth is not None:
+                        bandwidth.consume(len(chunk))
+                    tmp.write(chunk)
+                    bytes_written += len(chunk)
+                    for mirror, (cm, f) in list(copies.items()):
+                        try:
+                            f.write(chunk)
+                        except OSError as e:
+                            errors[mirror] = e
+                            del copies[mirror]
+                            _abort(cm, e)
+            except BaseException as e:
+                for cm, _ in copies.values():
+                    _abort(cm, e)
+                raise
+            for mirror, (cm, _) in copies.items():
+                try:
+                    cm.__exit__(None, None, None)
+                except OSError as e:
+                    errors[mirror] = e
+        return path, bytes_written, errors
+    finally:
+        if slots is not None:
+            slots.release()
+
+
+def _copy_one(source: str, mirrors: tuple[str, ...], storage: Storage = LOCAL) -> tuple[str, int, dict[str, Exception]]:
+    # Copia a otros destinos de un fichero ya descargado: sólo E/S de disco, sin iCloud
+    size = storage.size(source)
+    if size is None:
+        raise FileNotFoundError(source)
+    errors: dict[str, Exception] = {}
+    for mirror in mirrors:
+        try:
+            with contextlib.closing(storage.reader(source)) as src, atomic_write(mirror, mode="wb") as (_, tmp):
+                shutil.copyfileobj(src, tmp, 1024 * 1024)
+        except OSError as e:
+            errors[mirror] = e
+    return source, size, errors
 
 
 def sync_assets(
@@ -47,56 +370,517 @@ def sync_assets(
     dry_run: bool = False,
     umask: str = "002",
     chown: Optional[str] = None,
+    slots: Optional[threading.Semaphore] = None,
+    bandwidth: Optional[TokenBucket] = None,
+    shard: tuple[int, int] | None = None,
+    shard_by: str = "id",
+    versions: Iterable[str] = ("original",),
+    previews_dir: Optional[str] = None,
+    preview_concurrency: int = 16,
+    reconcile: bool = False,
+    quarantine_dir: Optional[str] = None,
+    edits: str = "original",
+    retry_max: int = 5,
+    retry_backoff: float = 2.0,
+    plan: Optional[PlanWriter] = None,
+    only: Optional[dict[str, str]] = None,
+    postprocess: Iterable[str] = (),
+    postprocess_workers: Optional[int] = None,
+    derived_dir: Optional[str] = None,
+    thumb_size: int = 512,
+    progress: str = "off",
+    progress_interval: float = 60.0,
+    order: str = "newest",
+    lookahead: int = 2000,
+    full_listing: bool = False,
+    gc_runs: int = 0,
+    mirrors: Iterable[str] = (),
+    storage: Optional[Storage] = None,
+    min_free: int = 0,
 ) -> dict:
-    os.makedirs(out_base, exist_ok=True)
+    # plan: no se escribe nada; cada descarga/movimiento pendiente se vuelca al plan.
+    # only: {clave: destino} de un plan a aplicar; el resto de assets se ignora
+    # full_listing: assets es el listado completo del ámbito (sin filtros ni shards); sólo
+    # entonces se marca lo visto y, con gc_runs, se retira lo que lleva gc_runs sin aparecer.
+    # Si assets informa de errores de enumeración (photos.Listing) deja de considerarse completo
+    # mirrors: destinos adicionales con la misma estructura que out_base (originales/ediciones)
+    # storage: dónde está out_base (local por defecto, o S3); los mirrors son siempre locales
+    # min_free: bytes libres que se reservan en out_base; al llegar a ellos no se lanzan más
+    # descargas y lo pendiente queda para la próxima ejecución
+    dry_run = dry_run or plan is not None
+    planner = PathPlanner(folder_template)  # falla aquí, no por asset, si la plantilla es inválida
+    storage = storage or LOCAL
+    storage.prepare(out_base, planner.depth)
     state.load()
+    scope = storage.scope(out_base)
+    seen: set[str] = set()
+    versions = tuple(versions)
+    previews = [v for v in versions if v != "original"]
+    previews_base = previews_dir or os.path.join(out_base, ".previews")
+    for version in previews:
+        storage.prepare(os.path.join(previews_base, version), planner.depth)
+    mirror_scopes = []
+    for mirror in mirrors:
+        try:
+            LOCAL.prepare(mirror, planner.depth)
+        except OSError as e:
+            log.warning(f"Destino adicional {mirror} no disponible; se omite en esta ejecución: {e}")
+            continue
+        mirror_scopes.append(os.path.abspath(mirror))
+    swept_at = (state.runs().get(scope) or {}).get("tmp_swept_at", 0)
+    if storage.local and not dry_run and time.time() - swept_at >= TMP_SWEEP_INTERVAL:
+        swept_at = time.time()
+        extra = ((previews_base,) if previews else ()) + tuple(mirror_scopes)
+        sweep = [out_base] + [root for root in extra if not _inside(root, out_base)]
+        for root in sweep:
+            removed, freed = remove_stale_temps(root, TMP_MAX_AGE)
+            if removed:
+                log.info(f"{removed} temporales huérfanos borrados en {root} ({human_bytes(freed)})")
 
-    scheduled = []
-    skipped = 0
-    downloaded = 0
-    errors = 0
+    # Ventana de descargas en vuelo: los resultados se procesan según terminan, así que
+    # no se retienen todos los assets de la ejecución en memoria
+    max_inflight = max(1, concurrency) * 4 + (max(1, preview_concurrency) * 2 if previews else 0)
+    scheduled = {}
+    counts = {"skipped": 0, "downloaded": 0, "previews": 0, "moved": 0, "retried": 0, "errors": 0, "postprocessed": 0, "post_deferred": 0, "mirrored": 0}
+    # Contadores de progreso (ver progress.Progress); bytes_sized: tamaño anunciado de lo ya
+    # terminado, para el ETA contra bytes_queued
+    counts.update({"enumerated": 0, "queued": 0, "bytes": 0, "bytes_queued": 0, "bytes_sized": 0, "listing_done": 0})
+    counts.update({"space_deferred": 0, "space_deferred_bytes": 0})
 
-    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as ex:
-        futures = []
-        for asset in assets:
-            target = _target_path_for(asset, out_base, folder_template)
-            if state.exists_same(asset.id, target, asset.size):
-                skipped += 1
+    # Control de espacio (sólo destino local): se admiten descargas en orden mientras el
+    # espacio libre, descontado lo que está en vuelo, quede por encima de la reserva. Al
+    # agotarse se sigue listando (movimientos, estado) pero no se lanza ninguna descarga más
+    space = {"free": 0, "inflight": 0, "checked": float("-inf"), "full": False}
+    admission = storage.local and min_free > 0 and not dry_run
+    reserved: dict[str, int] = {}  # clave -> bytes admitidos, hasta que termina su descarga
+
+    # Post-proceso (HEIC→JPEG, miniaturas) en procesos aparte. La cola está acotada: si se
+    # llena, el fichero se deja para la próxima ejecución en lugar de frenar las descargas
+    post_tasks = () if dry_run else tuple(postprocess)
+    if post_tasks and not postprocessing.available():
+        log.warning("Post-proceso desactivado: falta Pillow (pip install Pillow pillow-heif)")
+        post_tasks = ()
+    if post_tasks and not storage.local:
+        log.warning("Post-proceso desactivado: requiere un destino local")
+        post_tasks = ()
+    post_workers = max(1, postprocess_workers or os.cpu_count() or 1)
+    derived_base = derived_dir or os.path.join(out_base, ".derived")
+    post_pending: dict = {}
+    # Reintentos diferidos: (instante, seq, job). Un fallo no retiene al worker durmiendo;
+    # el asset espera aquí su backoff mientras el resto de descargas sigue fluyendo
+    retries: list[tuple[float, int, tuple]] = []
+    seq = itertools.count()
+    # Errores sistémicos (sesión caducada, disco lleno, red caída, throttling) abren el
+    # circuito: se deja de lanzar trabajo, se guarda el estado y se sale con código propio
+    breaker = CircuitBreaker()
+    applied: set[str] = set()
+
+    def _reap_post() -> None:
+        for fut in [f for f in post_pending if f.done()]:
+            key = post_pending.pop(fut)
+            try:
+                result = fut.result()
+            except Exception as e:
+                log.warning("Post-proceso fallido para %s: %s", key, e)
                 continue
-            if dry_run:
-                log.info(f"DRY-RUN: descargaría {asset.id} → {target}")
-                skipped += 1
+            entry = state.get(key)
+            if entry is not None:
+                entry.derived = {**(entry.derived or {}), **result}
+                state.upsert(entry)
+            counts["postprocessed"] += 1
+
+    def _post_submit(key: str) -> None:
+        entry = state.get(key)
+        if entry is None:
+            return
+        derived = dict(entry.derived or {})
+        jobs = []
+        for task in post_tasks:
+            if task in derived:
+                continue
+            if not postprocessing.applicable(task, entry.path):
+                derived[task] = ""
+                continue
+            jobs.append((task, postprocessing.derived_path(derived_base, task, out_base, entry.path)))
+        if derived != (entry.derived or {}):
+            entry.derived = derived
+            state.upsert(entry)
+        if not jobs:
+            return
+        _reap_post()
+        if len(post_pending) >= post_workers * 4:
+            counts["post_deferred"] += 1
+            return
+        fut = post.submit(postprocessing.process, entry.path, tuple(jobs), thumb_size)
+        post_pending[fut] = key
+
+    def _expected_size(job: tuple) -> int:
+        return _job_size(job[0], job[3]) or 0
+
+    def _space_needed(job: tuple) -> int:
+        asset, version = job[0], job[3]
+        if version in PREVIEW_VERSIONS:
+            return PREVIEW_SIZE
+        return _job_size(asset, version) or UNKNOWN_SIZE
+
+    def _admit(job: tuple) -> bool:
+        if not admission:
+            return True
+        needed = _space_needed(job)
+        now = time.monotonic()
+        if not space["full"] and now - space["checked"] >= SPACE_CHECK_INTERVAL:
+            space["checked"] = now
+            space["free"] = free_bytes(out_base) - space["inflight"]
+        if not space["full"] and space["free"] - needed < min_free:
+            space["full"] = True
+            log.warning(f"Espacio libre bajo en {out_base} ({human_bytes(max(0, space['free']))}, reserva {human_bytes(min_free)}): no se lanzan más descargas")
+        if space["full"]:
+            counts["space_deferred"] += 1
+            counts["space_deferred_bytes"] += needed
+            return False
+        space["free"] -= needed
+        space["inflight"] += needed
+        reserved[job[2]] = needed
+        return True
+
+    def _release(key: str) -> None:
+        space["inflight"] -= reserved.pop(key, 0)
+
+    def _submit(job: tuple) -> None:
+        asset, target, key, version, lane, attempt, copies = job
+        if attempt == 1 and lane != "copy":
+            counts["queued"] += 1
+            counts["bytes_queued"] += _expected_size(job)
+        mirror_paths = tuple(c[1] for c in copies)
+        if lane == "fast":
+            fut = fast.submit(_download_one, asset, target, None, bandwidth, version, (), storage)
+        elif lane == "copy":
+            fut = ex.submit(_copy_one, target, mirror_paths, storage)
+        else:
+            fut = ex.submit(_download_one, asset, target, slots, bandwidth, version, mirror_paths, storage)
+        scheduled[fut] = job
+
+    def _submit_due() -> None:
+        now = time.monotonic()
+        while retries and retries[0][0] <= now:
+            _submit(heapq.heappop(retries)[2])
+
+    def _next_retry_in() -> float | None:
+        return max(0.0, retries[0][0] - time.monotonic()) if retries else None
+
+    def _finish_copies(job: tuple, size: int | None, errors: dict) -> None:
+        asset, target, key, version, lane, attempt, copies = job
+        rv = _remote_version(asset, version)
+        for mkey, mtarget, mscope in copies:
+            if mtarget in errors:
+                log.warning("No se pudo escribir la copia %s: %s", mtarget, errors[mtarget])
+                state.record_failure(mkey, mtarget, classify_error(errors[mtarget]), str(errors[mtarget]))
+                counts["errors"] += 1
                 continue
-            futures.append(ex.submit(_download_one, asset, target))
-            scheduled.append((asset, target))
+            with contextlib.suppress(OSError):
+                set_mtime(mtarget, os.stat(target).st_mtime if storage.local else asset.created.timestamp())
+            state.upsert(AssetEntry(asset_id=mkey, path=mtarget, size=size, scope=mscope, remote_version=rv, created=asset.created.timestamp(), album=asset.album))
+            counts["mirrored"] += 1
 
-        for fut, (asset, target) in zip(as_completed(futures), scheduled):
+    def _finish(fut) -> None:
+        job = scheduled.pop(fut)
+        asset, target, key, version, lane, attempt, copies = job
+        if lane == "copy":
+            # Copia local de algo ya descargado: sus fallos no cuentan para el circuito
             try:
-                path, size = fut.result()
-                # Ajuste de mtime
-                ts = mtime_from_exif(path)
-                if ts:
-                    set_mtime(path, ts)
-                state.upsert(AssetEntry(asset_id=asset.id, path=target, size=size))
-                downloaded += 1
+                _, size, errors = fut.result()
             except Exception as e:
-                log.error(f"Error descargando {asset.id}: {e}")
-                errors += 1
+                size, errors = None, {c[1]: e for c in copies}
+            _finish_copies(job, size, errors)
+            return
+        try:
+            path, size, errors = fut.result()
+            # Ajuste de mtime (en S3 la fecha ya va en los metadatos del objeto)
+            ts = (mtime_from_exif(path) if storage.local else None) or asset.created.timestamp()
+            if ts and storage.local:
+                set_mtime(path, ts)
+            rv = _remote_version(asset, version)
+            state.upsert(AssetEntry(asset_id=key, path=target, size=size, scope=scope, remote_version=rv, created=asset.created.timestamp(), album=asset.album))
+            _release(key)
+            counts["previews" if version in PREVIEW_VERSIONS else "downloaded"] += 1
+            counts["bytes"] += size or 0
+            counts["bytes_sized"] += _expected_size(job)
+            breaker.success()
+            if copies:
+                _finish_copies(job, size, errors)
+            if post_tasks and version not in PREVIEW_VERSIONS:
+                _post_submit(key)
+        except Exception as e:
+            kind = breaker.failure(e)
+            if attempt < retry_max and kind not in (AUTH, DISK) and breaker.tripped is None:
+                delay = max(retry_delay(attempt, retry_backoff), breaker.pause_remaining())
+                log.warning("Error descargando %s (intento %d/%d), reintento en %.0fs: %s", key, attempt, retry_max, delay, e)
+                heapq.heappush(retries, (time.monotonic() + delay, next(seq), job[:5] + (attempt + 1,) + job[6:]))
+                counts["retried"] += 1
+                return
+            log.error("Error descargando %s (%s): %s", key, kind, e)
+            state.record_failure(key, target, kind, str(e))
+            _release(key)
+            counts["errors"] += 1
+            counts["bytes_sized"] += _expected_size(job)
 
-    try:
-        state.save()
-    except Exception as e:
-        log.warning(f"No se pudo guardar el estado: {e}")
+    def _drain(timeout: float | None) -> None:
+        done, _ = wait(list(scheduled), timeout=timeout, return_when=FIRST_COMPLETED)
+        for fut in done:
+            _finish(fut)
 
-    # Permisos finales
-    try:
-        apply_tree_permissions(out_base, umask=umask, chown=chown)
-    except Exception as e:
-        log.warning(f"No se pudieron aplicar permisos: {e}")
+    def _wait_pause() -> None:
+        # Throttling: no se lanza nada nuevo hasta que pase la pausa global
+        while breaker.tripped is None and breaker.pause_remaining() > 0:
+            if scheduled:
+                _drain(breaker.pause_remaining())
+            else:
+                time.sleep(breaker.pause_remaining())
+
+    def _cancel_pending() -> None:
+        retries.clear()
+        for fut in list(post_pending):
+            fut.cancel()
+        for fut in list(scheduled):
+            if fut.cancel():
+                scheduled.pop(fut)
+        # Las que ya están en curso terminan y se registran
+        while scheduled:
+            _drain(None)
+
+    def _checkpoint() -> None:
+        try:
+            state.save()
+        except Exception as e:
+            log.warning(f"No se pudo guardar el estado: {e}")
+
+    def _planned(jkey: str, target: str) -> bool:
+        if only is None:
+            return True
+        if jkey not in only:
+            return False
+        applied.add(jkey)
+        if only[jkey] != target:
+            log.warning("Plan desfasado para %s: %s ≠ %s; se omite", jkey, only[jkey], target)
+            return False
+        return True
+
+    def _reason(entry, rv: str | None) -> str:
+        if entry is None:
+            return "new"
+        if rv and entry.remote_version and not same_version(entry.remote_version, rv):
+            return "changed"
+        return "missing"
+
+    def _mirror_copies(asset, jkey: str, target: str, version: str, size: int | None, rv: str | None) -> tuple:
+        # Destinos adicionales a los que les falta este fichero: (clave, ruta, ámbito)
+        copies = []
+        rel = os.path.relpath(target, out_base)
+        for mscope in mirror_scopes:
+            mkey, mtarget = _mirror_key(jkey, mscope), os.path.join(mscope, rel)
+            if not _planned(mkey, mtarget) or _is_current(state, mkey, mtarget, size, rv, mscope, asset):
+                continue
+            entry = state.get(mkey)
+            if _try_move(state, entry, mkey, mtarget, size, rv, mscope, dry_run, asset):
+                if plan is not None:
+                    plan.add(asset, mkey, version, mtarget, size, "move", entry.path, mirror=True)
+                continue
+            if plan is not None:
+                plan.add(asset, mkey, version, mtarget, size, _reason(entry, rv), mirror=True)
+                continue
+            if dry_run:
+                log.info("DRY-RUN: copiaría %s (%s) → %s", asset.id, version, mtarget)
+                continue
+            copies.append((mkey, mtarget, mscope))
+        return tuple(copies)
+
+    def _plan(asset) -> None:
+        key = _state_key(asset)
+        seen.add(key)
+        rv = getattr(asset, "remote_version", None)
+        for version in previews:
+            pkey = _preview_key(key, version)
+            if asset.media == "video":
+                # Versiones anteriores guardaban las de vídeo como .jpg sin serlo: se retiran
+                entry = state.get(pkey)
+                if entry is not None and not dry_run:
+                    with contextlib.suppress(Exception):
+                        storage.remove(entry.path)
+                    state.remove(pkey)
+                continue
+            ptarget = planner.target(asset, os.path.join(previews_base, version), extension="jpg")
+            if not _planned(pkey, ptarget) or _is_current(state, pkey, ptarget, None, rv, scope, asset, storage):
+                continue
+            entry = _lookup(state, pkey, _preview_key(asset.id, version), ptarget)
+            if _try_move(state, entry, pkey, ptarget, None, rv, scope, dry_run, asset, storage):
+                if plan is not None:
+                    plan.add(asset, pkey, version, ptarget, None, "move", entry.path)
+                continue
+            if plan is not None:
+                plan.add(asset, pkey, version, ptarget, None, _reason(entry, rv))
+                continue
+            if dry_run:
+                log.info("DRY-RUN: descargaría %s de %s → %s", version, asset.id, ptarget)
+                continue
+            job = (asset, ptarget, pkey, version, "fast", 1, ())
+            if _admit(job):
+                _submit(job)
+        for jkey, target, version, size in _main_jobs(asset, key, out_base, planner, versions, edits):
+            rv = _remote_version(asset, version)
+            planned = _planned(jkey, target)
+            if not planned and not mirror_scopes:
+                continue
+            copies = _mirror_copies(asset, jkey, target, version, size, rv) if mirror_scopes else ()
+            if not planned:
+                # Plan que sólo completa destinos adicionales: copia desde el principal
+                if copies and _is_current(state, jkey, target, size, rv, scope, asset, storage):
+                    _submit((asset, target, jkey, version, "copy", 1, copies))
+                elif copies:
+                    log.warning("%s no está al día en el destino principal; no se puede copiar a %s", jkey, ", ".join(c[1] for c in copies))
+                continue
+            entry = _lookup(state, jkey, asset.id, target) if jkey == key else state.get(jkey)
+            if _is_current(state, jkey, target, size, rv, scope, asset, storage):
+                counts["skipped"] += 1
+                if post_tasks:
+                    _post_submit(jkey)  # derivados que falten (p.ej. post-proceso recién activado)
+                if copies:
+                    _submit((asset, target, jkey, version, "copy", 1, copies))  # desde el disco local
+                continue
+            if _try_move(state, entry, jkey, target, size, rv, scope, dry_run, asset, storage):
+                if plan is not None:
+                    plan.add(asset, jkey, version, target, size, "move", entry.path)
+                counts["moved"] += 1
+                if copies:
+                    _submit((asset, target, jkey, version, "copy", 1, copies))
+                continue
+            if plan is not None:
+                plan.add(asset, jkey, version, target, size, _reason(entry, rv))
+                continue
+            if dry_run:
+                log.info("DRY-RUN: descargaría %s (%s) → %s", asset.id, version, target)
+                counts["skipped"] += 1
+                continue
+            if entry is not None and entry.path == target and rv and entry.remote_version and not same_version(entry.remote_version, rv):
+                log.info("%s ha cambiado en iCloud; se vuelve a descargar", asset.id)
+            job = (asset, target, jkey, version, "main", 1, copies)
+            if _admit(job):
+                _submit(job)
+
+    # Dos carriles: thumb/medium en su propio pool (muchos hilos, ficheros pequeños) para que
+    # el árbol de previews esté completo mucho antes que los originales
+    # spawn: el proceso padre tiene hilos (fork podría heredar locks tomados)
+    post_pool = ProcessPoolExecutor(max_workers=post_workers, mp_context=multiprocessing.get_context("spawn")) if post_tasks else contextlib.nullcontext()
+    with Progress(counts, os.path.basename(scope) or scope, progress, progress_interval), \
+            ThreadPoolExecutor(max_workers=max(1, concurrency)) as ex, \
+            ThreadPoolExecutor(max_workers=max(1, preview_concurrency) if previews else 1) as fast, \
+            post_pool as post:
+        try:
+            mine = (a for a in assets if in_shard(a, shard, shard_by))
+            for asset in prioritized(mine, order, lookahead):
+                if breaker.tripped is not None:
+                    break
+                counts["enumerated"] += 1
+                _wait_pause()
+                _plan(asset)
+                _submit_due()
+                if len(scheduled) >= max_inflight:
+                    _drain(_next_retry_in())
+        except Exception as e:
+            # Fallo al listar (p.ej. sesión caducada a mitad): se conserva lo ya descargado
+            kind = classify_error(e)
+            if breaker.tripped is None and kind != ASSET:
+                breaker.tripped = CircuitOpen(kind, e)
+            if breaker.tripped is None:
+                _cancel_pending()
+                _checkpoint()
+                raise
+        counts["listing_done"] = 1
+        # Assets o álbumes que no se pudieron leer (ver photos.Listing): el listado es
+        # parcial y lo que falta en él no se puede dar por borrado
+        listing_errors = getattr(assets, "errors", 0)
+        if listing_errors and (reconcile or full_listing):
+            log.warning(f"{listing_errors} errores al listar {scope}: listado incompleto, sin reconcile ni limpieza del estado")
+            reconcile = full_listing = False
+
+        while (scheduled or retries) and breaker.tripped is None:
+            _submit_due()
+            if scheduled:
+                _drain(_next_retry_in())
+            else:
+                time.sleep(_next_retry_in() or 0)
+
+        if breaker.tripped is not None:
+            _cancel_pending()
+
+        if post_pending:
+            wait(list(post_pending))
+        _reap_post()
 
-    return {
-        "skipped": skipped,
-        "downloaded": downloaded,
-        "errors": errors,
+    if counts["post_deferred"]:
+        log.info(f"{counts['post_deferred']} ficheros pendientes de post-proceso (cola llena); se retoman en la próxima ejecución")
+    if counts["space_deferred"]:
+        log.warning(
+            f"Espacio insuficiente en {out_base}: {counts['space_deferred']} ficheros "
+            f"(~{human_bytes(counts['space_deferred_bytes'])}) quedan para la próxima ejecución; "
+            f"libera espacio o ajusta MIN_FREE_GB (reserva actual {human_bytes(min_free)})"
+        )
+
+    if breaker.tripped is not None:
+        log.error(f"{breaker.tripped}. Estado guardado con {counts['downloaded']} descargas de esta ejecución.")
+        _checkpoint()
+        raise breaker.tripped
+
+    if only is not None and len(applied) < len(only):
+        log.warning(f"{len(only) - len(applied)} entradas del plan ya no están en iCloud")
+
+    if plan is not None:
+        # Sólo planificación: ni reconcile ni permisos (los datos derivados del estado sí se guardan)
+        _checkpoint()
+        summary = plan.close()
+        return {"planned": summary["files"], "bytes": summary["bytes"], "unknown_size": summary["unknown_size"], "copies": summary["copies"], **summary["reasons"]}
+
+    removed = 0
+    if reconcile:
+        removed = _reconcile(state, scope, seen, quarantine_dir or os.path.join(out_base, ".quarantine"), dry_run, storage)
+
+    result = {
+        "skipped": counts["skipped"],
+        "downloaded": counts["downloaded"],
+        "previews": counts["previews"],
+        "moved": counts["moved"],
+        "removed": removed,
+        "retried": counts["retried"],
+        "errors": counts["errors"],
+        "postprocessed": counts["postprocessed"],
+        "mirrored": counts["mirrored"],
+        "deferred": counts["space_deferred"],
     }
+    if not dry_run:
+        run_seq = state.record_run(scope, {**result, "tmp_swept_at": swept_at}, complete=full_listing)
+        if full_listing:
+            state.mark_seen(scope, seen, run_seq)
+            if gc_runs > 0:
+                result["forgotten"] = _forget_stale(state, scope, gc_runs)
+        for mscope in mirror_scopes:
+            # Cada destino adicional lleva su propio registro de ejecuciones y su limpieza
+            mirror_seq = state.record_run(mscope, {"mirror_of": scope}, complete=full_listing)
+            if full_listing:
+                state.mark_seen(mscope, seen, mirror_seq)
+                if gc_runs > 0:
+                    _forget_stale(state, mscope, gc_runs)
+    _checkpoint()
+
+    # Permisos finales
+    roots = [out_base]
+    if previews and not _inside(previews_base, out_base):
+        roots.append(previews_base)
+    if post_tasks and not _inside(derived_base, out_base):
+        roots.append(derived_base)
+    targets = [(root, storage) for root in roots] + [(root, LOCAL) for root in mirror_scopes]
+    for root, where in targets:
+        try:
+            where.finalize(root, umask, chown)
+        except Exception as e:
+            log.warning(f"No se pudieron aplicar permisos: {e}")
 
+    return result
@@ -0,0 +1,37 @@
+from __future__ import annotations
+
+import threading
+import time
+
+
+# Token bucket compartido entre hilos (p.ej. bytes/s de descarga de varias cuentas, o
+# peticiones/s de metadatos)
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float | None = None) -> None:
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def consume(self, amount: float = 1.0) -> None:
+        # Peticiones mayores que la capacidad se cobran igualmente (saldo negativo)
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= amount
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        # Retry-After: el saldo pasa a deber `seconds` de tokens, así que todos los hilos
+        # esperan a la vez y después se sigue al ritmo nominal, sin la ráfaga acumulada.
+        # Varias pausas simultáneas (el mismo 429 en varios hilos) no se suman
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self._tokens, -seconds * self.rate)
@@ -5,6 +5,7 @@ import os
 import re
 import shutil
 import tempfile
+import threading
 import time
 from pathlib import Path
 from typing import Iterator
@@ -21,15 +22,62 @@ def sanitize_filename(name: str) -> str:
     return name[:200] if len(name) > 200 else name
 
 
+# Carpetas que ya sabemos que existen (compartido por todos los hilos del proceso): en SMB/NFS
+# cada makedirs son varios round-trips, así que cada carpeta se crea como mucho una vez
+_known_dirs: set[str] = set()
+_known_dirs_lock = threading.Lock()
+
+
+def ensure_dir(directory: str) -> None:
+    if directory in _known_dirs:
+        return
+    os.makedirs(directory, exist_ok=True)
+    with _known_dirs_lock:
+        _known_dirs.add(directory)
+
+
+def forget_dir(directory: str) -> None:
+    # Llamar tras borrar una carpeta para que se vuelva a crear si hace falta
+    with _known_dirs_lock:
+        _known_dirs.discard(directory)
+
+
+def seed_known_dirs(root: str, depth: int) -> int:
+    # Registra las carpetas existentes hasta `depth` niveles bajo root con os.scandir (sin
+    # entrar en el último nivel, donde están los ficheros)
+    found = []
+    level = [root] if os.path.isdir(root) else []
+    found.extend(level)
+    for _ in range(depth):
+        nxt = []
+        for d in level:
+            try:
+                with os.scandir(d) as it:
+                    nxt.extend(e.path for e in it if e.is_dir(follow_symlinks=False))
+            except OSError:
+                continue
+        found.extend(nxt)
+        level = nxt
+    with _known_dirs_lock:
+        _known_dirs.update(found)
+    return len(found)
+
+
 @contextlib.contextmanager
 def atomic_write(target_path: str, mode: str = "wb") -> Iterator[tuple[str, tempfile.NamedTemporaryFile]]:
     directory = os.path.dirname(target_path)
-    os.makedirs(directory, exist_ok=True)
+    ensure_dir(directory)
     with tempfile.NamedTemporaryFile(delete=False, dir=directory) as tmp:
         try:
             yield tmp.name, tmp
             tmp.flush()
             os.fsync(tmp.fileno())
+        except BaseException:
+            # Descarga fallida: no dejar el temporal huérfano
+            tmp.close()
+            with contextlib.suppress(OSError):
+                os.remove(tmp.name)
+            raise
         finally:
             try:
                 tmp.close()
@@ -38,6 +86,39 @@ def atomic_write(target_path: str, mode: str = "wb") -> Iterator[tuple[str, temp
     os.replace(tmp.name, target_path)
 
 
+# Nombre de los temporales de NamedTemporaryFile (ver atomic_write)
+_TMP_NAME = re.compile(r"^tmp[a-z0-9_]{8}$")
+
+
+def remove_stale_temps(root: str, max_age: float = 3600.0) -> tuple[int, int]:
+    # Borra los temporales que deja una descarga interrumpida sin limpieza (proceso matado,
+    # corte de luz). Los recientes pueden ser de otro worker en marcha: sólo los de más de
+    # max_age segundos. Devuelve (ficheros, bytes)
+    removed = freed = 0
+    cutoff = time.time() - max_age
+    stack = [root]
+    while stack:
+        d = stack.pop()
+        try:
+            with os.scandir(d) as it:
+                for e in it:
+                    if e.is_dir(follow_symlinks=False):
+                        stack.append(e.path)
+                    elif _TMP_NAME.match(e.name) and e.is_file(follow_symlinks=False):
+                        st = e.stat(follow_symlinks=False)
+                        if st.st_mtime < cutoff:
+                            os.remove(e.path)
+                            removed += 1
+                            freed += st.st_size
+        except OSError:
+            continue
+    return removed, freed
+
+
+def free_bytes(path: str) -> int:
+    return shutil.disk_usage(path).free
+
+
 def set_mtime(path: str, timestamp: float) -> None:
     os.utime(path, (timestamp, timestamp))
 
@@ -0,0 +1,55 @@
+from __future__ import annotations
+
+from datetime import datetime
+
+import pytest
+
+from icloudsync.photos import PhotoAsset
+from icloudsync.state import StateDB
+
+
+class FakeSource:
+    # Sustituye a ICloudPhotos como downloader: contenido determinista y registro de descargas
+    def __init__(self) -> None:
+        self.downloads: list[tuple[str, str]] = []
+
+    def download(self, asset, version: str = "original"):
+        self.downloads.append((asset.id, version))
+        yield f"{asset.id}:{version}".encode()
+
+
+@pytest.fixture
+def source() -> FakeSource:
+    return FakeSource()
+
+
+@pytest.fixture
+def make_asset(source):
+    def make(i: int, **kw) -> PhotoAsset:
+        fields = {
+            "id": f"id{i}",
+            "created": datetime(2024, 1 + i % 12, 1 + i % 28, 12),
+            "filename": f"IMG_{i}.HEIC",
+            "size": None,
+            "album": None,
+            "extension": "heic",
+            "source": source,
+        }
+        fields.update(kw)
+        return PhotoAsset(**fields)
+
+    return make
+
+
+@pytest.fixture
+def state(tmp_path) -> StateDB:
+    return StateDB(str(tmp_path / "state" / "state.json"))
+
+
+def files_under(root) -> set[str]:
+    # Rutas relativas de los ficheros descargados (sin árboles ocultos ni temporales)
+    return {
+        str(p.relative_to(root))
+        for p in root.rglob("*")
+        if p.is_file() and not any(part.startswith(".") for part in p.relative_to(root).parts)
+    }
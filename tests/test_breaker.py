@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import errno
+import time
+
+import pytest
+
+from icloudsync.breaker import ASSET, AUTH, DISK, NETWORK, THROTTLED, CircuitBreaker, CircuitOpen, classify_error, retry_after
+from icloudsync.state import StateDB
+from icloudsync.sync import sync_assets
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, headers: dict | None = None) -> None:
+        super().__init__(f"HTTP {status}")
+        self.response = type("Response", (), {"status_code": status, "headers": headers or {}})()
+
+
+class PyiCloudFailedLoginException(Exception):
+    pass
+
+
+class ReadTimeout(Exception):
+    pass
+
+
+@pytest.mark.parametrize(
+    "exc, kind",
+    [
+        (OSError(errno.ENOSPC, "No space left on device"), DISK),
+        (OSError(errno.EDQUOT, "Disk quota exceeded"), DISK),
+        (PyiCloudFailedLoginException("login"), AUTH),
+        (HTTPError(401), AUTH),
+        (HTTPError(403), AUTH),
+        (HTTPError(421), AUTH),
+        (HTTPError(429), THROTTLED),
+        (HTTPError(503), THROTTLED),
+        (ConnectionResetError("reset"), NETWORK),
+        (TimeoutError("timeout"), NETWORK),
+        (ReadTimeout("read"), NETWORK),
+        (HTTPError(404), ASSET),
+        (HTTPError(500), ASSET),
+        (OSError(errno.EACCES, "Permission denied"), ASSET),
+        (ValueError("corrupto"), ASSET),
+    ],
+)
+def test_classify_error(exc, kind):
+    assert classify_error(exc) == kind
+
+
+def test_retry_after_seconds_and_http_date():
+    assert retry_after(HTTPError(429, {"Retry-After": "12"})) == 12.0
+    assert retry_after(HTTPError(429, {"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"})) == 0.0
+    assert retry_after(HTTPError(429, {"Retry-After": "pronto"})) is None
+    assert retry_after(ValueError()) is None
+
+
+@pytest.mark.parametrize("exc, threshold, code", [(HTTPError(401), 2, 10), (HTTPError(429), 6, 11), (ConnectionResetError(), 8, 12), (OSError(errno.ENOSPC, "lleno"), 1, 13)])
+def test_breaker_trips_after_consecutive_failures(exc, threshold, code):
+    breaker = CircuitBreaker()
+    for _ in range(threshold - 1):
+        breaker.failure(exc)
+    assert breaker.tripped is None
+
+    breaker.failure(exc)
+    assert isinstance(breaker.tripped, CircuitOpen)
+    assert breaker.tripped.exit_code == code
+
+
+def test_success_resets_streak_and_asset_errors_never_trip():
+    breaker = CircuitBreaker()
+    breaker.failure(HTTPError(401))
+    breaker.success()
+    breaker.failure(HTTPError(401))
+    for _ in range(100):
+        breaker.failure(HTTPError(404))
+
+    assert breaker.tripped is None
+
+
+def test_throttling_pauses_for_retry_after():
+    breaker = CircuitBreaker()
+    breaker.failure(HTTPError(429, {"Retry-After": "20"}))
+
+    assert 19 < breaker.pause_remaining() <= 20
+    assert breaker.paused_until > time.monotonic()
+
+
+class FailingSource:
+    def __init__(self, exc: Exception) -> None:
+        self.exc = exc
+        self.attempts = 0
+
+    def download(self, asset, version="original"):
+        self.attempts += 1
+        raise self.exc
+        yield b""
+
+
+def test_sync_stops_and_saves_state_when_circuit_opens(tmp_path, make_asset, state, source):
+    failing = FailingSource(HTTPError(401))
+    assets = [make_asset(0)] + [make_asset(i, source=failing) for i in range(1, 20)]
+
+    with pytest.raises(CircuitOpen) as info:
+        sync_assets(assets=iter(assets), out_base=str(tmp_path / "out"), folder_template="{:%Y/%m}", state=state, concurrency=1, order="listing")
+
+    assert info.value.kind == AUTH and info.value.exit_code == 10
+    assert failing.attempts < 19  # se deja de lanzar trabajo
+    assert StateDB(state.state_path).get("id0") is not None  # lo descargado antes queda guardado
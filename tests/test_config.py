@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+import pytest
+
+from icloudsync.config import Config
+
+
+@pytest.fixture
+def cfg() -> Config:
+    return Config(out_main="/data", cookies_dir="/cookies", mirrors="/backup", bandwidth_limit=5.0)
+
+
+def test_account_defaults_are_isolated(cfg):
+    acc = cfg.for_account({"apple_id": "ana@icloud.com"})
+
+    assert acc.apple_id == "ana@icloud.com"
+    assert acc.cookies_dir == "/cookies/ana@icloud.com"
+    assert acc.out_main == "/data/ana@icloud.com"
+    assert acc.out_shared == "/data/ana@icloud.com/Compartidos"
+    assert acc.mirrors == "/backup/ana@icloud.com"
+    assert acc.bandwidth_limit == 5.0
+    assert acc.accounts == []
+
+
+def test_account_overrides_any_per_account_key(cfg):
+    acc = cfg.for_account({
+        "apple_id": "luis@icloud.com",
+        "out_main": "/data/luis",
+        "versions": ["thumb", "original"],
+        "edits": "Both",
+        "reconcile": "true",
+        "retry_max": "7",
+        "min_free_gb": 10,
+        "since": "2024-01-01",
+        "umask": 22,
+    })
+
+    assert acc.out_main == "/data/luis"
+    assert acc.out_shared == "/data/luis/Compartidos"
+    assert acc.versions == "thumb,original"
+    assert acc.edits == "both"
+    assert acc.reconcile is True
+    assert acc.retry_max == 7
+    assert acc.min_free_gb == 10.0
+    assert acc.since == "2024-01-01"
+    assert acc.umask == "22"
+
+
+def test_account_rejects_process_wide_keys(cfg):
+    with pytest.raises(ValueError, match="globales.*BANDWIDTH_LIMIT, CONCURRENCY"):
+        cfg.for_account({"apple_id": "ana@icloud.com", "concurrency": 8, "bandwidth_limit": 1})
+
+
+def test_account_rejects_unknown_keys(cfg):
+    with pytest.raises(ValueError, match="no reconocidas: OUT_DIR"):
+        cfg.for_account({"apple_id": "ana@icloud.com", "out_dir": "/x"})
+
+
+@pytest.mark.parametrize("account", [{}, {"out_main": "/x"}, "ana@icloud.com"])
+def test_account_needs_apple_id(cfg, account):
+    with pytest.raises(ValueError, match="apple_id"):
+        cfg.for_account(account)
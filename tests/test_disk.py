@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import os
+import time
+
+import pytest
+
+from icloudsync import sync
+from icloudsync.sync import sync_assets
+from icloudsync.utils import remove_stale_temps
+
+from conftest import files_under
+
+MB = 1024 * 1024
+RESERVE = 100 * MB
+
+
+@pytest.fixture
+def disk(monkeypatch):
+    # Espacio libre simulado en el destino; registra cuántas veces se mide
+    disk = {"free": 0, "calls": 0}
+
+    def free_bytes(path):
+        disk["calls"] += 1
+        return disk["free"]
+
+    monkeypatch.setattr(sync, "free_bytes", free_bytes)
+    return disk
+
+
+def _sync(tmp_path, state, assets, **kw):
+    return sync_assets(assets=iter(assets), out_base=str(tmp_path / "out"), folder_template="{:%Y}", state=state, concurrency=1, order="listing", **kw)
+
+
+def test_low_space_defers_remaining_downloads(tmp_path, state, make_asset, source, disk):
+    size = len(b"id0:original")  # lo que baja FakeSource, para que la segunda pasada lo dé por bueno
+    assets = [make_asset(i, size=size) for i in range(5)]
+    disk["free"] = RESERVE + 2 * size + 5  # caben dos sin tocar la reserva
+
+    res = _sync(tmp_path, state, assets, min_free=RESERVE)
+
+    assert res["downloaded"] == 2
+    assert res["deferred"] == 3
+    assert source.downloads == [("id0", "original"), ("id1", "original")]
+    assert disk["calls"] == 1  # se mide una vez y se descuenta lo admitido
+
+    # Con espacio, la siguiente ejecución baja sólo lo que quedó pendiente
+    disk["free"] = 10 * 1024 * MB
+    res = _sync(tmp_path, state, assets, min_free=RESERVE)
+
+    assert res["downloaded"] == 3
+    assert res["deferred"] == 0
+    assert source.downloads[2:] == [("id2", "original"), ("id3", "original"), ("id4", "original")]
+    assert len(files_under(tmp_path / "out")) == 5
+
+
+def test_unknown_size_counts_as_default(tmp_path, state, make_asset, disk):
+    disk["free"] = RESERVE + sync.UNKNOWN_SIZE + MB
+    res = _sync(tmp_path, state, [make_asset(i) for i in range(3)], min_free=RESERVE)
+
+    assert (res["downloaded"], res["deferred"]) == (1, 2)
+
+
+def test_admission_off_without_reserve_or_in_dry_run(tmp_path, state, make_asset, disk):
+    assets = [make_asset(i, size=10 * MB) for i in range(3)]
+
+    assert _sync(tmp_path, state, assets)["deferred"] == 0
+    assert _sync(tmp_path, state, assets, min_free=RESERVE, dry_run=True)["deferred"] == 0
+    assert disk["calls"] == 0
+
+
+def _temp(path, age: float) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"x" * 10)
+    old = time.time() - age
+    os.utime(path, (old, old))
+
+
+def test_remove_stale_temps_only_old_temporaries(tmp_path):
+    _temp(tmp_path / "2024" / "tmpab12cd_3", 2 * 3600)
+    _temp(tmp_path / ".previews" / "thumb" / "tmpzz99yy00", 2 * 3600)
+    _temp(tmp_path / "2024" / "tmpqwertyui", 60)  # otro worker puede estar escribiéndolo
+    _temp(tmp_path / "2024" / "tmp_foto.jpg", 2 * 3600)  # no es un temporal de atomic_write
+
+    assert remove_stale_temps(str(tmp_path), 3600) == (2, 20)
+    assert files_under(tmp_path) == {"2024/tmpqwertyui", "2024/tmp_foto.jpg"}
+
+
+def test_sync_sweeps_temps_once_per_interval(tmp_path, state, make_asset):
+    out = tmp_path / "out"
+    _temp(out / "2023" / "tmpab12cd_3", 2 * sync.TMP_MAX_AGE)
+    _sync(tmp_path, state, [make_asset(0)])
+    assert not (out / "2023" / "tmpab12cd_3").exists()
+
+    _temp(out / "2023" / "tmpab12cd_4", 2 * sync.TMP_MAX_AGE)
+    _sync(tmp_path, state, [make_asset(0)])
+    assert (out / "2023" / "tmpab12cd_4").exists()
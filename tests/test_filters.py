@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+from datetime import datetime, timezone
+
+import pytest
+
+from icloudsync.cache import MetadataCache
+from icloudsync.photos import AssetFilter, ICloudPhotos, media_of
+
+
+def _ts(*args) -> float:
+    return datetime(*args, tzinfo=timezone.utc).timestamp()
+
+
+class Item:
+    def __init__(self, i: int, item_type: str = "image", live: bool = False) -> None:
+        self.id = f"a{i}"
+        self.filename = f"IMG_{i}.MOV" if item_type == "movie" else f"IMG_{i}.HEIC"
+        self.created = datetime(2024, 1, 1 + i, tzinfo=timezone.utc)
+        self.added_date = self.created
+        self.size = 10
+        self.item_type = item_type
+        self.versions = {"original": {"url": f"https://cdn/{self.id}"}}
+        if live:
+            self.versions["original_video"] = {"url": f"https://cdn/{self.id}.mov"}
+
+
+class Collection:
+    # Colección de pyicloud con orden de paginación; cuenta los assets recorridos (también en
+    # sus copias)
+    def __init__(self, items) -> None:
+        self.items = list(items)
+        self.direction = "ASCENDING"
+        self.stats = {"read": 0}
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __iter__(self):
+        items = self.items if self.direction == "ASCENDING" else reversed(self.items)
+        for item in items:
+            self.stats["read"] += 1
+            yield item
+
+
+class Api:
+    def __init__(self, items, albums=None) -> None:
+        self.session = None
+        self.collection = Collection(items)
+        api = self
+
+        class Photos:
+            all = api.collection
+
+        Photos.albums = albums or {}
+        self.photos = Photos()
+
+
+ITEMS = [Item(0), Item(1, "movie"), Item(2, live=True), Item(3), Item(4, "movie"), Item(5)]
+
+
+@pytest.mark.parametrize(
+    "flt, ids",
+    [
+        (AssetFilter(since=_ts(2024, 1, 3)), ["a2", "a3", "a4", "a5"]),
+        (AssetFilter(until=_ts(2024, 1, 3)), ["a0", "a1"]),  # until exclusivo
+        (AssetFilter(since=_ts(2024, 1, 2), until=_ts(2024, 1, 4)), ["a1", "a2"]),
+        (AssetFilter(media="photo"), ["a0", "a2", "a3", "a5"]),  # incluye Live Photos
+        (AssetFilter(media="video"), ["a1", "a4"]),
+        (AssetFilter(media="live"), ["a2"]),
+        (AssetFilter(since=_ts(2024, 1, 4), media="photo"), ["a3", "a5"]),
+    ],
+)
+def test_filters_select_assets(flt, ids):
+    photos = ICloudPhotos(Api(ITEMS), filters=flt)
+
+    assert sorted(a.id for a in photos.iter_library()) == ids
+
+
+def test_media_of():
+    assert media_of("movie", "heic", {}) == "video"
+    assert media_of(None, "mp4", {}) == "video"
+    assert media_of("image", "heic", {"original": {}, "original_video": {}}) == "live"
+    assert media_of("image", "jpg", {"original": {}}) == "photo"
+
+
+def test_since_pages_newest_first_and_stops_at_the_date():
+    api = Api(ITEMS)
+    photos = ICloudPhotos(api, filters=AssetFilter(since=_ts(2024, 1, 5)))
+
+    assert [a.id for a in photos.iter_library()] == ["a5", "a4"]
+    assert api.collection.stats["read"] == 3  # a5, a4 y el primero anterior a la fecha
+    assert api.collection.direction == "ASCENDING"  # se pagina una copia
+
+
+def test_video_filter_uses_smart_album():
+    videos = [ITEMS[1], ITEMS[4]]
+    api = Api(ITEMS, albums={"Videos": videos})
+
+    assert [a.id for a in ICloudPhotos(api, filters=AssetFilter(media="video")).iter_library()] == ["a1", "a4"]
+    assert api.collection.stats["read"] == 0
+
+
+def test_filtered_listing_keeps_full_cache(tmp_path):
+    cache = MetadataCache(str(tmp_path), ttl=900)
+    api = Api(ITEMS)
+    photos = ICloudPhotos(api, cache=cache, filters=AssetFilter(until=_ts(2024, 1, 3)))
+    assert [a.id for a in photos.iter_library()] == ["a0", "a1"]
+
+    everything = ICloudPhotos(api, cache=cache)
+    assert len(list(everything.iter_library())) == len(ITEMS)
+    assert api.collection.stats["read"] == len(ITEMS)  # el segundo listado sale del caché
@@ -0,0 +1,207 @@
+from __future__ import annotations
+
+from datetime import datetime, timezone
+
+import pytest
+
+from icloudsync.breaker import AUTH, classify_error
+from icloudsync.cache import MetadataCache
+from icloudsync.photos import ICloudPhotos, PhotoAsset
+from icloudsync.sync import sync_assets
+
+
+class FakeItem:
+    # Asset de pyicloud: atributos y versiones con URL de descarga
+    def __init__(self, i: int, urls: bool = True) -> None:
+        self.id = f"a{i}"
+        self.filename = f"IMG_{i}.HEIC"
+        self.created = datetime(2024, 1, 1 + i, tzinfo=timezone.utc)
+        self.added_date = self.created
+        self.size = 100 + i
+        self.item_type = "image"
+        self.has_urls = urls
+        self.gen = ""  # cambia las URLs firmadas (p.ej. al caducar las anteriores)
+
+    @property
+    def versions(self):
+        if not self.has_urls:
+            return {}
+        return {v: {"url": f"https://cdn/{self.gen}{self.id}/{v}"} for v in ("original", "thumb")}
+
+    def download(self, version="original"):
+        return FakeResponse(f"pyicloud:{self.id}:{version}".encode())
+
+
+class FakeResponse:
+    def __init__(self, data: bytes, status_code: int = 200) -> None:
+        self.data = data
+        self.status_code = status_code
+
+    def raise_for_status(self) -> None:
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+    def iter_content(self, chunk_size):
+        yield self.data
+
+    def close(self) -> None:
+        pass
+
+
+class PyiCloudAPIResponseException(Exception):
+    # Como la de pyicloud: el código HTTP va en .code
+    def __init__(self, reason: str, code: int) -> None:
+        super().__init__(reason)
+        self.code = code
+
+
+class FakeSession:
+    # expired: prefijo de las URLs caducadas; raises: responder como pyicloud (excepción) o
+    # con la respuesta de error tal cual
+    def __init__(self) -> None:
+        self.gets: list[str] = []
+        self.expired: str | None = None
+        self.expired_status = 403
+        self.raises = True
+
+    def get(self, url, stream=False):
+        self.gets.append(url)
+        if self.expired and url.startswith(self.expired):
+            if self.raises:
+                raise PyiCloudAPIResponseException("Forbidden", self.expired_status)
+            return FakeResponse(b"<html>", self.expired_status)
+        return FakeResponse(url.encode())
+
+
+class FakeApi:
+    def __init__(self, items) -> None:
+        self.items = items
+        self.session = FakeSession()
+        self.listings = 0
+        api = self
+
+        class Photos:
+            @property
+            def all(self):
+                api.listings += 1
+                return items
+
+        self.photos = Photos()
+
+
+def _read(photos: ICloudPhotos, asset: PhotoAsset, version: str = "original") -> bytes:
+    return b"".join(photos.download(asset, version))
+
+
+def test_records_keep_no_urls_nor_pyicloud_asset():
+    photos = ICloudPhotos(FakeApi([FakeItem(i) for i in range(3)]), versions=("thumb", "original"))
+    assets = list(photos.iter_library())
+
+    assert not hasattr(assets[0], "__dict__")
+    assert {f for f in PhotoAsset.__slots__ if "url" in f} == {"urls_at"}
+    assert all(isinstance(a.urls_at, int) for a in assets)
+    assert not any(isinstance(getattr(a, f), FakeItem) for a in assets for f in PhotoAsset.__slots__)
+
+
+def test_download_resolves_urls_through_shared_source():
+    api = FakeApi([FakeItem(i) for i in range(3)])
+    photos = ICloudPhotos(api, versions=("thumb", "original"))
+    assets = list(photos.iter_library())
+
+    assert _read(photos, assets[1]) == b"https://cdn/a1/original"
+    assert _read(photos, assets[2], "thumb") == b"https://cdn/a2/thumb"
+    assert b"".join(assets[0].downloader()) == b"https://cdn/a0/original"
+    with pytest.raises(LookupError):
+        _read(photos, assets[0], "medium")
+
+
+def test_assets_without_urls_download_through_pyicloud():
+    photos = ICloudPhotos(FakeApi([FakeItem(0, urls=False)]))
+    (asset,) = photos.iter_library()
+
+    assert asset.urls_at is None
+    assert _read(photos, asset) == b"pyicloud:a0:original"
+
+
+def test_cached_listing_serves_urls(tmp_path):
+    api = FakeApi([FakeItem(i) for i in range(3)])
+    cache = MetadataCache(str(tmp_path))
+    list(ICloudPhotos(api, cache=cache).iter_library())
+
+    photos = ICloudPhotos(api, cache=cache)
+    assets = list(photos.iter_library())
+
+    assert api.listings == 1
+    assert [a.listing for a in assets] == ["__library__|original"] * 3
+    assert _read(photos, assets[2]) == b"https://cdn/a2/original"
+
+
+def _expire_cached_urls(api: FakeApi) -> None:
+    # Las URLs guardadas en el caché dejan de valer; un listado nuevo trae otras
+    api.session.expired = "https://cdn/a"
+    for item in api.items:
+        item.gen = "g2/"
+
+
+@pytest.mark.parametrize("raises, status", [(True, 403), (True, 410), (False, 403), (False, 404)])
+def test_expired_cached_url_relists_once(tmp_path, raises, status):
+    api = FakeApi([FakeItem(i) for i in range(3)])
+    cache = MetadataCache(str(tmp_path))
+    list(ICloudPhotos(api, cache=cache).iter_library())
+    _expire_cached_urls(api)
+    api.session.raises, api.session.expired_status = raises, status
+
+    photos = ICloudPhotos(api, cache=cache)
+    assets = list(photos.iter_library())
+
+    assert [_read(photos, a) for a in assets] == [f"https://cdn/g2/a{i}/original".encode() for i in range(3)]
+    assert api.listings == 2  # un único relistado para los tres
+    assert list(ICloudPhotos(api, cache=cache).iter_library())[0].listing == "__library__|original"
+    assert api.listings == 2  # el caché se reescribió con las URLs nuevas
+
+
+def test_sync_with_expired_cached_urls_does_not_trip_auth(tmp_path, state):
+    api = FakeApi([FakeItem(i) for i in range(5)])
+    cache = MetadataCache(str(tmp_path / "cache"))
+    list(ICloudPhotos(api, cache=cache).iter_library())
+    _expire_cached_urls(api)
+
+    res = sync_assets(
+        assets=ICloudPhotos(api, cache=cache).iter_library(),
+        out_base=str(tmp_path / "out"),
+        folder_template="{:%Y/%m}",
+        state=state,
+        concurrency=2,
+    )
+
+    assert res["downloaded"] == 5 and res["errors"] == 0 and res["retried"] == 0
+    assert api.listings == 2
+
+
+def test_asset_gone_after_relist_is_not_auth(tmp_path):
+    api = FakeApi([FakeItem(i) for i in range(3)])
+    cache = MetadataCache(str(tmp_path))
+    list(ICloudPhotos(api, cache=cache).iter_library())
+    _expire_cached_urls(api)
+    api.items.pop()
+
+    photos = ICloudPhotos(api, cache=cache)
+    gone = list(photos.iter_library())[2]
+
+    with pytest.raises(LookupError) as info:
+        _read(photos, gone)
+    assert classify_error(info.value) != AUTH
+
+
+def test_rejected_fresh_url_is_not_relisted():
+    # Sin caché la URL es recién listada: un 403 es un error real de la sesión
+    api = FakeApi([FakeItem(0)])
+    api.session.expired = "https://cdn/"
+    photos = ICloudPhotos(api)
+    (asset,) = photos.iter_library()
+
+    with pytest.raises(PyiCloudAPIResponseException) as info:
+        _read(photos, asset)
+    assert classify_error(info.value) == AUTH
+    assert api.listings == 1
+
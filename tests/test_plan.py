@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import json
+import os
+
+import pytest
+
+from conftest import files_under
+from icloudsync.plan import PlanWriter, human_bytes, read_plan
+from icloudsync.sync import sync_assets
+
+TEMPLATE = "{album}/{:%Y/%m}"
+
+
+def _plan(tmp_path, state, assets, name="plan.jsonl", **kw):
+    path = tmp_path / name
+    with open(path, "w", encoding="utf-8") as fh:
+        writer = PlanWriter(fh, "library", out_base=str(tmp_path / "out"), folder_template=TEMPLATE, versions=["original"], edits="original", previews_dir=None)
+        res = sync_assets(assets=iter(assets), out_base=str(tmp_path / "out"), folder_template=TEMPLATE, state=state, plan=writer, **kw)
+    return path, res
+
+
+def _records(path):
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+
+def test_plan_writes_nothing_and_lists_every_download(tmp_path, make_asset, state, source):
+    assets = [make_asset(i, album="A", size=1000 + i) for i in range(3)] + [make_asset(3, album="B")]
+    path, res = _plan(tmp_path, state, assets)
+
+    assert source.downloads == []
+    assert not (tmp_path / "out").exists() or files_under(tmp_path / "out") == set()
+    assert res["planned"] == 4 and res["bytes"] == 3003 and res["unknown_size"] == 1 and res["new"] == 4
+    records = _records(path)
+    assert "plan" in records[0] and "summary" in records[-1]
+    lines = records[1:-1]
+    assert {r["key"] for r in lines} == {"id0", "id1", "id2", "id3"}
+    assert all(r["reason"] == "new" and r["target"].startswith(str(tmp_path / "out")) for r in lines)
+    assert records[-1]["summary"]["albums"] == {"A": {"files": 3, "bytes": 3003}, "B": {"files": 1, "bytes": 0}}
+
+
+def test_apply_round_trip_downloads_exactly_the_plan(tmp_path, make_asset, state, source):
+    assets = [make_asset(i, album="A") for i in range(4)]
+    path, _ = _plan(tmp_path, state, assets)
+    ((header, jobs),) = read_plan(str(path))
+    only = {k: jobs[k] for k in ("id1", "id3")}
+
+    res = sync_assets(assets=iter(assets), out_base=header["out_base"], folder_template=header["folder_template"], state=state, only=only)
+
+    assert res["downloaded"] == 2
+    assert sorted(a for a, _ in source.downloads) == ["id1", "id3"]
+    assert {state.get(k).path for k in only} == set(only.values())
+
+
+def test_plan_after_sync_reports_moves_and_missing(tmp_path, make_asset, state):
+    out = tmp_path / "out"
+    assets = [make_asset(i, album="A") for i in range(3)]
+    sync_assets(assets=iter(assets), out_base=str(out), folder_template=TEMPLATE, state=state)
+    os.remove(state.get("id2").path)
+
+    path, res = _plan(tmp_path, state, [make_asset(0, album="A"), make_asset(1, album="Renombrado"), make_asset(2, album="A")])
+
+    assert res["planned"] == 2 and res["move"] == 1 and res["missing"] == 1
+    moved = next(r for r in _records(path) if r.get("reason") == "move")
+    assert moved["from"] == state.get("id1").path and "/Renombrado/" in moved["target"]
+
+
+def test_read_plan_sections_and_errors(tmp_path):
+    path = tmp_path / "plan.jsonl"
+    path.write_text(
+        '{"plan":{"source":"library"}}\n{"key":"a","target":"/x/a"}\n{"summary":{}}\n'
+        '{"plan":{"source":"shared"}}\n\n{"summary":{}}\n',
+        encoding="utf-8",
+    )
+    assert list(read_plan(str(path))) == [({"source": "library"}, {"a": "/x/a"}), ({"source": "shared"}, {})]
+
+    path.write_text('{"key":"a","target":"/x/a"}\n', encoding="utf-8")
+    with pytest.raises(ValueError, match="sin cabecera"):
+        list(read_plan(str(path)))
+    path.write_text('{"plan":{}}\nno es json\n', encoding="utf-8")
+    with pytest.raises(ValueError, match=":2: línea del plan inválida"):
+        list(read_plan(str(path)))
+
+
+@pytest.mark.parametrize("n, text", [(0, "0 B"), (1023, "1023 B"), (1536, "1.5 KB"), (5 * 1024**3, "5.0 GB")])
+def test_human_bytes(n, text):
+    assert human_bytes(n) == text
@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from icloudsync.planner import PathPlanner
+
+
+def _asset(created: datetime, album: str | None = None, asset_id: str = "x1") -> SimpleNamespace:
+    return SimpleNamespace(id=asset_id, created=created, album=album, extension="heic")
+
+
+@pytest.mark.parametrize(
+    "template, granularity",
+    [
+        ("{:%Y/%m}", "month"),
+        ("{album}/{:%Y}", "month"),
+        ("{album}", "month"),
+        ("{:%Y/%m/%d}", "day"),
+        ("{:%Y-%m-%d %H}", None),
+        ("{}", None),
+        ("{album}/{}", None),
+        ("{0}", None),
+        ("{!s}", None),
+        ("{0:%Y}/{0}", None),
+    ],
+)
+def test_granularity(template, granularity):
+    assert PathPlanner(template)._granularity == granularity
+
+
+@pytest.mark.parametrize("template", ["{}", "{album}/{}", "{!s}", "{:%Y/%H}"])
+def test_uncacheable_templates_render_each_timestamp(template):
+    planner = PathPlanner(template)
+    first = _asset(datetime(2024, 3, 1, 10, 0, 0), album="A")
+    second = _asset(datetime(2024, 3, 1, 11, 30, 0), album="A")
+
+    assert planner.folder(first) == template.format(first.created, album="A")
+    assert planner.folder(second) == template.format(second.created, album="A")
+    assert planner.folder(first) != planner.folder(second)
+
+
+def test_month_cache_is_per_album_and_month():
+    planner = PathPlanner("{album}/{:%Y/%m}")
+
+    assert planner.folder(_asset(datetime(2024, 3, 1), "A")) == "A/2024/03"
+    assert planner.folder(_asset(datetime(2024, 3, 31), "A")) == "A/2024/03"
+    assert planner.folder(_asset(datetime(2024, 3, 31), "B")) == "B/2024/03"
+    assert planner.folder(_asset(datetime(2024, 4, 1), "A")) == "A/2024/04"
+
+
+def test_target_name(tmp_path):
+    planner = PathPlanner("{:%Y/%m}")
+    target = planner.target(_asset(datetime(2024, 3, 1, 9, 8, 7), asset_id="AX/1"), str(tmp_path))
+
+    assert target == str(tmp_path / "2024" / "03" / "20240301_090807_AX_1.heic")
+
+
+@pytest.mark.parametrize("template", ["{year}/{:%m}", "{:%Y", "{0[1]}"])
+def test_invalid_templates_fail_on_creation(template):
+    with pytest.raises(ValueError, match="Plantilla de carpetas inválida"):
+        PathPlanner(template)
@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+import logging
+from types import SimpleNamespace
+
+import pytest
+
+from icloudsync import progress as progress_module
+from icloudsync.progress import RATE_WINDOW, Progress
+
+
+def _rates(progress: Progress, samples):
+    return [progress._rate(t, b) for t, b in samples]
+
+
+def test_rate_window_is_time_based_at_bar_refresh_rate():
+    progress = Progress({}, "library", mode="log")
+    # 1 MB/s durante 2 minutos y después 3 MB/s: al cabo de un minuto sólo cuenta lo nuevo
+    samples = [(t, t * 1_000_000) for t in range(121)]
+    samples += [(120 + t, 120_000_000 + t * 3_000_000) for t in range(1, 61)]
+    rates = _rates(progress, samples)
+
+    assert rates[120] == pytest.approx(1_000_000)
+    assert rates[-1] == pytest.approx(3_000_000)
+    assert samples[-1][0] - progress._samples[0][0] == RATE_WINDOW
+    assert len(progress._samples) <= RATE_WINDOW + 2
+
+
+@pytest.mark.parametrize("interval", [60.0, 300.0])
+def test_rate_in_log_mode_averages_last_interval(interval):
+    progress = Progress({}, "library", mode="log", interval=interval)
+    # Una muestra por intervalo: 1 MB/s en los dos primeros, 4 MB/s en el último
+    samples = [(0.0, 0), (interval, interval * 1e6), (2 * interval, 2 * interval * 1e6), (3 * interval, 6 * interval * 1e6)]
+    rates = _rates(progress, samples)
+
+    assert rates[1] == pytest.approx(1e6)
+    assert rates[-1] == pytest.approx(4e6)
+    assert len(progress._samples) == 2
+
+
+def test_log_line_reports_speed_and_eta(caplog, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(progress_module, "time", SimpleNamespace(monotonic=lambda: clock[0]))
+    counts = {"bytes": 0, "bytes_queued": 100 * 1024**2, "bytes_sized": 0, "listing_done": 1}
+    progress = Progress(counts, "library", mode="log")
+    progress._tick()
+    clock[0] += 10
+    counts.update(bytes=10 * 1024**2, bytes_sized=10 * 1024**2)
+
+    with caplog.at_level(logging.INFO, logger="icloudsync.progress"):
+        progress._tick()
+
+    assert "10.0 MB a 1.0 MB/s, ETA 1m30s" in caplog.records[-1].getMessage()
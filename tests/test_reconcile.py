@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import os
+
+from conftest import files_under
+from icloudsync.sync import sync_assets
+
+TEMPLATE = "{album}/{:%Y/%m}"
+
+
+class PartialListing(list):
+    # Como photos.Listing cuando algún asset o álbum no se pudo leer
+    errors = 1
+
+
+def _sync(out, state, assets, **kw):
+    return sync_assets(assets=assets, out_base=str(out), folder_template=TEMPLATE, state=state, concurrency=2, **kw)
+
+
+def test_renamed_album_moves_instead_of_downloading(tmp_path, make_asset, state, source):
+    out = tmp_path / "out"
+    _sync(out, state, [make_asset(i, album="Viaje") for i in range(3)])
+    source.downloads.clear()
+
+    res = _sync(out, state, [make_asset(i, album="Viaje 2024") for i in range(3)])
+
+    assert res["moved"] == 3 and res["downloaded"] == 0
+    assert source.downloads == []
+    assert all(p.startswith("Viaje 2024/") for p in files_under(out))
+    assert not (out / "Viaje").exists()  # carpetas vacías retiradas
+    assert all(e.path.startswith(str(out / "Viaje 2024")) for e in state.entries())
+
+
+def test_changed_remote_version_downloads_again(tmp_path, make_asset, state, source):
+    out = tmp_path / "out"
+    _sync(out, state, [make_asset(0, album="A", remote_version="v1")])
+    source.downloads.clear()
+
+    res = _sync(out, state, [make_asset(0, album="B", remote_version="v2")])
+
+    assert res["moved"] == 0 and res["downloaded"] == 1
+    assert source.downloads == [("id0", "original")]
+
+
+def test_remote_deletion_goes_to_quarantine(tmp_path, make_asset, state):
+    out = tmp_path / "out"
+    assets = [make_asset(i, album="A") for i in range(4)]
+    _sync(out, state, assets)
+    gone = state.get("id3").path
+
+    res = _sync(out, state, assets[:3], reconcile=True, full_listing=True)
+
+    assert res["removed"] == 1
+    assert state.get("id3") is None
+    assert len(files_under(out)) == 3
+    quarantined = out / ".quarantine" / os.path.relpath(gone, out)
+    assert quarantined.is_file()
+
+
+def test_reconcile_refuses_mass_disappearance(tmp_path, make_asset, state):
+    out = tmp_path / "out"
+    assets = [make_asset(i, album="A") for i in range(4)]
+    _sync(out, state, assets)
+
+    res = _sync(out, state, assets[:1], reconcile=True, full_listing=True)
+
+    assert res["removed"] == 0
+    assert len(files_under(out)) == 4 and len(state.entries()) == 4
+
+
+def test_partial_listing_skips_reconcile_and_seen_marks(tmp_path, make_asset, state):
+    out = tmp_path / "out"
+    assets = [make_asset(i, album="A") for i in range(4)]
+    _sync(out, state, assets, full_listing=True)
+    seen_before = {e.asset_id: e.seen_run for e in state.entries()}
+
+    res = _sync(out, state, PartialListing(assets[:3]), reconcile=True, full_listing=True, gc_runs=1)
+
+    assert res["removed"] == 0 and "forgotten" not in res
+    assert len(files_under(out)) == 4
+    assert {e.asset_id: e.seen_run for e in state.entries()} == seen_before
@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+import pytest
+
+from icloudsync import sync
+from icloudsync.sync import RETRY_MAX_DELAY, retry_delay, sync_assets
+
+
+class FlakySource:
+    # Falla las primeras `failures[id]` descargas de cada asset; registra cada intento
+    def __init__(self, failures: dict[str, int]) -> None:
+        self.failures = dict(failures)
+        self.attempts: list[str] = []
+
+    def download(self, asset, version="original"):
+        self.attempts.append(asset.id)
+        if self.failures.get(asset.id, 0) > 0:
+            self.failures[asset.id] -= 1
+            raise RuntimeError(f"fallo transitorio en {asset.id}")
+        yield asset.id.encode()
+
+
+@pytest.mark.parametrize("attempt, backoff, low, high", [(1, 2.0, 1.0, 2.0), (1, 10.0, 5.0, 10.0), (3, 2.0, 4.0, 8.0), (20, 2.0, RETRY_MAX_DELAY / 2, RETRY_MAX_DELAY)])
+def test_retry_delay_is_backoff_power_with_jitter(attempt, backoff, low, high):
+    delays = [retry_delay(attempt, backoff) for _ in range(200)]
+
+    assert all(low <= d <= high for d in delays)
+    assert len(set(delays)) > 1  # con jitter: una ráfaga de fallos no se reintenta a la vez
+
+
+def _sync(tmp_path, state, assets, **kw):
+    return sync_assets(assets=iter(assets), out_base=str(tmp_path / "out"), folder_template="{:%Y/%m}", state=state, concurrency=1, order="listing", **kw)
+
+
+def test_failed_download_waits_in_queue_without_blocking_others(tmp_path, make_asset, state):
+    source = FlakySource({"id0": 2})
+    assets = [make_asset(i, source=source) for i in range(5)]
+
+    res = _sync(tmp_path, state, assets, retry_backoff=0.05)
+
+    assert res["downloaded"] == 5 and res["retried"] == 2 and res["errors"] == 0
+    assert source.attempts[0] == "id0"
+    assert source.attempts[1:5] == ["id1", "id2", "id3", "id4"]
+    assert source.attempts[5:] == ["id0", "id0"]
+
+
+def test_retries_run_in_deadline_order(tmp_path, make_asset, state, monkeypatch):
+    # id0 falla antes pero con más espera: id1 se reintenta primero
+    delays = iter([0.3, 0.05])
+    monkeypatch.setattr(sync, "retry_delay", lambda attempt, backoff: next(delays))
+    source = FlakySource({"id0": 1, "id1": 1})
+
+    res = _sync(tmp_path, state, [make_asset(i, source=source) for i in range(2)])
+
+    assert res["downloaded"] == 2 and res["retried"] == 2
+    assert source.attempts == ["id0", "id1", "id1", "id0"]
+
+
+def test_exhausted_retries_record_failure(tmp_path, make_asset, state):
+    source = FlakySource({"id0": 10})
+
+    res = _sync(tmp_path, state, [make_asset(0, source=source)], retry_max=3, retry_backoff=0.01)
+
+    assert res["downloaded"] == 0 and res["retried"] == 2 and res["errors"] == 1
+    assert source.attempts == ["id0"] * 3
+    assert state.get("id0") is None
@@ -0,0 +1,52 @@
+from __future__ import annotations
+
+import pytest
+
+from conftest import files_under
+from icloudsync.sync import in_shard, parse_shard, sync_assets
+
+
+@pytest.mark.parametrize("spec, expected", [(None, None), ("", None), ("0/1", (0, 1)), ("3/4", (3, 4))])
+def test_parse_shard(spec, expected):
+    assert parse_shard(spec) == expected
+
+
+@pytest.mark.parametrize("spec", ["1", "a/b", "4/4", "-1/4", "0/0"])
+def test_parse_shard_rejects_invalid(spec):
+    with pytest.raises(ValueError, match="Shard inválido"):
+        parse_shard(spec)
+
+
+@pytest.mark.parametrize("shard_by", ["id", "month"])
+def test_shards_partition_without_overlap(make_asset, shard_by):
+    assets = [make_asset(i) for i in range(500)]
+    count = 4
+    owners = [[i for i in range(count) if in_shard(a, (i, count), shard_by)] for a in assets]
+
+    assert all(len(o) == 1 for o in owners)
+    assert all(any(o == [i] for o in owners) for i in range(count))
+
+
+def test_shard_by_month_keeps_months_together(make_asset):
+    assets = [make_asset(i) for i in range(200)]
+    by_month: dict[str, set[int]] = {}
+    for a in assets:
+        by_month.setdefault(f"{a.created:%Y%m}", set()).update(i for i in range(3) if in_shard(a, (i, 3), "month"))
+
+    assert all(len(owners) == 1 for owners in by_month.values())
+
+
+def test_shard_assignment_is_stable(make_asset):
+    # crc32, no hash(): el reparto no depende de PYTHONHASHSEED ni del proceso
+    expected = [0, 1, 1, 0, 1, 3]  # zlib.crc32(b"id<i>") % 5
+    assert [next(s for s in range(5) if in_shard(make_asset(i), (s, 5))) for i in range(6)] == expected
+
+
+def test_sharded_syncs_cover_everything_once(tmp_path, make_asset, state, source):
+    assets = [make_asset(i) for i in range(40)]
+    out = tmp_path / "out"
+    for i in range(3):
+        sync_assets(assets=iter(assets), out_base=str(out), folder_template="{:%Y/%m}", state=state, shard=(i, 3), concurrency=2)
+
+    assert sorted(asset_id for asset_id, _ in source.downloads) == sorted(a.id for a in assets)
+    assert len(files_under(out)) == len(assets)
@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import json
+
+from icloudsync.state import AssetEntry, StateDB, same_version
+from icloudsync.sync import sync_assets
+
+
+def _entry(key: str, tmp_path, scope: str = "/data", **kw) -> AssetEntry:
+    path = tmp_path / f"{key}.jpg"
+    path.write_bytes(b"x")
+    return AssetEntry(asset_id=key, path=str(path), size=1, scope=scope, **kw)
+
+
+def _run(state: StateDB, scope: str, seen: set[str]) -> int:
+    seq = state.record_run(scope, {}, complete=True)
+    state.mark_seen(scope, seen, seq)
+    return seq
+
+
+def test_entries_not_seen_for_n_complete_runs_are_stale(tmp_path, state):
+    for key in ("a", "b", "c"):
+        state.upsert(_entry(key, tmp_path))
+    _run(state, "/data", {"a", "b", "c"})
+    _run(state, "/data", {"a", "b"})
+    assert state.stale(2) == []
+    state.record_run("/data", {}, complete=False)  # listado parcial: no cuenta
+    assert state.stale(2) == []
+    _run(state, "/data", {"a"})
+
+    assert state.stale(2) == ["c"]
+    assert sorted(state.stale(1)) == ["b", "c"]
+    assert state.stale(0) == []
+
+
+def test_version_keys_follow_their_base_asset(tmp_path, state):
+    state.upsert(_entry("a", tmp_path))
+    state.upsert(_entry("a#thumb", tmp_path))
+    for _ in range(3):
+        _run(state, "/data", {"a"})
+
+    assert state.stale(1) == []
+
+
+def test_stale_is_per_scope(tmp_path, state):
+    state.upsert(_entry("a", tmp_path, scope="/data"))
+    state.upsert(_entry("b", tmp_path, scope="/data/Compartidos"))
+    _run(state, "/data", set())
+    _run(state, "/data", set())
+
+    assert state.stale(2) == ["a"]
+    assert state.stale(2, scope="/data/Compartidos") == []
+
+
+def test_check_files_forgets_deleted_files(tmp_path, state):
+    state.upsert(_entry("a", tmp_path))
+    state.upsert(_entry("b", tmp_path))
+    (tmp_path / "b.jpg").unlink()
+
+    assert state.gc(0, check_files=True, dry_run=True) == 1
+    assert len(state.entries()) == 2
+    assert state.gc(0, check_files=True) == 1
+    assert [e.asset_id for e in state.entries()] == ["a"]
+
+
+def test_save_compacts_and_drops_removed_entries(tmp_path, state):
+    for key in ("a", "b"):
+        state.upsert(_entry(key, tmp_path))
+    state.save()
+    state.remove("b")
+    state.save()
+
+    raw = json.loads(open(state.state_path, encoding="utf-8").read())
+    assert list(raw["assets"]) == ["a"]
+    assert "checksum" not in raw["assets"]["a"] and "derived" not in raw["assets"]["a"]  # sin valores por defecto
+    assert StateDB(state.state_path).get("a").size == 1
+
+
+def test_concurrent_writers_merge_on_save(tmp_path, state):
+    other = StateDB(state.state_path)
+    state.upsert(_entry("a", tmp_path))
+    other.upsert(_entry("b", tmp_path))
+    state.save()
+    other.save()
+
+    assert sorted(e.asset_id for e in StateDB(state.state_path).entries()) == ["a", "b"]
+
+
+def test_sync_gc_forgets_after_runs(tmp_path, make_asset, state):
+    out = str(tmp_path / "out")
+    assets = [make_asset(i) for i in range(6)]
+    for _ in range(2):
+        res = sync_assets(assets=iter(assets), out_base=out, folder_template="{:%Y/%m}", state=state, full_listing=True, gc_runs=2)
+    assert res.get("forgotten") == 0
+
+    for expected in (0, 1):
+        res = sync_assets(assets=iter(assets[1:]), out_base=out, folder_template="{:%Y/%m}", state=state, full_listing=True, gc_runs=2)
+        assert res["forgotten"] == expected
+    assert state.get("id0") is None and len(state.entries()) == 5
+
+
+def test_same_version_accepts_legacy_combined_tokens():
+    assert same_version("fp", "fp")
+    assert not same_version("fp", "fp2")
+    assert same_version("fp:efp:adj", "fp")
+    assert same_version("fp:efp:adj", "efp:adj")
+    assert not same_version("fp:efp:adj", "other")
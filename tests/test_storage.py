@@ -0,0 +1,54 @@
+from __future__ import annotations
+
+import pytest
+
+from icloudsync.storage import LocalStorage, Storage
+
+
+class Partial(Storage):
+    # Backend al que le falta remove()
+    def scope(self, root):
+        return root
+
+    def prepare(self, root, depth):
+        pass
+
+    def writer(self, path, mtime=None):
+        raise NotImplementedError
+
+    def reader(self, path):
+        raise NotImplementedError
+
+    def size(self, path):
+        return None
+
+    def replace(self, src, dst):
+        pass
+
+
+def test_incomplete_backend_fails_on_creation():
+    with pytest.raises(TypeError, match="remove"):
+        Partial()
+    with pytest.raises(TypeError):
+        Storage()
+
+
+def test_local_writer_is_atomic(tmp_path):
+    storage = LocalStorage()
+    path = str(tmp_path / "2024" / "IMG_1.HEIC")
+    with pytest.raises(RuntimeError):
+        with storage.writer(path) as out:
+            out.write(b"medio")
+            raise RuntimeError("descarga cortada")
+    assert storage.size(path) is None
+    assert not list(tmp_path.rglob("*.HEIC"))
+
+    with storage.writer(path) as out:
+        out.write(b"completo")
+    assert storage.size(path) == len(b"completo")
+
+    dst = str(tmp_path / "otro" / "IMG_1.HEIC")
+    storage.replace(path, dst)
+    assert storage.size(path) is None
+    with storage.reader(dst) as f:
+        assert f.read() == b"completo"
@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+import io
+
+import pytest
+
+from icloudsync.storage import S3Storage
+
+MIB = 1024 * 1024
+
+
+class NoSuchKey(Exception):
+    response = {"Error": {"Code": "404"}}
+
+
+class FakeS3:
+    # Cliente S3 en memoria con la parte de la API de boto3 que usa S3Storage; registra
+    # cada llamada para comprobar qué peticiones se hacen
+    def __init__(self) -> None:
+        self.objects: dict[tuple[str, str], bytes] = {}
+        self.metadata: dict[tuple[str, str], dict] = {}
+        self.uploads: dict[str, dict[int, bytes]] = {}
+        self.calls: list[str] = []
+        self.fail_part: int | None = None
+
+    def create_multipart_upload(self, Bucket, Key, Metadata):
+        self.calls.append("create_multipart_upload")
+        upload_id = f"u{len(self.uploads)}"
+        self.uploads[upload_id] = {}
+        self.metadata[(Bucket, Key)] = Metadata
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, PartNumber, UploadId, Body):
+        self.calls.append("upload_part")
+        if PartNumber == self.fail_part:
+            raise ConnectionError("conexión cortada")
+        self.uploads[UploadId][PartNumber] = Body
+        return {"ETag": f"etag-{PartNumber}"}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self.calls.append("complete_multipart_upload")
+        parts = self.uploads.pop(UploadId)
+        self.objects[(Bucket, Key)] = b"".join(parts[p["PartNumber"]] for p in MultipartUpload["Parts"])
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.calls.append("abort_multipart_upload")
+        del self.uploads[UploadId]
+
+    def put_object(self, Bucket, Key, Body, Metadata):
+        self.calls.append("put_object")
+        self.objects[(Bucket, Key)] = Body
+        self.metadata[(Bucket, Key)] = Metadata
+
+    def head_object(self, Bucket, Key):
+        self.calls.append("head_object")
+        if (Bucket, Key) not in self.objects:
+            raise NoSuchKey()
+        return {"ContentLength": len(self.objects[(Bucket, Key)])}
+
+    def get_object(self, Bucket, Key):
+        self.calls.append("get_object")
+        return {"Body": io.BytesIO(self.objects[(Bucket, Key)])}
+
+    def copy(self, CopySource, Bucket, Key):
+        self.calls.append("copy")
+        self.objects[(Bucket, Key)] = self.objects[(CopySource["Bucket"], CopySource["Key"])]
+
+    def delete_object(self, Bucket, Key):
+        self.calls.append("delete_object")
+        self.objects.pop((Bucket, Key), None)
+
+    def get_paginator(self, name):
+        assert name == "list_objects_v2"
+        return self
+
+    def paginate(self, Bucket, Prefix):
+        self.calls.append("list_objects_v2")
+        yield {"Contents": [{"Key": k, "Size": len(v)} for (b, k), v in self.objects.items() if b == Bucket and k.startswith(Prefix)]}
+
+
+@pytest.fixture
+def s3() -> FakeS3:
+    return FakeS3()
+
+
+@pytest.fixture
+def storage(s3) -> S3Storage:
+    return S3Storage(part_size=5 * MIB, client=s3)
+
+
+def _write(storage: S3Storage, path: str, data: bytes, chunk: int = 1 * MIB, mtime: float | None = None) -> None:
+    with storage.writer(path, mtime) as out:
+        for i in range(0, len(data), chunk):
+            out.write(data[i : i + chunk])
+
+
+def test_part_size_has_s3_minimum(s3):
+    assert S3Storage(part_size=1 * MIB, client=s3).part_size == 5 * MIB
+
+
+def test_small_object_single_put(storage, s3):
+    data = b"a" * (5 * MIB - 1)
+    _write(storage, "s3://fotos/2024/IMG_1.HEIC", data, mtime=1700000000.5)
+
+    assert s3.calls == ["put_object"]
+    assert s3.objects[("fotos", "2024/IMG_1.HEIC")] == data
+    assert s3.metadata[("fotos", "2024/IMG_1.HEIC")] == {"mtime": "1700000000"}
+    assert storage.size("s3://fotos/2024/IMG_1.HEIC") == len(data)
+    assert "head_object" not in s3.calls
+
+
+def test_multipart_with_shorter_last_part(storage, s3):
+    data = bytes(range(256)) * (12 * MIB // 256) + b"fin"
+    _write(storage, "s3://fotos/2024/VID_1.MOV", data)
+
+    assert s3.calls == ["create_multipart_upload", "upload_part", "upload_part", "upload_part", "complete_multipart_upload"]
+    assert s3.objects[("fotos", "2024/VID_1.MOV")] == data
+    assert not s3.uploads
+    assert storage.size("s3://fotos/2024/VID_1.MOV") == len(data)
+
+
+def test_failure_mid_stream_aborts_upload(storage, s3):
+    s3.fail_part = 2
+    with pytest.raises(ConnectionError):
+        _write(storage, "s3://fotos/2024/VID_2.MOV", b"b" * (12 * MIB))
+
+    assert s3.calls[-1] == "abort_multipart_upload"
+    assert "complete_multipart_upload" not in s3.calls
+    assert ("fotos", "2024/VID_2.MOV") not in s3.objects
+    assert not s3.uploads
+
+
+def test_error_in_caller_aborts_upload(storage, s3):
+    with pytest.raises(RuntimeError):
+        with storage.writer("s3://fotos/2024/VID_3.MOV") as out:
+            out.write(b"c" * (6 * MIB))
+            raise RuntimeError("descarga cortada")
+
+    assert s3.calls == ["create_multipart_upload", "upload_part", "abort_multipart_upload"]
+    assert ("fotos", "2024/VID_3.MOV") not in s3.objects
+
+
+def test_listed_prefix_answers_without_head(storage, s3):
+    s3.objects[("fotos", "lib/2024/IMG_1.HEIC")] = b"x" * 10
+    s3.objects[("fotos", "otro/IMG_2.HEIC")] = b"y" * 20
+    storage.prepare("s3://fotos/lib/", depth=2)
+    storage.prepare("s3://fotos/lib/2024", depth=1)  # ya cubierto por el listado anterior
+
+    assert storage.size("s3://fotos/lib/2024/IMG_1.HEIC") == 10
+    assert storage.size("s3://fotos/lib/2024/IMG_9.HEIC") is None
+    assert s3.calls == ["list_objects_v2"]
+
+
+def test_unlisted_path_falls_back_to_head(storage, s3):
+    s3.objects[("fotos", "otro/IMG_2.HEIC")] = b"y" * 20
+    storage.prepare("s3://fotos/lib", depth=2)
+
+    assert storage.size("s3://fotos/otro/IMG_2.HEIC") == 20
+    assert storage.size("s3://fotos/otro/IMG_3.HEIC") is None
+    assert s3.calls == ["list_objects_v2", "head_object", "head_object"]
+
+
+def test_head_errors_other_than_not_found_propagate(storage, s3):
+    def head_object(Bucket, Key):
+        raise PermissionError("403")
+
+    s3.head_object = head_object
+    with pytest.raises(PermissionError):
+        storage.size("s3://fotos/IMG_1.HEIC")
+
+
+def test_replace_is_copy_and_delete(storage, s3):
+    _write(storage, "s3://fotos/lib/IMG_1.HEIC", b"z" * 100)
+    s3.calls.clear()
+    storage.replace("s3://fotos/lib/IMG_1.HEIC", "s3://fotos/lib/2024/IMG_1.HEIC")
+
+    assert s3.calls == ["copy", "delete_object"]
+    assert s3.objects == {("fotos", "lib/2024/IMG_1.HEIC"): b"z" * 100}
+    assert storage.size("s3://fotos/lib/2024/IMG_1.HEIC") == 100
+    assert storage.size("s3://fotos/lib/IMG_1.HEIC") is None
+    assert s3.calls == ["copy", "delete_object", "head_object"]
@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import pytest
+
+from icloudsync import throttle
+from icloudsync.photos import METADATA_RETRIES, limit_metadata
+from icloudsync.throttle import TokenBucket
+
+
+class Clock:
+    # Sustituye al módulo time de throttle: sleep avanza el reloj en lugar de esperar
+    def __init__(self) -> None:
+        self.now = 1000.0
+        self.slept: list[float] = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(throttle, "time", clock)
+    return clock
+
+
+def test_consume_waits_once_burst_is_spent(clock):
+    bucket = TokenBucket(2.0)
+    bucket.consume()
+    bucket.consume()
+    assert clock.slept == []
+
+    bucket.consume()
+    assert clock.slept == [0.5]
+
+
+def test_refill_is_capped_and_large_requests_go_negative(clock):
+    bucket = TokenBucket(2.0)
+    clock.now += 100  # el saldo no pasa de la capacidad
+    bucket.consume(3)
+    assert clock.slept == [0.5]
+
+
+def test_pause_holds_every_caller_without_stacking(clock):
+    bucket = TokenBucket(2.0)
+    bucket.pause(3)
+    bucket.pause(3)  # el mismo 429 visto por otro hilo
+    bucket.consume()
+    assert clock.slept == [3.5]
+
+    # Tras la pausa sigue al ritmo nominal, sin la ráfaga acumulada
+    bucket.consume()
+    assert clock.slept == [3.5, 0.5]
+
+
+class Response:
+    def __init__(self, status_code: int, retry_after: str | None = None) -> None:
+        self.status_code = status_code
+        self.headers = {"Retry-After": retry_after} if retry_after is not None else {}
+        self.closed = False
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class Session:
+    # Sesión de requests con respuestas programadas
+    def __init__(self, *responses: Response) -> None:
+        self.responses = list(responses)
+        self.sent: list[dict] = []
+
+    def send(self, request, **kwargs):
+        self.sent.append(kwargs)
+        return self.responses.pop(0)
+
+
+class Bucket:
+    def __init__(self) -> None:
+        self.consumed = 0
+        self.pauses: list[float] = []
+
+    def consume(self, amount: float = 1.0) -> None:
+        self.consumed += 1
+
+    def pause(self, seconds: float) -> None:
+        self.pauses.append(seconds)
+
+
+def test_throttled_metadata_pauses_for_retry_after(caplog):
+    limited = Response(429, retry_after="7")
+    session = Session(limited, Response(200))
+    bucket = Bucket()
+    limit_metadata(session, bucket)
+
+    assert session.send("GET /records").status_code == 200
+    assert bucket.pauses == [7.0]
+    assert bucket.consumed == 2
+    assert limited.closed
+    assert "pausa de 7s" in caplog.text
+
+
+def test_throttled_metadata_gives_up_after_retries():
+    session = Session(*(Response(503) for _ in range(METADATA_RETRIES + 2)))
+    bucket = Bucket()
+    limit_metadata(session, bucket)
+
+    resp = session.send("GET /records")
+
+    assert resp.status_code == 503 and not resp.closed
+    assert len(session.sent) == METADATA_RETRIES + 1
+    assert bucket.pauses == [30.0 * n for n in range(1, METADATA_RETRIES + 1)]  # sin Retry-After
+
+
+def test_downloads_bypass_metadata_bucket():
+    session = Session(Response(429, retry_after="7"))
+    bucket = Bucket()
+    limit_metadata(session, bucket)
+
+    assert session.send("GET /photo", stream=True).status_code == 429
+    assert bucket.consumed == 0 and bucket.pauses == []
+
+
+def test_limit_metadata_wraps_send_once():
+    session = Session(Response(200))
+    first, second = Bucket(), Bucket()
+    limit_metadata(session, first)
+    limit_metadata(session, second)  # otra cuenta/comando con la misma sesión
+
+    session.send("GET /records")
+    assert (first.consumed, second.consumed) == (0, 1)